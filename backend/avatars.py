@@ -0,0 +1,122 @@
+"""
+Avatar thumbnails
+-------------------
+`profile_photo` is usually a 100-500 KB base64 data URI. Whenever it changes,
+a fixed-size JPEG thumbnail is written to the blob store, and `users.avatar`
+records it as {'sha256', 'version'}. Photos that are already URLs (Google
+sign-in, CDN) are recorded as {'url', 'version'}, and list responses link
+them directly (the endpoint never redirects to them). List responses
+(conversations, search, blocked users) read only `avatar` and carry an
+`avatar_url` plus `avatar_version`. Browsers then fetch the image from
+`GET /api/users/{id}/avatar` and cache it by ETag. The URL is absolute
+(MEDIA_BASE_URL, or the origin of the request) so it also works when the
+frontend is served from another origin.
+
+Only raster images that Pillow can decode become avatars, always re-encoded
+as JPEG: the endpoint is unauthenticated and on the API origin, so uploaded
+bytes (SVG, HTML) are never served as they came. Without Pillow no
+thumbnails are built and clients show initials.
+
+Tuning (backend/.env):
+  AVATAR_SIZE=128   # thumbnail edge in pixels
+"""
+
+import os
+import io
+import asyncio
+import re
+import hashlib
+import logging
+from typing import Optional, Tuple
+from urllib.parse import urlparse
+
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+from blob_store import blob_store, parse_data_uri
+
+logger = logging.getLogger(__name__)
+
+AVATAR_SIZE = int(os.getenv('AVATAR_SIZE', '128'))
+AVATAR_QUALITY = 85
+# Version advertised for users whose avatar has not been built yet; the endpoint builds it
+UNBUILT_VERSION = '0'
+
+
+_AVATAR_PATH_RE = re.compile(r'/api/users/([^/]+)/avatar/?$')
+
+
+def avatar_url(user_id: str, version: str, base_url: str = '') -> str:
+    return f"{base_url}/api/users/{user_id}/avatar?v={version}"
+
+
+def avatar_owner(url: Optional[str]) -> Optional[str]:
+    """The user id when `url` (absolute or a path) points at an avatar endpoint, else None."""
+    match = _AVATAR_PATH_RE.search(urlparse(url or '').path)
+    return match.group(1) if match else None
+
+
+def make_thumbnail(data: bytes, size: int = AVATAR_SIZE) -> bytes:
+    """Square, centre-cropped JPEG of an image."""
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        thumb = ImageOps.fit(img.convert('RGB'), (size, size), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    thumb.save(out, 'JPEG', quality=AVATAR_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def _thumbnail_of(photo: str) -> Optional[Tuple[bytes, str]]:
+    parsed = parse_data_uri(photo)
+    if parsed is None or not PIL_AVAILABLE:
+        return None
+    mime_type, data = parsed
+    if not mime_type.lower().startswith('image/') or 'svg' in mime_type.lower():
+        return None
+    try:
+        return make_thumbnail(data), 'image/jpeg'
+    except Exception as e:
+        logger.warning(f"Avatar thumbnail failed, no avatar stored: {e}")
+        return None
+
+
+async def build_avatar(profile_photo: Optional[str]) -> Optional[dict]:
+    """The `avatar` field for a profile photo: a thumbnail blob, an external URL, or None."""
+    photo = profile_photo or ''
+    if photo.startswith(('http://', 'https://')):
+        if avatar_owner(photo):
+            # Our own avatar endpoint would redirect to itself
+            return None
+        return {'url': photo, 'version': hashlib.sha256(photo.encode()).hexdigest()[:12]}
+    thumb = await asyncio.to_thread(_thumbnail_of, photo)
+    if thumb is None:
+        return None
+    sha256 = await blob_store.put_bytes(*thumb)
+    return {'sha256': sha256, 'version': sha256[:12]}
+
+
+async def refresh_avatar(users, user_id: str) -> Optional[dict]:
+    """(Re)build and store a user's avatar from their current profile_photo."""
+    doc = await users.find_one({'user_id': user_id}, {'_id': 0, 'profile_photo': 1})
+    avatar = await build_avatar((doc or {}).get('profile_photo'))
+    await users.update_one({'user_id': user_id}, {'$set': {'avatar': avatar}})
+    return avatar
+
+
+def list_avatar(user: dict, base_url: str = '') -> dict:
+    """Replace the stored `avatar` with what list responses carry (in place); see request_base_url."""
+    if 'avatar' in user:
+        avatar = user.pop('avatar') or {}
+        version = avatar.get('version')
+        url = avatar.get('url') or (avatar_url(user['user_id'], version, base_url) if version else '')
+    else:
+        version = UNBUILT_VERSION
+        url = avatar_url(user['user_id'], version, base_url)
+    user['avatar_url'] = url
+    user['avatar_version'] = version
+    # Existing clients use profile_photo as an <img> src, where a URL works as well
+    user['profile_photo'] = url
+    return user
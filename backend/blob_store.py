@@ -0,0 +1,256 @@
+"""
+Content-addressed blob store
+------------------------------
+Attachment bytes are written to disk under BLOB_DIR, named by their SHA-256,
+and messages keep only that hash in their `blob` field. Attachments that
+arrive as plain data URIs go here when Cloudinary is not configured.
+End-to-end encrypted attachments (NaCl ciphertext the server cannot read)
+always go here, as opaque bytes that the client decrypts after download.
+The download URL is built when a message is read (`blob_url`), from
+MEDIA_BASE_URL or the origin of the request, so it is never baked into
+stored content. Identical bytes, such as a forwarded photo or the same file
+sent twice, are stored once. A small `blobs` document per hash
+records the MIME type for the download endpoint. That endpoint serves byte
+ranges, so video can seek without fetching the whole file. Decoding, hashing
+and disk I/O all run in worker threads.
+
+Tuning (backend/.env):
+  BLOB_DIR=./media/blobs   # put this on a shared volume when running several nodes
+  MEDIA_BASE_URL=          # public origin of the API, e.g. https://api.example.com;
+                           # empty = the origin each request came in on
+"""
+
+import os
+import re
+import base64
+import shutil
+import asyncio
+import hashlib
+import logging
+import binascii
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+BLOB_DIR = Path(os.getenv('BLOB_DIR', str(Path(os.getenv('MEDIA_DIR', str(ROOT_DIR / 'media'))) / 'blobs')))
+MEDIA_BASE_URL = os.getenv('MEDIA_BASE_URL', '').rstrip('/')
+BLOB_READ_CHUNK = 256 * 1024
+
+_SHA_RE = re.compile(r'^[0-9a-f]{64}$')
+_BLOB_URL_RE = re.compile(r'/api/blobs/([0-9a-f]{64})$')
+_DATA_URI_RE = re.compile(r'^data:([^;,]*)(?:;[^;,]*)*?;base64,', re.IGNORECASE)
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested byte range starts past the end of the blob."""
+
+
+def request_base_url(request) -> str:
+    """Origin clients reach the API on: MEDIA_BASE_URL, or the one this request used."""
+    return MEDIA_BASE_URL or str(request.base_url).rstrip('/')
+
+
+def environ_base_url(environ: Optional[dict]) -> str:
+    """request_base_url for a Socket.IO connection, from its handshake environ."""
+    if MEDIA_BASE_URL or not environ or not environ.get('HTTP_HOST'):
+        return MEDIA_BASE_URL
+    scope = environ.get('asgi.scope') or {}
+    scheme = environ.get('HTTP_X_FORWARDED_PROTO') or ('https' if scope.get('scheme') in ('https', 'wss') else 'http')
+    return f"{scheme}://{environ['HTTP_HOST']}{scope.get('root_path', '')}"
+
+
+def blob_path(sha256: str) -> str:
+    return f"/api/blobs/{sha256}"
+
+
+def blob_url(sha256: str, base_url: str = '') -> str:
+    return f"{base_url}{blob_path(sha256)}"
+
+
+def with_blob_url(message: dict, base_url: str) -> dict:
+    """Add the download URL of a message's blob (in place); built per read, never stored."""
+    if message.get('blob'):
+        message['blob_url'] = blob_url(message['blob'], base_url)
+    return message
+
+
+def blob_ref(content: Optional[str]) -> Optional[str]:
+    """The hash a blob URL or path points at (uploads, and messages from before `blob` held it)."""
+    match = _BLOB_URL_RE.search(content or '')
+    return match.group(1) if match else None
+
+
+def parse_data_uri(content: str) -> Optional[Tuple[str, bytes]]:
+    """(mime_type, bytes) of a base64 data URI, or None if `content` is not one."""
+    match = _DATA_URI_RE.match(content)
+    if not match:
+        return None
+    try:
+        data = base64.b64decode(content[match.end():])
+    except (binascii.Error, ValueError):
+        return None
+    return (match.group(1) or 'application/octet-stream').lower(), data
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Resolve a single `Range: bytes=...` header to an inclusive (start, end).
+    Returns None when the whole body should be sent (no header, or one we do
+    not handle such as multiple ranges).
+    """
+    match = _RANGE_RE.match((header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_file(path: Path, start: int, end: int, chunk: int = BLOB_READ_CHUNK) -> Iterator[bytes]:
+    """Bytes start..end (inclusive). A plain generator: StreamingResponse iterates it in a thread."""
+    remaining = end - start + 1
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while remaining > 0:
+            block = f.read(min(chunk, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def _file_size(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return None
+
+
+class BlobStore:
+    def __init__(self, root: Path = BLOB_DIR, collection=None):
+        self.root = Path(root)
+        self.collection = collection
+        self.stats = {'stored': 0, 'deduplicated': 0, 'bytes_stored': 0, 'bytes_deduplicated': 0}
+
+    def path(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def _commit(self, src: Path, sha256: str) -> bool:
+        """Move a finished temp file into place. False if the blob already existed."""
+        dest = self.path(sha256)
+        if dest.exists():
+            src.unlink()
+            return False
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(src, dest)
+        except OSError:
+            # Spool and blob dir on different filesystems: copy next to the target, then rename
+            fd, tmp = tempfile.mkstemp(dir=dest.parent, suffix='.tmp')
+            os.close(fd)
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, dest)
+            src.unlink()
+        return True
+
+    def _write_bytes(self, data: bytes) -> Tuple[str, bool]:
+        sha256 = hashlib.sha256(data).hexdigest()
+        if self.path(sha256).exists():
+            return sha256, False
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return sha256, self._commit(Path(tmp), sha256)
+
+    def _adopt_file(self, src: Path) -> Tuple[str, int, bool]:
+        digest = hashlib.sha256()
+        size = 0
+        with open(src, 'rb') as f:
+            for block in iter(lambda: f.read(BLOB_READ_CHUNK), b''):
+                digest.update(block)
+                size += len(block)
+        sha256 = digest.hexdigest()
+        return sha256, size, self._commit(src, sha256)
+
+    def _store_data_uri(self, content: str) -> Optional[Tuple[str, int, str, bool]]:
+        parsed = parse_data_uri(content)
+        if parsed is None:
+            return None
+        mime_type, data = parsed
+        sha256, created = self._write_bytes(data)
+        return sha256, len(data), mime_type, created
+
+    async def _record(self, sha256: str, size: int, mime_type: str, created: bool) -> str:
+        if created:
+            self.stats['stored'] += 1
+            self.stats['bytes_stored'] += size
+        else:
+            self.stats['deduplicated'] += 1
+            self.stats['bytes_deduplicated'] += size
+        if self.collection is not None:
+            await self.collection.update_one(
+                {'sha256': sha256},
+                {'$setOnInsert': {
+                    'sha256': sha256,
+                    'size': size,
+                    'mime_type': mime_type,
+                    'created_at': datetime.now(timezone.utc).isoformat(),
+                }},
+                upsert=True
+            )
+        return sha256
+
+    async def put_bytes(self, data: bytes, mime_type: str) -> str:
+        """Store bytes and return their SHA-256."""
+        sha256, created = await asyncio.to_thread(self._write_bytes, data)
+        return await self._record(sha256, len(data), mime_type, created)
+
+    async def put_file(self, path: Path, mime_type: str) -> str:
+        """Take ownership of a file on disk (it is moved, or deleted if the blob already exists)."""
+        sha256, size, created = await asyncio.to_thread(self._adopt_file, Path(path))
+        return await self._record(sha256, size, mime_type, created)
+
+    async def put_data_uri(self, content: str) -> Optional[str]:
+        """Store the bytes of a base64 data URI and return their SHA-256. None if `content` is not one."""
+        stored = await asyncio.to_thread(self._store_data_uri, content)
+        if stored is None:
+            return None
+        return await self._record(*stored)
+
+    async def info(self, sha256: str) -> Optional[dict]:
+        """Where a blob is and how to serve it, or None if it does not exist."""
+        if not _SHA_RE.match(sha256):
+            return None
+        path = self.path(sha256)
+        size = await asyncio.to_thread(_file_size, path)
+        if size is None:
+            return None
+        meta = None
+        if self.collection is not None:
+            meta = await self.collection.find_one({'sha256': sha256}, {'_id': 0, 'mime_type': 1})
+        return {
+            'sha256': sha256,
+            'path': path,
+            'size': size,
+            'mime_type': (meta or {}).get('mime_type') or 'application/octet-stream',
+        }
+
+
+blob_store = BlobStore(BLOB_DIR, db.blobs)
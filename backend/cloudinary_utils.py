@@ -8,9 +8,13 @@ To enable: Add to backend/.env:
   CLOUDINARY_CLOUD_NAME=your_cloud_name
   CLOUDINARY_API_KEY=your_api_key
   CLOUDINARY_API_SECRET=your_api_secret
+
+Uploads run in a worker thread (`asyncio.to_thread`): the Cloudinary SDK is
+blocking and a large upload would otherwise stall every socket on the loop.
 """
 
 import os
+import asyncio
 import base64
 import mimetypes
 from io import BytesIO
@@ -61,6 +65,39 @@ def _get_resource_type(mime_type: str) -> str:
         return "raw"
 
 
+def _upload_kwargs(resource_type: str, file_name: Optional[str], folder: str) -> dict:
+    # Determine public_id from filename for meaningful URLs
+    public_id = None
+    if file_name:
+        # Strip extension — Cloudinary adds it automatically
+        name_without_ext = file_name.rsplit(".", 1)[0] if "." in file_name else file_name
+        public_id = f"{folder}/{name_without_ext}"
+
+    upload_kwargs = {
+        "resource_type": resource_type,
+        "folder": folder if not public_id else None,
+        "public_id": public_id,
+        "use_filename": True if not public_id else False,
+        "unique_filename": True,
+    }
+    # Remove None values to avoid API errors
+    return {k: v for k, v in upload_kwargs.items() if v is not None}
+
+
+def _upload_data_uri(data_uri: str, file_name: Optional[str], folder: str) -> Optional[str]:
+    raw_bytes, mime_type = _data_uri_to_bytes(data_uri)
+    kwargs = _upload_kwargs(_get_resource_type(mime_type), file_name, folder)
+    result = cloudinary.uploader.upload(BytesIO(raw_bytes), **kwargs)
+    return result.get("secure_url")
+
+
+def _upload_path(path: str, mime_type: str, file_name: Optional[str], folder: str) -> Optional[str]:
+    kwargs = _upload_kwargs(_get_resource_type(mime_type), file_name, folder)
+    # upload_large sends the file in 20 MB parts instead of one request
+    result = cloudinary.uploader.upload_large(path, **kwargs)
+    return result.get("secure_url")
+
+
 async def upload_to_cdn(
     data_uri: str,
     file_name: Optional[str] = None,
@@ -77,33 +114,32 @@ async def upload_to_cdn(
         return None
     
     try:
-        raw_bytes, mime_type = _data_uri_to_bytes(data_uri)
-        resource_type = _get_resource_type(mime_type)
-        
-        # Determine public_id from filename for meaningful URLs
-        public_id = None
-        if file_name:
-            # Strip extension — Cloudinary adds it automatically
-            name_without_ext = file_name.rsplit(".", 1)[0] if "." in file_name else file_name
-            public_id = f"{folder}/{name_without_ext}"
-        
-        upload_kwargs = {
-            "resource_type": resource_type,
-            "folder": folder if not public_id else None,
-            "public_id": public_id,
-            "use_filename": True if not public_id else False,
-            "unique_filename": True,
-        }
-        # Remove None values to avoid API errors
-        upload_kwargs = {k: v for k, v in upload_kwargs.items() if v is not None}
-        
-        result = cloudinary.uploader.upload(BytesIO(raw_bytes), **upload_kwargs)
-        return result.get("secure_url")
+        return await asyncio.to_thread(_upload_data_uri, data_uri, file_name, folder)
     except Exception as e:
         print(f"[Cloudinary] Upload failed: {e}. Falling back to data URI.")
         return None
 
 
+async def upload_file_to_cdn(
+    path: str,
+    mime_type: str,
+    file_name: Optional[str] = None,
+    folder: str = "quickchat_media"
+) -> Optional[str]:
+    """
+    Upload a file already on disk (e.g. a finished resumable upload) to Cloudinary.
+    Returns the secure URL, or None if the CDN is not configured or the upload fails.
+    """
+    if not CDN_ENABLED:
+        return None
+
+    try:
+        return await asyncio.to_thread(_upload_path, path, mime_type, file_name, folder)
+    except Exception as e:
+        print(f"[Cloudinary] Upload failed: {e}.")
+        return None
+
+
 def is_cdn_enabled() -> bool:
     """Return whether Cloudinary CDN is enabled."""
     return CDN_ENABLED
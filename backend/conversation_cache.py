@@ -0,0 +1,57 @@
+"""
+Conversation membership cache
+-------------------------------
+The send path only needs a conversation's participants, yet used to load the
+whole document on every message. This keeps `{conversation_id, type,
+participants}` in a bounded LRU with a short TTL. Routers that change
+membership (create, delete, account deletion) invalidate it explicitly; the
+TTL bounds staleness on other workers.
+
+Tuning (backend/.env):
+  CONVERSATION_CACHE_SIZE=50000
+  CONVERSATION_CACHE_TTL=30
+"""
+
+import os
+from typing import Optional
+
+from cache import TTLCache
+from database import db
+
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', '50000'))
+CONVERSATION_CACHE_TTL = float(os.getenv('CONVERSATION_CACHE_TTL', '30'))
+
+_MEMBERSHIP_PROJECTION = {'_id': 0, 'conversation_id': 1, 'type': 1, 'participants': 1}
+
+
+class ConversationCache:
+    def __init__(self, collection, maxsize: int = CONVERSATION_CACHE_SIZE, ttl: float = CONVERSATION_CACHE_TTL):
+        self.collection = collection
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get(self, conversation_id: str) -> Optional[dict]:
+        """Return {conversation_id, type, participants} or None if the conversation does not exist."""
+        conv = self._cache.get(conversation_id)
+        if conv is None:
+            conv = await self.collection.find_one({'conversation_id': conversation_id}, _MEMBERSHIP_PROJECTION)
+            if conv is None:
+                return None
+            self._cache.set(conversation_id, conv)
+        return conv
+
+    async def is_participant(self, conversation_id: str, user_id: str) -> bool:
+        conv = await self.get(conversation_id)
+        return bool(conv) and user_id in conv.get('participants', [])
+
+    def invalidate(self, conversation_id: str):
+        self._cache.pop(conversation_id)
+
+    def invalidate_user(self, user_id: str):
+        """Drop every cached conversation a user belongs to (account deletion)."""
+        self._cache.pop_where(lambda _, conv: user_id in conv.get('participants', []))
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+conversation_cache = ConversationCache(db.conversations)
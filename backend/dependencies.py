@@ -1,8 +1,12 @@
+import copy
+import os
+import time
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from database import db
 from utils import SECRET_KEY, ALGORITHM
+from cache import TTLCache
 
 security = HTTPBearer()
 
@@ -15,22 +19,52 @@ _USER_AUTH_PROJECTION = {
     'password_hash': 0,
 }
 
+# Principal cache: {user_id: user dict}. Short TTL bounds staleness on other workers;
+# writes to the user document on this worker call invalidate_principal().
+PRINCIPAL_CACHE_TTL = float(os.getenv('PRINCIPAL_CACHE_TTL', '15'))
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', '20000'))
+
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+# Decoded JWT payloads, each kept until the token's own `exp`.
+token_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=0)
+
+
+def decode_token(token: str) -> dict:
+    """Verify and decode an access token, reusing the result until the token expires."""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        remaining = payload.get('exp', 0) - time.time()
+        if remaining > 0:
+            token_cache.set(token, payload, ttl=remaining)
+    return payload
+
+
+def invalidate_principal(user_id: str):
+    """Forget the cached user dict after the user document changes."""
+    principal_cache.pop(user_id)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         user_id = payload.get('sub')
         if not user_id:
             raise HTTPException(status_code=401, detail='Invalid token')
-        
-        user = await db.users.find_one({'user_id': user_id}, _USER_AUTH_PROJECTION)
-        if not user:
-            raise HTTPException(status_code=401, detail='User not found')
-        
-        if 'blocked_users' not in user:
-            user['blocked_users'] = []
-            
-        return user
+
+        user = principal_cache.get(user_id)
+        if user is None:
+            user = await db.users.find_one({'user_id': user_id}, _USER_AUTH_PROJECTION)
+            if not user:
+                raise HTTPException(status_code=401, detail='User not found')
+
+            if 'blocked_users' not in user:
+                user['blocked_users'] = []
+            principal_cache.set(user_id, user)
+
+        # Deep copy so handlers can't mutate the cached entry, nested lists like blocked_users included
+        return copy.deepcopy(user)
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail='Invalid token')
     except HTTPException:
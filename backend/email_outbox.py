@@ -0,0 +1,251 @@
+"""
+Durable email outbox
+----------------------
+Handlers call `await email_outbox.enqueue(...)`, which only inserts a document
+into the `email_outbox` collection and wakes the sender, so a request never
+waits on SMTP. One sender task per process claims due emails in batches and
+delivers them over a single SMTP connection that stays open between batches
+(the blocking SMTP conversation runs in a worker thread).
+
+Claiming pushes `next_attempt_at` forward by a lease, so an email claimed by a
+process that dies is picked up again once the lease runs out, by any node.
+Failures are retried with exponential back-off; after EMAIL_MAX_ATTEMPTS an
+email is left in the collection with status 'failed' for inspection.
+
+Tuning (backend/.env):
+  SMTP_HOST=smtp.gmail.com  SMTP_PORT=465   # implicit TLS; SMTP_STARTTLS=true for 587
+  EMAIL_BATCH_MAX=20           # emails claimed per round
+  EMAIL_MAX_ATTEMPTS=5
+  EMAIL_IDLE_CLOSE_SECONDS=60  # close the SMTP connection after this long unused
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import smtplib
+from collections import deque
+from datetime import datetime, timezone
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+
+from database import db
+from ids import new_id
+from utils import GMAIL_EMAIL, GMAIL_PASSWORD, SENDER_EMAIL
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '465'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'false').lower() == 'true'
+SMTP_TIMEOUT_SECONDS = float(os.getenv('SMTP_TIMEOUT_SECONDS', '15'))
+EMAIL_BATCH_MAX = int(os.getenv('EMAIL_BATCH_MAX', '20'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', '5'))
+EMAIL_LEASE_SECONDS = float(os.getenv('EMAIL_LEASE_SECONDS', '120'))
+EMAIL_POLL_SECONDS = float(os.getenv('EMAIL_POLL_SECONDS', '5'))
+EMAIL_IDLE_CLOSE_SECONDS = float(os.getenv('EMAIL_IDLE_CLOSE_SECONDS', '60'))
+
+
+def smtp_connect():
+    """Open and authenticate an SMTP connection (blocking; called from a worker thread)."""
+    if SMTP_STARTTLS:
+        conn = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+        conn.starttls()
+    else:
+        conn = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_SECONDS)
+    if GMAIL_EMAIL:
+        conn.login(GMAIL_EMAIL, GMAIL_PASSWORD)
+    return conn
+
+
+def build_message(to_email: str, subject: str, html_content: str) -> str:
+    message = MIMEMultipart('alternative')
+    message['Subject'] = subject
+    message['From'] = SENDER_EMAIL
+    message['To'] = to_email
+    message.attach(MIMEText(html_content, 'html'))
+    return message.as_string()
+
+
+class EmailOutbox:
+    def __init__(self, collection, connect=smtp_connect, batch_max: int = EMAIL_BATCH_MAX,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, retry_base: float = EMAIL_RETRY_BASE_SECONDS,
+                 lease: float = EMAIL_LEASE_SECONDS, poll: float = EMAIL_POLL_SECONDS,
+                 idle_close: float = EMAIL_IDLE_CLOSE_SECONDS):
+        self.collection = collection
+        self.connect = connect
+        self.batch_max = batch_max
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.poll = poll
+        self.idle_close = idle_close
+        self._smtp = None
+        self._last_used = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._latencies = deque(maxlen=1000)
+        self.counters = {'enqueued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'connections': 0, 'batches': 0}
+
+    async def enqueue(self, to_email: str, subject: str, html_content: str) -> str:
+        """Persist an email for delivery and return its outbox id."""
+        now = time.time()
+        outbox_id = new_id('mail')
+        await self.collection.insert_one({
+            'outbox_id': outbox_id,
+            'to': to_email,
+            'subject': subject,
+            'html': html_content,
+            'status': 'pending',
+            'attempts': 0,
+            'enqueued_at': now,
+            'next_attempt_at': now,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        })
+        self.counters['enqueued'] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return outbox_id
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._wakeup = None
+        if self._smtp is not None:
+            await asyncio.to_thread(self._close_smtp)
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.process_due()
+            except Exception as e:
+                logger.error(f"Email outbox round failed: {e}")
+                sent = 0
+            if sent:
+                continue
+            if self._smtp is not None and time.monotonic() - self._last_used > self.idle_close:
+                await asyncio.to_thread(self._close_smtp)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> List[dict]:
+        now = time.time()
+        batch = []
+        while len(batch) < self.batch_max:
+            doc = await self.collection.find_one_and_update(
+                {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                {'$set': {'next_attempt_at': now + self.lease}, '$inc': {'attempts': 1}},
+                sort=[('next_attempt_at', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None:
+                break
+            batch.append(doc)
+        return batch
+
+    async def process_due(self) -> int:
+        """Deliver one batch of due emails; returns how many were claimed."""
+        batch = await self._claim()
+        if not batch:
+            return 0
+        self.counters['batches'] += 1
+        errors = await asyncio.to_thread(self._send_batch, batch)
+        now = time.time()
+        sent_ids = []
+        for doc, error in zip(batch, errors):
+            if error is None:
+                self.counters['sent'] += 1
+                self._latencies.append(now - doc['enqueued_at'])
+                sent_ids.append(doc['outbox_id'])
+            elif doc['attempts'] >= self.max_attempts:
+                self.counters['failed'] += 1
+                logger.error(f"Email to {doc['to']} failed permanently: {error}")
+                await self.collection.update_one(
+                    {'outbox_id': doc['outbox_id']},
+                    {'$set': {'status': 'failed', 'last_error': error}}
+                )
+            else:
+                self.counters['retried'] += 1
+                delay = self.retry_base * (2 ** (doc['attempts'] - 1)) * (1 + random.random() / 2)
+                await self.collection.update_one(
+                    {'outbox_id': doc['outbox_id']},
+                    {'$set': {'next_attempt_at': now + delay, 'last_error': error}}
+                )
+        if sent_ids:
+            await self.collection.delete_many({'outbox_id': {'$in': sent_ids}})
+        return len(batch)
+
+    def _send_batch(self, batch: List[dict]) -> List[Optional[str]]:
+        """Blocking: send every email over the shared connection, reconnecting once if it dropped."""
+        errors: List[Optional[str]] = []
+        for doc in batch:
+            raw = build_message(doc['to'], doc['subject'], doc['html'])
+            error = None
+            for _ in range(2):
+                if self._smtp is None:
+                    try:
+                        self._smtp = self.connect()
+                        self.counters['connections'] += 1
+                    except (smtplib.SMTPException, OSError) as e:
+                        error = f"connect: {e}"
+                        break
+                try:
+                    self._smtp.sendmail(SENDER_EMAIL, [doc['to']], raw)
+                    error = None
+                    break
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # Stale pooled connection: drop it and retry once on a fresh one
+                    self._close_smtp()
+                    error = str(e)
+                except smtplib.SMTPException as e:
+                    error = str(e)
+                    break
+            errors.append(error)
+            if error is not None and error.startswith('connect:'):
+                # Server unreachable: fail the rest of the batch fast, they will be retried
+                errors.extend([error] * (len(batch) - len(errors)))
+                break
+        self._last_used = time.monotonic()
+        return errors
+
+    def _close_smtp(self):
+        conn, self._smtp = self._smtp, None
+        if conn is not None:
+            try:
+                conn.quit()
+            except Exception:
+                pass
+
+    async def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+        try:
+            depth = await self.collection.count_documents({'status': 'pending'})
+        except Exception:
+            depth = None
+        return {
+            **self.counters,
+            'queue_depth': depth,
+            'connected': self._smtp is not None,
+            'latency_ms_p50': pick(0.5),
+            'latency_ms_p99': pick(0.99),
+        }
+
+
+# Global outbox; the sender task is started from the app lifespan
+email_outbox = EmailOutbox(db.email_outbox)
@@ -1,4 +1,9 @@
 import os
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
 from pathlib import Path
@@ -38,6 +43,107 @@ def decrypt_message(encrypted_message: str) -> str:
         print(f"Decryption failed: {e}")
         return encrypted_message
 
+# ---- Batch decryption for history pages ------------------------------------
+# Fernet (HMAC + AES-CBC) costs tens of microseconds per message; a 1,000 message
+# page decrypted inline would stall every other socket on the loop. Small pages
+# stay inline, bigger ones are split into chunks for a thread pool (the OpenSSL
+# calls release the GIL). Recently decrypted ciphertexts are kept in a
+# byte-bounded LRU since several devices fetch the same pages.
+DECRYPT_CACHE_MAX_BYTES = int(os.getenv('DECRYPT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+DECRYPT_INLINE_MAX = int(os.getenv('DECRYPT_INLINE_MAX', '32'))
+DECRYPT_CHUNK_SIZE = int(os.getenv('DECRYPT_CHUNK_SIZE', '128'))
+DECRYPT_WORKERS = int(os.getenv('DECRYPT_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+
+class DecryptedCache:
+    """LRU of ciphertext -> plaintext bounded by total characters held."""
+    def __init__(self, max_bytes: int = DECRYPT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # Single entries above this share are not worth evicting everything else for
+        self.max_entry_bytes = max_bytes // 16
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ciphertext: str):
+        with self._lock:
+            plaintext = self._data.get(ciphertext)
+            if plaintext is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(ciphertext)
+            self.hits += 1
+            return plaintext
+
+    def put(self, ciphertext: str, plaintext: str):
+        cost = len(ciphertext) + len(plaintext)
+        if cost > self.max_entry_bytes:
+            return
+        with self._lock:
+            if ciphertext in self._data:
+                return
+            self._data[ciphertext] = plaintext
+            self.size += cost
+            while self.size > self.max_bytes:
+                old_ct, old_pt = self._data.popitem(last=False)
+                self.size -= len(old_ct) + len(old_pt)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+decrypted_cache = DecryptedCache()
+_decrypt_executor = ThreadPoolExecutor(max_workers=DECRYPT_WORKERS, thread_name_prefix='decrypt')
+
+
+def _decrypt_chunk(ciphertexts: List[str]) -> List[str]:
+    plaintexts = []
+    for ct in ciphertexts:
+        pt = decrypt_message(ct)
+        decrypted_cache.put(ct, pt)
+        plaintexts.append(pt)
+    return plaintexts
+
+
+async def decrypt_many(ciphertexts: List[str]) -> List[str]:
+    """Decrypt a page of messages without blocking the event loop for long."""
+    results: List[str] = [''] * len(ciphertexts)
+    pending_idx = []
+    for i, ct in enumerate(ciphertexts):
+        if not ct:
+            continue
+        cached = decrypted_cache.get(ct)
+        if cached is None:
+            pending_idx.append(i)
+        else:
+            results[i] = cached
+
+    if len(pending_idx) <= DECRYPT_INLINE_MAX:
+        for i, pt in zip(pending_idx, _decrypt_chunk([ciphertexts[i] for i in pending_idx])):
+            results[i] = pt
+        return results
+
+    loop = asyncio.get_running_loop()
+    chunks = [pending_idx[i:i + DECRYPT_CHUNK_SIZE] for i in range(0, len(pending_idx), DECRYPT_CHUNK_SIZE)]
+    decrypted = await asyncio.gather(*(
+        loop.run_in_executor(_decrypt_executor, _decrypt_chunk, [ciphertexts[i] for i in chunk])
+        for chunk in chunks
+    ))
+    for chunk, plaintexts in zip(chunks, decrypted):
+        for i, pt in zip(chunk, plaintexts):
+            results[i] = pt
+    return results
+
 def generate_encryption_key() -> str:
     """Generate a new encryption key"""
     return Fernet.generate_key().decode('utf-8')
@@ -0,0 +1,58 @@
+"""
+Time-ordered, collision-free identifiers
+------------------------------------------
+IDs look like `msg_1792345678901a3f09c2e000001`:
+
+  13 decimal digits   milliseconds since the epoch
+   8 hex digits       node component (NODE_ID/host/pid + random, fixed per process)
+   6 hex digits       per-millisecond sequence
+
+They sort lexicographically in creation order, so `message_id` alone can drive
+keyset pagination. The leading 10 digits are the epoch seconds, which keeps
+new IDs sorting after the legacy `msg_{seconds}_{fraction}` ones.
+"""
+
+import os
+import time
+import socket
+import hashlib
+import secrets
+import threading
+
+_SEQ_MAX = 0xFFFFFF
+
+
+def _node_component() -> str:
+    seed = f"{os.getenv('NODE_ID', '')}|{socket.gethostname()}|{os.getpid()}|{secrets.token_hex(8)}"
+    return hashlib.sha1(seed.encode()).hexdigest()[:8]
+
+
+class IdGenerator:
+    def __init__(self, node: str = None, clock=time.time):
+        self.node = node or _node_component()
+        self._clock = clock
+        self._last_ms = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def new_id(self, prefix: str) -> str:
+        with self._lock:
+            now_ms = int(self._clock() * 1000)
+            # Never go backwards, even if the wall clock does
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._seq = 0
+            else:
+                self._seq += 1
+                if self._seq > _SEQ_MAX:
+                    self._last_ms += 1
+                    self._seq = 0
+            return f"{prefix}_{self._last_ms:013d}{self.node}{self._seq:06x}"
+
+
+_generator = IdGenerator()
+
+
+def new_id(prefix: str) -> str:
+    """Return a new unique, time-ordered id such as new_id('msg')."""
+    return _generator.new_id(prefix)
@@ -0,0 +1,170 @@
+"""
+Media storage for uploaded files
+----------------------------------
+Finished uploads and data URI attachments go to Cloudinary when it is
+configured, otherwise into the content-addressed blob store (see
+blob_store.py). End-to-end encrypted attachments always go to the blob store,
+as the ciphertext bytes. `GET /api/media/{name}` still serves files stored under
+MEDIA_DIR by earlier versions. Partial resumable uploads
+are spooled to disk under MEDIA_DIR/incoming, so memory use per upload is
+bounded by the write buffer, not by the file size. Every filesystem and CDN
+call here runs in a worker thread.
+
+Tuning (backend/.env):
+  MEDIA_DIR=./media               # local store + upload spool
+  UPLOAD_MAX_BYTES=104857600      # 100 MB per file
+  UPLOAD_CHUNK_MAX_BYTES=8388608  # 8 MB per PUT
+"""
+
+import os
+import re
+import time
+import base64
+import asyncio
+import logging
+import binascii
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+
+from cache import TTLCache
+from cloudinary_utils import upload_file_to_cdn, upload_to_cdn, is_cdn_enabled
+from blob_store import blob_store, blob_path, blob_ref
+from conversation_cache import conversation_cache
+from database import db
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = Path(__file__).parent
+MEDIA_DIR = Path(os.getenv('MEDIA_DIR', str(ROOT_DIR / 'media')))
+SPOOL_DIR = MEDIA_DIR / 'incoming'
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_MAX_BYTES = int(os.getenv('UPLOAD_CHUNK_MAX_BYTES', str(8 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv('UPLOAD_SESSION_TTL_SECONDS', str(24 * 3600)))
+# Bytes buffered in memory before each write to the spool file
+UPLOAD_WRITE_BUFFER = 1024 * 1024
+
+_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}(\.[A-Za-z0-9]{1,10})?$')
+
+# (user_id, sha256) pairs already allowed; a video is fetched as a burst of range requests
+_blob_access = TTLCache(maxsize=20000, ttl=300)
+
+
+def spool_path(upload_id: str) -> Path:
+    return SPOOL_DIR / f"{upload_id}.part"
+
+
+def _write_at(path: Path, offset: int, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'r+b' if path.exists() else 'wb') as f:
+        f.seek(offset)
+        f.write(data)
+        f.truncate()
+
+
+async def write_chunk(path: Path, offset: int, data: bytes):
+    """Write `data` at `offset` of a spool file, dropping anything after it (a retried chunk)."""
+    await asyncio.to_thread(_write_at, path, offset, data)
+
+
+async def store_upload(path: Path, mime_type: str, file_name: Optional[str] = None) -> str:
+    """Move a finished upload to permanent storage and return the URL clients should use."""
+    url = await upload_file_to_cdn(str(path), mime_type, file_name=file_name)
+    if url:
+        await asyncio.to_thread(path.unlink, True)
+        return url
+    return blob_path(await blob_store.put_file(path, mime_type or 'application/octet-stream'))
+
+
+def _ciphertext_bytes(content: str) -> Optional[bytes]:
+    try:
+        return base64.b64decode(content, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+async def can_read_blob(sha256: str, user_id: str) -> bool:
+    """The uploader, or a participant of a conversation with a message that references the blob."""
+    key = (user_id, sha256)
+    if _blob_access.get(key):
+        return True
+    allowed = bool(await db.uploads.find_one({'user_id': user_id, 'blob': sha256}, {'_id': 1}))
+    if not allowed:
+        for conversation_id in await db.messages.distinct('conversation_id', {'blob': sha256}):
+            if await conversation_cache.is_participant(conversation_id, user_id):
+                allowed = True
+                break
+    if allowed:
+        _blob_access.set(key, True)
+    return allowed
+
+
+async def blob_fields(content: str, store=None,
+                      may_reference: Optional[Callable[[str], Awaitable[bool]]] = None) -> Optional[dict]:
+    """
+    Message fields for an attachment kept in the blob store, or None if the
+    content is not something to move there (an external URL, plain text):
+    - a blob URL from an upload -> `blob`, only if `may_reference(sha256)`
+      allows it: sending a reference shares the blob with the conversation,
+      so it must be one the sender can already read
+    - a data URI -> `blob` of the decoded bytes
+    - base64 NaCl ciphertext (E2EE clients) -> `blob` of the ciphertext bytes
+      and `blob_e2ee`; the client downloads and decrypts it
+    """
+    store = store or blob_store
+    sha256 = blob_ref(content)
+    if sha256:
+        if may_reference is None or not await may_reference(sha256):
+            return None
+        return {'blob': sha256}
+    if content.startswith('data:'):
+        sha256 = await store.put_data_uri(content)
+        return {'blob': sha256} if sha256 else None
+    if content.startswith(('http://', 'https://')):
+        return None
+    data = await asyncio.to_thread(_ciphertext_bytes, content)
+    if not data:
+        return None
+    return {'blob': await store.put_bytes(data, 'application/octet-stream'), 'blob_e2ee': True}
+
+
+async def store_attachment(content: str, sender_id: str, file_name: Optional[str] = None) -> Tuple[str, dict]:
+    """
+    Take an attachment out of a message: (content to keep, extra message
+    fields). Data URIs go to the CDN when it is configured; everything
+    blob_fields() accepts otherwise leaves no content behind. A blob URL the
+    sender cannot read stays plain content, which nobody else can fetch.
+    """
+    if content.startswith('data:') and is_cdn_enabled():
+        url = await upload_to_cdn(content, file_name=file_name)
+        if url:
+            return url, {}
+    fields = await blob_fields(content, may_reference=lambda sha256: can_read_blob(sha256, sender_id))
+    return ('', fields) if fields else (content, {})
+
+
+def local_media_path(name: str) -> Optional[Path]:
+    """Resolve a /api/media/{name} file, refusing anything that is not a generated name."""
+    if not _NAME_RE.match(name):
+        return None
+    path = MEDIA_DIR / name
+    return path if path.is_file() else None
+
+
+def _sweep_spool(max_age: float):
+    if not SPOOL_DIR.exists():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for part in SPOOL_DIR.glob('*.part'):
+        try:
+            if part.stat().st_mtime < cutoff:
+                part.unlink()
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+async def sweep_spool(max_age: float = UPLOAD_SESSION_TTL_SECONDS) -> int:
+    """Delete spool files of abandoned uploads (their sessions expired from Mongo)."""
+    return await asyncio.to_thread(_sweep_spool, max_age)
@@ -0,0 +1,185 @@
+"""
+Write-behind batching for message persistence
+-----------------------------------------------
+Messages sent within the same flush window (a few milliseconds) are written
+with a single `insert_many`, and the matching `updated_at` / `last_message`
+updates are folded into one `bulk_write` with one update per conversation.
+Recipients' unread counters (read_state.py) are bumped the same way, with one
+`$inc` per (recipient, conversation). Callers await
+`persist()` and only get control back once their message is durably stored,
+so the sender's ack still means "saved".
+
+Tuning (backend/.env):
+  MESSAGE_FLUSH_MS=5        # how long to coalesce before writing
+  MESSAGE_MAX_BATCH=500     # flush early once this many messages are queued
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from database import db
+from read_state import read_state as default_read_state
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_FLUSH_MS = float(os.getenv('MESSAGE_FLUSH_MS', '5'))
+MESSAGE_MAX_BATCH = int(os.getenv('MESSAGE_MAX_BATCH', '500'))
+# Larger contents (inline media) are left out of the conversation list preview
+LAST_MESSAGE_PREVIEW_MAX = int(os.getenv('LAST_MESSAGE_PREVIEW_MAX', '4096'))
+
+
+def last_message_summary(doc: dict) -> dict:
+    """Small denormalized copy of a message kept on its conversation for the chat list."""
+    content = doc.get('content') or ''
+    # Vanish-mode messages must not outlive themselves in the preview
+    if doc.get('expires_in') or len(content) > LAST_MESSAGE_PREVIEW_MAX:
+        content = ''
+    return {
+        'message_id': doc['message_id'],
+        'sender_id': doc.get('sender_id'),
+        'message_type': doc.get('message_type', 'text'),
+        'content': content,
+        'timestamp': doc['timestamp'],
+        'is_edited': doc.get('is_edited', False),
+        'is_deleted': doc.get('is_deleted', False),
+    }
+
+
+def last_message_update(doc: dict) -> UpdateOne:
+    """Set a conversation's last_message/updated_at unless a newer message is already recorded."""
+    return UpdateOne(
+        {'conversation_id': doc['conversation_id'], 'last_message.timestamp': {'$not': {'$gt': doc['timestamp']}}},
+        {'$set': {'last_message': last_message_summary(doc)}, '$max': {'updated_at': doc['timestamp']}}
+    )
+
+
+class MessageWriter:
+    def __init__(self, messages, conversations, flush_ms: float = MESSAGE_FLUSH_MS, max_batch: int = MESSAGE_MAX_BATCH,
+                 read_state=None):
+        self.messages = messages
+        self.conversations = conversations
+        self.flush_ms = flush_ms
+        self.max_batch = max_batch
+        self.read_state = read_state
+        self._pending: List[Tuple[dict, asyncio.Future, Tuple[str, ...]]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self.stats = {'messages': 0, 'batches': 0, 'failed': 0, 'flush_seconds': 0.0}
+
+    async def persist(self, doc: dict, recipients: Iterable[str] = ()) -> dict:
+        """Queue a message document and wait until it has been written. `recipients` get +1 unread."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((doc, future, tuple(recipients)))
+        if len(self._pending) >= self.max_batch or self.flush_ms <= 0:
+            self._start_flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+        return await future
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.flush_ms / 1000)
+        self._flush_task = None
+        await self._flush(self._take_batch())
+
+    def _start_flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        task = asyncio.create_task(self._flush(self._take_batch()))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    def _take_batch(self) -> List[Tuple[dict, asyncio.Future, Tuple[str, ...]]]:
+        batch, self._pending = self._pending, []
+        return batch
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future, Tuple[str, ...]]]):
+        if not batch:
+            return
+        error: BaseException = RuntimeError('Message batch flush aborted')
+        try:
+            await self._write_batch(batch)
+        except Exception as e:
+            logger.error(f"Message batch flush failed: {e}")
+            error = e
+        finally:
+            # Whatever went wrong (or cancelled us), no sender may be left awaiting forever
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    async def _write_batch(self, batch: List[Tuple[dict, asyncio.Future, Tuple[str, ...]]]):
+        started = time.perf_counter()
+        docs = [doc for doc, _, _ in batch]
+        failed: Dict[int, Exception] = {}
+        try:
+            await self.messages.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get('writeErrors', []):
+                failed[err['index']] = Exception(err.get('errmsg', 'write failed'))
+        except Exception as e:
+            logger.error(f"Message batch insert failed: {e}")
+            failed = {i: e for i in range(len(batch))}
+
+        # One summary update per conversation, for its newest message in this batch.
+        latest: Dict[str, dict] = {}
+        for i, doc in enumerate(docs):
+            if i in failed:
+                continue
+            conv_id = doc['conversation_id']
+            if conv_id not in latest or doc['timestamp'] > latest[conv_id]['timestamp']:
+                latest[conv_id] = doc
+        if latest:
+            try:
+                await self.conversations.bulk_write(
+                    [last_message_update(doc) for doc in latest.values()],
+                    ordered=False
+                )
+            except Exception as e:
+                # Messages are stored; a stale preview is repaired by the backfill script.
+                logger.error(f"Conversation last_message update failed: {e}")
+
+        unread = Counter(
+            (user_id, doc['conversation_id'])
+            for i, (doc, _, recipients) in enumerate(batch) if i not in failed
+            for user_id in recipients
+        )
+        if unread and self.read_state is not None:
+            try:
+                await self.read_state.increment(unread)
+            except Exception as e:
+                # Counters drift until the next read or reconcile_unread.py run
+                logger.error(f"Unread counter update failed: {e}")
+
+        for i, (doc, future, _) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(failed[i])
+            else:
+                future.set_result(doc)
+
+        self.stats['messages'] += len(batch) - len(failed)
+        self.stats['failed'] += len(failed)
+        self.stats['batches'] += 1
+        self.stats['flush_seconds'] += time.perf_counter() - started
+
+    async def close(self):
+        """Flush anything still queued (called on shutdown)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush(self._take_batch())
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+
+# Global write-behind stage shared by the socket and HTTP send paths
+message_writer = MessageWriter(db.messages, db.conversations, read_state=default_read_state)
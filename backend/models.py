@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Optional, List, Any
 
 class UserRegister(BaseModel):
     email: EmailStr
@@ -86,3 +86,17 @@ class EndCallEvent(BaseModel):
 class IceCandidateEvent(BaseModel):
     target_id: str
     candidate: dict
+
+class NovaMessage(BaseModel):
+    role: str
+    content: Any
+
+class NovaStreamEvent(BaseModel):
+    request_id: str
+    messages: List[NovaMessage]
+    model: Optional[str] = None
+
+class UploadCreate(BaseModel):
+    file_name: Optional[str] = None
+    mime_type: str = 'application/octet-stream'
+    size: int
@@ -0,0 +1,183 @@
+"""
+Nova AI completions
+---------------------
+One connection-pooled httpx client for the lifetime of the app (no TLS
+handshake per question) and two ways to call the completion API: `complete()`
+for the whole answer, `stream()` to yield tokens as the upstream produces
+them. Closing the `stream()` generator early (client went away) closes the
+upstream response, which cancels generation there too.
+
+Socket.IO streams (`nova_stream`) are capped per socket and rate limited per
+user. The per-user count is a fixed window kept in Redis through the async
+`redis_pool` (shared by every worker, never blocking the event loop), and in
+process memory while Redis is unconfigured or down.
+
+Tuning (backend/.env):
+  NVIDIA_API_KEY=...
+  NOVA_API_URL=https://integrate.api.nvidia.com/v1/chat/completions
+  NOVA_MAX_CONNECTIONS=20
+  NOVA_MAX_STREAMS_PER_SOCKET=2   # answers generated at once for one socket
+  NOVA_RATE_LIMIT=20/minute       # nova_stream requests per user
+"""
+
+import os
+import json
+import time
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from limits import parse as parse_limit
+
+from redis_pool import redis_pool
+
+logger = logging.getLogger(__name__)
+
+NOVA_API_URL = os.getenv('NOVA_API_URL', 'https://integrate.api.nvidia.com/v1/chat/completions')
+NOVA_MODEL = 'google/gemma-3n-e4b-it'
+NOVA_TIMEOUT_SECONDS = float(os.getenv('NOVA_TIMEOUT_SECONDS', '60'))
+NOVA_MAX_CONNECTIONS = int(os.getenv('NOVA_MAX_CONNECTIONS', '20'))
+NOVA_MAX_STREAMS_PER_SOCKET = int(os.getenv('NOVA_MAX_STREAMS_PER_SOCKET', '2'))
+NOVA_RATE_LIMIT = parse_limit(os.getenv('NOVA_RATE_LIMIT', '20/minute'))
+
+API_KEY = os.getenv("NVIDIA_API_KEY", "")
+
+# Ensure it's formatted properly for the Authorization header
+if API_KEY and not API_KEY.startswith("Bearer "):
+    API_KEY = f"Bearer {API_KEY}"
+
+
+class NovaUnavailable(Exception):
+    """The completion API failed or returned an error status."""
+
+
+def build_payload(raw_messages: List[dict], model: str, user_name: str) -> dict:
+    """Normalize a chat history into the strict user/assistant alternation the model expects."""
+    raw_messages = [dict(m) for m in raw_messages]
+
+    # 1. Filter out any leading non-user messages to ensure it starts with 'user'
+    while raw_messages and raw_messages[0]["role"] != "user":
+        raw_messages.pop(0)
+
+    # 2. Enforce strict alternation
+    messages = []
+    expected_role = "user"
+    for m in raw_messages:
+        if m["role"] == expected_role:
+            messages.append(m)
+            expected_role = "assistant" if expected_role == "user" else "user"
+
+    # 3. Bake system prompt into the first user message (safest approach for some strict models)
+    system_instructions = f"SYSTEM INSTRUCTIONS: You are Nova, an advanced, highly intelligent AI assistant embedded in QuickChat. Your goal is to be exceptionally helpful, concise, and friendly. The user's name is {user_name}.\n\n"
+
+    if messages and messages[0]["role"] == "user":
+        if isinstance(messages[0]["content"], str):
+            messages[0]["content"] = system_instructions + messages[0]["content"]
+        elif isinstance(messages[0]["content"], list):
+            for block in messages[0]["content"]:
+                if isinstance(block, dict) and block.get("type") == "text":
+                    block["text"] = system_instructions + block.get("text", "")
+                    break
+
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 2048
+    }
+
+
+class NovaClient:
+    def __init__(self, url: str = NOVA_API_URL, api_key: str = API_KEY, timeout: float = NOVA_TIMEOUT_SECONDS,
+                 max_connections: int = NOVA_MAX_CONNECTIONS):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._http: Optional[httpx.AsyncClient] = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    @property
+    def http(self) -> httpx.AsyncClient:
+        if self._http is None or self._http.is_closed:
+            self._http = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                headers={"Authorization": self.api_key},
+            )
+        return self._http
+
+    async def complete(self, payload: dict) -> str:
+        response = await self.http.post(self.url, json=payload, headers={"Accept": "application/json"})
+        if response.status_code != 200:
+            logger.error(f"NVIDIA API Error: {response.text}")
+            raise NovaUnavailable(f"AI service returned error: {response.text}")
+        data = response.json()
+        return data["choices"][0]["message"]["content"]
+
+    async def stream(self, payload: dict) -> AsyncIterator[str]:
+        """Yield content deltas from an OpenAI-style SSE completion stream."""
+        async with self.http.stream(
+            "POST", self.url,
+            json={**payload, "stream": True},
+            headers={"Accept": "text/event-stream"}
+        ) as response:
+            if response.status_code != 200:
+                body = (await response.aread()).decode(errors='replace')
+                logger.error(f"NVIDIA API Error: {body}")
+                raise NovaUnavailable(f"AI service returned error: {body}")
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                try:
+                    chunk = json.loads(data)
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                except (ValueError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+class NovaRateLimit:
+    """At most `limit` nova_stream requests per user per fixed window."""
+
+    def __init__(self, pool=None, limit=NOVA_RATE_LIMIT, clock=time.time):
+        self.pool = pool
+        self.amount = limit.amount
+        self.window = limit.get_expiry()
+        self.clock = clock
+        # (user_id, window index) -> requests, while Redis is not in use
+        self._local: Dict[Tuple[str, int], int] = {}
+
+    async def allow(self, user_id: str) -> bool:
+        """Count one request; False once the user is over the limit for this window."""
+        index = int(self.clock() // self.window)
+        count = None
+        if self.pool is not None:
+            key = f"nova:rate:{user_id}:{index}"
+            count = await self.pool.call('incr', key)
+            if count == 1:
+                await self.pool.call('expire', key, self.window)
+        if count is None:
+            for stale in [k for k in self._local if k[1] != index]:
+                del self._local[stale]
+            count = self._local[(user_id, index)] = self._local.get((user_id, index), 0) + 1
+        return count <= self.amount
+
+
+# App-lifetime client; closed from the server lifespan
+nova_client = NovaClient()
+# Per-user limit on Socket.IO streams
+nova_rate_limit = NovaRateLimit(redis_pool)
@@ -0,0 +1,113 @@
+"""
+Off-loop password hashing
+---------------------------
+bcrypt costs a few hundred milliseconds of CPU per call. Run inline in an
+async handler, one login stalls every socket served by the event loop. Here
+hashes and checks run on a small dedicated thread pool (bcrypt releases the
+GIL while it works), with a cap on how many may wait: beyond it callers get
+`PasswordHasherBusy` straight away instead of queueing minutes of CPU work.
+
+Tuning (backend/.env):
+  BCRYPT_ROUNDS=12              # work factor for new hashes (see utils.py)
+  PASSWORD_HASH_WORKERS=4       # concurrent bcrypt calls (default: min(4, CPUs))
+  PASSWORD_HASH_QUEUE_MAX=32    # waiting calls beyond the workers before rejecting
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import BCRYPT_ROUNDS, hash_password, verify_password, password_rounds
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_MAX = int(os.getenv('PASSWORD_HASH_QUEUE_MAX', '32'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full; map to 503 + Retry-After."""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, queue_max: int = PASSWORD_HASH_QUEUE_MAX,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._pending = 0
+        self._waits = deque(maxlen=1000)
+        self._totals = deque(maxlen=1000)
+        self.counters = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'rejected': 0}
+
+    async def _run(self, fn, *args):
+        if self._pending >= self.workers + self.queue_max:
+            self.counters['rejected'] += 1
+            raise PasswordHasherBusy()
+        self._pending += 1
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            return fn(*args), started
+
+        try:
+            result, started = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self._pending -= 1
+        self._waits.append(started - submitted)
+        self._totals.append(time.perf_counter() - submitted)
+        return result
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(hash_password, password, self.rounds)
+        self.counters['hashed'] += 1
+        return hashed
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        # Accounts without a password (Google sign-in) never match
+        if not hashed:
+            return False
+        ok = await self._run(verify_password, password, hashed)
+        self.counters['verified'] += 1
+        return ok
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return bool(hashed) and password_rounds(hashed) != self.rounds
+
+    async def rehash_if_needed(self, password: str, hashed: str):
+        """
+        Return a hash at the current work factor if `hashed` (already verified
+        against `password`) uses another one, otherwise None. Skipped when busy.
+        """
+        if not self.needs_rehash(hashed):
+            return None
+        try:
+            new_hash = await self.hash(password)
+        except PasswordHasherBusy:
+            return None
+        self.counters['rehashed'] += 1
+        return new_hash
+
+    def stats(self) -> dict:
+        def pick(samples, p):
+            samples = sorted(samples)
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 1) if samples else None
+        return {
+            **self.counters,
+            'rounds': self.rounds,
+            'workers': self.workers,
+            'in_flight': self._pending,
+            'queue_depth': max(0, self._pending - self.workers),
+            'wait_ms_p99': pick(self._waits, 0.99),
+            'latency_ms_p50': pick(self._totals, 0.5),
+            'latency_ms_p99': pick(self._totals, 0.99),
+        }
+
+
+# Global hasher used by the auth router
+password_hasher = PasswordHasher()
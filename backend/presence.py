@@ -0,0 +1,211 @@
+"""
+Multi-device presence registry for QuickChat
+----------------------------------------------
+Maps each user to the set of socket ids they have open (one per tab/device),
+so a second device no longer overwrites the first and a user only goes
+offline when their last socket disconnects.
+
+Every entry carries a heartbeat TTL. The node that accepted a socket owns it
+and keeps its entry alive; if that node dies without cleaning up, its sockets
+simply expire. With a Redis backend the registry is shared by all workers,
+so `is_online` answers the same on every node. Redis is reached through
+`redis_pool`: while it is down, each node answers from its own sockets and
+the next heartbeat re-registers them.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL_SECONDS = int(os.getenv('PRESENCE_TTL_SECONDS', '90'))
+PRESENCE_HEARTBEAT_SECONDS = int(os.getenv('PRESENCE_HEARTBEAT_SECONDS', '30'))
+NODE_ID = os.getenv('NODE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+_KEY_PREFIX = 'presence'
+
+
+def user_room(user_id: str) -> str:
+    """Socket.IO room every socket of a user joins; reaches all of their devices on any node."""
+    return f"user:{user_id}"
+
+
+class PresenceRegistry:
+    def __init__(self, pool=None, node_id: str = NODE_ID, ttl: int = PRESENCE_TTL_SECONDS):
+        # A RedisPool: every call goes through it, so a Redis failure falls back to local state
+        self.pool = pool
+        self.node_id = node_id
+        self.ttl = ttl
+        # Sockets accepted by this node: {sid: user_id}. Always local, O(1).
+        self.local_sids: Dict[str, str] = {}
+        self._local_users: Dict[str, Set[str]] = {}
+        # {user_id: {sid: expires_at}}: every socket without Redis, this node's with it
+        self._sessions: Dict[str, Dict[str, float]] = {}
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def _user_key(self, user_id: str) -> str:
+        return f"{_KEY_PREFIX}:user:{user_id}"
+
+    def _node_key(self) -> str:
+        return f"{_KEY_PREFIX}:node:{self.node_id}"
+
+    def user_id(self, sid: str) -> Optional[str]:
+        """Return the user owning a socket on this node (None if unknown)."""
+        return self.local_sids.get(sid)
+
+    async def connect(self, user_id: str, sid: str) -> bool:
+        """
+        Register a socket for a user.
+        Returns True if this is the user's first live socket (they just came online).
+        While Redis is down, only this node's sockets are taken into account.
+        """
+        now = time.time()
+        sessions = self._live_sessions(user_id, now)
+        was_offline = not sessions
+        sessions[sid] = now + self.ttl
+        self._sessions[user_id] = sessions
+        try:
+            if self.pool is not None:
+                key = self._user_key(user_id)
+                result = await self.pool.pipeline([
+                    ('zremrangebyscore', key, '-inf', now),
+                    ('zcard', key),
+                    ('zadd', key, {sid: now + self.ttl}),
+                    ('expire', key, self.ttl),
+                    ('hset', self._node_key(), sid, user_id),
+                ])
+                if result is not None:
+                    was_offline = result[1] == 0
+        except BaseException:
+            self._forget_session(user_id, sid)
+            raise
+        # Only once registered: a failed connect must not leave the sid behind
+        self.local_sids[sid] = user_id
+        self._local_users.setdefault(user_id, set()).add(sid)
+        return was_offline
+
+    async def disconnect(self, sid: str) -> Tuple[Optional[str], bool]:
+        """
+        Remove a socket.
+        Returns (user_id, went_offline) — went_offline is True only when no other socket remains.
+        """
+        user_id = self.local_sids.pop(sid, None)
+        if user_id is None:
+            return None, False
+        local = self._local_users.get(user_id)
+        if local is not None:
+            local.discard(sid)
+            if not local:
+                del self._local_users[user_id]
+        went_offline = not self._forget_session(user_id, sid)
+        if self.pool is None:
+            return user_id, went_offline
+
+        key = self._user_key(user_id)
+        result = await self.pool.pipeline([
+            ('zrem', key, sid),
+            ('zremrangebyscore', key, '-inf', time.time()),
+            ('zcard', key),
+            ('hdel', self._node_key(), sid),
+        ])
+        if result is not None:
+            went_offline = result[2] == 0
+        return user_id, went_offline
+
+    async def is_online(self, user_id: str) -> bool:
+        # Fast path: a socket on this node is authoritative, no round trip needed.
+        if user_id in self._local_users:
+            return True
+        now = time.time()
+        if self.pool is not None:
+            count = await self.pool.call('zcount', self._user_key(user_id), now, '+inf')
+            if count is not None:
+                return count > 0
+        return bool(self._live_sessions(user_id, now))
+
+    async def sids(self, user_id: str) -> Set[str]:
+        """All live socket ids of a user, across every node (this node's only while Redis is down)."""
+        now = time.time()
+        if self.pool is not None:
+            members = await self.pool.call('zrangebyscore', self._user_key(user_id), now, '+inf')
+            if members is not None:
+                return {m.decode() if isinstance(m, bytes) else m for m in members}
+        return set(self._live_sessions(user_id, now))
+
+    async def online_users(self, user_ids: Iterable[str]) -> Set[str]:
+        """Bulk variant of is_online: one pipeline round trip for any number of users."""
+        user_ids = list(dict.fromkeys(user_ids))
+        now = time.time()
+        if self.pool is not None and user_ids:
+            counts = await self.pool.pipeline(
+                [('zcount', self._user_key(u), now, '+inf') for u in user_ids], transaction=False)
+            if counts is not None:
+                return {u for u, c in zip(user_ids, counts) if c > 0}
+        return {u for u in user_ids if self._live_sessions(u, now)}
+
+    async def heartbeat(self):
+        """
+        Extend the TTL of every socket this node owns and drop expired local
+        entries. With Redis this also re-registers sockets whose connect ran
+        while Redis was down.
+        """
+        now = time.time()
+        for user_id in list(self._sessions):
+            sessions = self._live_sessions(user_id, now)
+            for sid in sessions:
+                if sid in self.local_sids:
+                    sessions[sid] = now + self.ttl
+            if sessions:
+                self._sessions[user_id] = sessions
+            else:
+                self._sessions.pop(user_id, None)
+
+        if self.pool is None or not self.local_sids:
+            return
+        commands = []
+        for sid, user_id in self.local_sids.items():
+            key = self._user_key(user_id)
+            commands += [('zadd', key, {sid: now + self.ttl}), ('expire', key, self.ttl),
+                         ('hset', self._node_key(), sid, user_id)]
+        commands.append(('expire', self._node_key(), self.ttl))
+        await self.pool.pipeline(commands, transaction=False)
+
+    def _forget_session(self, user_id: str, sid: str) -> Dict[str, float]:
+        """Drop a socket from the local sessions; returns the user's remaining live ones."""
+        sessions = self._live_sessions(user_id, time.time())
+        sessions.pop(sid, None)
+        if sessions:
+            self._sessions[user_id] = sessions
+        else:
+            self._sessions.pop(user_id, None)
+        return sessions
+
+    async def _heartbeat_loop(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Presence heartbeat failed: {e}")
+
+    def start(self, interval: int = PRESENCE_HEARTBEAT_SECONDS):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop(interval))
+
+    async def stop(self):
+        """Stop heartbeating and release every socket this node owns (graceful shutdown)."""
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        for sid in list(self.local_sids):
+            try:
+                await self.disconnect(sid)
+            except Exception as e:
+                logger.error(f"Presence cleanup failed for {sid}: {e}")
+
+    def _live_sessions(self, user_id: str, now: float) -> Dict[str, float]:
+        return {sid: exp for sid, exp in self._sessions.get(user_id, {}).items() if exp > now}
@@ -0,0 +1,140 @@
+"""
+Contact-scoped presence broadcasts
+------------------------------------
+Going online or offline used to be emitted to every connected socket, so
+fan-out grew with the square of the user base. Changes are now collected for
+PRESENCE_BATCH_MS and sent as one `presence_diff` ({online: [...],
+offline: [...]}) per contact: someone who shares a conversation with a
+changed user and is online themselves. Per window that costs:
+- one `bulk_write` for the `users.online_status` mirror
+- one find on conversations by `participants` to get the contacts
+- one bulk presence lookup to skip contacts who are offline
+- one emit per contact, to their user room (reaches every device, any node)
+
+A user who drops and comes back within the same window (a page reload, a
+flaky network) produces no diff at all.
+
+Tuning (backend/.env):
+  PRESENCE_BATCH_MS=1000     # how long presence changes are coalesced
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from pymongo import UpdateMany
+
+from database import db
+from presence import PresenceRegistry, user_room
+from socket_instance import sio, presence
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_BATCH_MS = float(os.getenv('PRESENCE_BATCH_MS', '1000'))
+
+
+class PresenceBroadcaster:
+    def __init__(self, conversations, users, registry: PresenceRegistry, emit: Callable[..., Awaitable],
+                 batch_ms: float = PRESENCE_BATCH_MS):
+        self.conversations = conversations
+        self.users = users
+        self.registry = registry
+        self.emit = emit
+        self.batch_ms = batch_ms
+        # user_id -> True (came online) / False (went offline) since the last flush
+        self._pending: Dict[str, bool] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self.stats = {'changes': 0, 'cancelled': 0, 'flushes': 0, 'diffs': 0, 'failed': 0, 'flush_seconds': 0.0}
+
+    def changed(self, user_id: str, online: bool):
+        """Record that a user's first socket connected (online) or last one left (offline)."""
+        self.stats['changes'] += 1
+        if self._pending.get(user_id, online) != online:
+            # Back to where it was at the last flush: nobody needs to hear about it
+            del self._pending[user_id]
+            self.stats['cancelled'] += 1
+        else:
+            self._pending[user_id] = online
+        if self.batch_ms <= 0:
+            self._start_flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.batch_ms / 1000)
+        self._flush_task = None
+        await self._flush(self._take_batch())
+
+    def _start_flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        task = asyncio.create_task(self._flush(self._take_batch()))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    def _take_batch(self) -> Dict[str, bool]:
+        batch, self._pending = self._pending, {}
+        return batch
+
+    async def _flush(self, batch: Dict[str, bool]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        diffs: Dict[str, Dict[str, Set[str]]] = {}
+        try:
+            came_online = [u for u, online in batch.items() if online]
+            went_offline = [u for u, online in batch.items() if not online]
+            # Kept for older clients and tools; the app reads presence from the registry
+            await self.users.bulk_write([
+                UpdateMany({'user_id': {'$in': ids}}, {'$set': {'online_status': status}})
+                for ids, status in ((came_online, 'online'), (went_offline, 'offline')) if ids
+            ], ordered=False)
+
+            convs = await self.conversations.find(
+                {'participants': {'$in': list(batch)}}, {'_id': 0, 'participants': 1}
+            ).to_list(None)
+            for conv in convs:
+                participants = conv.get('participants', [])
+                for user_id in participants:
+                    if user_id not in batch:
+                        continue
+                    for contact in participants:
+                        if contact != user_id:
+                            diff = diffs.setdefault(contact, {'online': set(), 'offline': set()})
+                            diff['online' if batch[user_id] else 'offline'].add(user_id)
+            online_contacts = await self.registry.online_users(diffs)
+        except Exception as e:
+            logger.error(f"Presence flush failed: {e}")
+            self.stats['failed'] += len(batch)
+            return
+        finally:
+            self.stats['flushes'] += 1
+            self.stats['flush_seconds'] += time.perf_counter() - started
+
+        for contact in online_contacts:
+            diff = diffs[contact]
+            try:
+                await self.emit('presence_diff', {
+                    'online': sorted(diff['online']),
+                    'offline': sorted(diff['offline']),
+                }, room=user_room(contact))
+                self.stats['diffs'] += 1
+            except Exception as e:
+                logger.error(f"Presence broadcast failed: {e}")
+
+    async def close(self):
+        """Send anything still queued (called on shutdown)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush(self._take_batch())
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+
+# Global broadcaster used by the connect and disconnect handlers
+presence_broadcaster = PresenceBroadcaster(db.conversations, db.users, presence, sio.emit)
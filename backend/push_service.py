@@ -1,30 +1,190 @@
+"""
+Background Web Push dispatch
+------------------------------
+Socket and HTTP handlers call `send_push_notification()`, which only enqueues
+and returns. A bounded pool of workers drains the queue, sends through
+pywebpush in threads, retries 429/5xx responses with exponential backoff
+(honouring Retry-After), and prunes dead (404/410) subscriptions in batches.
+
+Tuning (backend/.env):
+  PUSH_WORKERS=8            # concurrent deliveries
+  PUSH_QUEUE_MAX=10000      # jobs beyond this are dropped (and counted)
+  PUSH_MAX_RETRIES=4
+"""
+
+import os
 import json
+import time
+import random
 import logging
 import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List, Optional
+
 from pywebpush import webpush, WebPushException
 from database import db
 from utils import VAPID_PRIVATE_KEY, VAPID_CLAIMS_EMAIL
 
 logger = logging.getLogger(__name__)
 
-async def send_push_notification(user_id: str, payload: dict):
-    if not VAPID_PRIVATE_KEY:
-        return
-        
-    subscriptions = await db.push_subscriptions.find({"user_id": user_id}).to_list(1000)
-    for sub in subscriptions:
+PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', '8'))
+PUSH_QUEUE_MAX = int(os.getenv('PUSH_QUEUE_MAX', '10000'))
+PUSH_MAX_RETRIES = int(os.getenv('PUSH_MAX_RETRIES', '4'))
+PUSH_RETRY_BASE_SECONDS = float(os.getenv('PUSH_RETRY_BASE_SECONDS', '1'))
+PUSH_PRUNE_INTERVAL_SECONDS = float(os.getenv('PUSH_PRUNE_INTERVAL_SECONDS', '5'))
+PUSH_TIMEOUT_SECONDS = float(os.getenv('PUSH_TIMEOUT_SECONDS', '10'))
+
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+_DEAD_STATUS = {404, 410}
+
+
+@dataclass
+class PushJob:
+    user_id: str
+    payload: dict
+    # None until resolved by a worker; retries carry the single failed subscription
+    subscriptions: Optional[List[dict]] = None
+    attempt: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class PushDispatcher:
+    def __init__(self, subscriptions, send=webpush, workers: int = PUSH_WORKERS, queue_max: int = PUSH_QUEUE_MAX,
+                 max_retries: int = PUSH_MAX_RETRIES, retry_base: float = PUSH_RETRY_BASE_SECONDS,
+                 prune_interval: float = PUSH_PRUNE_INTERVAL_SECONDS):
+        self.subscriptions = subscriptions
+        self.send = send
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.prune_interval = prune_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_max)
+        self._tasks: List[asyncio.Task] = []
+        self._retry_handles: set = set()
+        self._dead_ids: set = set()
+        self._latencies = deque(maxlen=1000)
+        self.counters = {'enqueued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'dropped': 0, 'pruned': 0}
+
+    def enqueue(self, job: PushJob) -> bool:
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.counters['dropped'] += 1
+            logger.warning(f"Push queue full, dropping notification for {job.user_id}")
+            return False
+        self.counters['enqueued'] += 1
+        return True
+
+    def _ensure_started(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._prune_loop()))
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                logger.error(f"Push error: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, job: PushJob):
+        if job.subscriptions is None:
+            job.subscriptions = await self.subscriptions.find({"user_id": job.user_id}).to_list(1000)
+        data = json.dumps(job.payload)
+        for sub in job.subscriptions:
+            try:
+                await asyncio.to_thread(
+                    self.send,
+                    subscription_info=sub["subscription"],
+                    data=data,
+                    vapid_private_key=VAPID_PRIVATE_KEY,
+                    vapid_claims={"sub": VAPID_CLAIMS_EMAIL},
+                    timeout=PUSH_TIMEOUT_SECONDS
+                )
+                self.counters['sent'] += 1
+                self._latencies.append(time.monotonic() - job.enqueued_at)
+            except WebPushException as ex:
+                status = ex.response.status_code if ex.response is not None else None
+                if status in _DEAD_STATUS:
+                    self._dead_ids.add(sub["_id"])
+                elif status in _RETRYABLE_STATUS and job.attempt < self.max_retries:
+                    self._schedule_retry(job, sub, ex.response)
+                else:
+                    self.counters['failed'] += 1
+                    logger.error(f"Push failed: {repr(ex)}")
+            except Exception as e:
+                self.counters['failed'] += 1
+                logger.error(f"Push error: {e}")
+
+    def _schedule_retry(self, job: PushJob, sub: dict, response):
+        delay = self.retry_base * (2 ** job.attempt) * (1 + random.random() / 2)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        retry = PushJob(job.user_id, job.payload, [sub], job.attempt + 1, job.enqueued_at)
+        self.counters['retried'] += 1
+
+        def requeue():
+            self._retry_handles.discard(handle)
+            try:
+                self.queue.put_nowait(retry)
+            except asyncio.QueueFull:
+                self.counters['dropped'] += 1
+
+        handle = asyncio.get_running_loop().call_later(delay, requeue)
+        self._retry_handles.add(handle)
+
+    async def _prune_loop(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            await self.prune_dead()
+
+    async def prune_dead(self):
+        """Delete every dead subscription seen since the last call in one delete_many."""
+        if not self._dead_ids:
+            return
+        ids, self._dead_ids = list(self._dead_ids), set()
         try:
-            await asyncio.to_thread(
-                webpush,
-                subscription_info=sub["subscription"],
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims={"sub": VAPID_CLAIMS_EMAIL}
-            )
-        except WebPushException as ex:
-            logger.error(f"Push failed: {repr(ex)}")
-            # If subscription is dead, remove it
-            if ex.response and ex.response.status_code in [404, 410]:
-                await db.push_subscriptions.delete_one({"_id": sub["_id"]})
+            result = await self.subscriptions.delete_many({"_id": {"$in": ids}})
+            self.counters['pruned'] += result.deleted_count
         except Exception as e:
-            logger.error(f"Push error: {e}")
+            logger.error(f"Pruning push subscriptions failed: {e}")
+            self._dead_ids.update(ids)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        pick = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+        return {
+            **self.counters,
+            'queue_depth': self.queue.qsize(),
+            'pending_retries': len(self._retry_handles),
+            'latency_ms_p50': pick(0.5),
+            'latency_ms_p99': pick(0.99),
+        }
+
+    async def stop(self):
+        for handle in self._retry_handles:
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # A fresh queue so a restarted dispatcher is not tied to the old event loop
+        self.queue = asyncio.Queue(maxsize=self.queue.maxsize)
+        await self.prune_dead()
+
+
+push_dispatcher = PushDispatcher(db.push_subscriptions)
+
+
+def send_push_notification(user_id: str, payload: dict) -> bool:
+    """Queue a push for all of a user's subscriptions; never blocks the caller."""
+    if not VAPID_PRIVATE_KEY:
+        return False
+    return push_dispatcher.enqueue(PushJob(user_id, payload))
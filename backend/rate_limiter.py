@@ -1,24 +1,21 @@
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-import os
-import redis
 import logging
+from redis_pool import redis_pool
 
 logger = logging.getLogger(__name__)
 
-# Try connecting to Redis
-REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
-redis_client = None
-
-try:
-    client = redis.from_url(REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
-    if client.ping():
-        redis_client = client
-        logger.info("Connected to Redis for rate limiting.")
-except Exception as e:
-    logger.warning(f"Could not connect to Redis: {e}. Falling back to in-memory rate limiting.")
-
-if redis_client:
-    limiter = Limiter(key_func=get_remote_address, storage_uri=REDIS_URL)
+# slowapi's storage is synchronous, so it gets the blocking twin of the shared
+# pool (same URL, timeouts and connection cap). Nothing is contacted at import:
+# on the first storage error slowapi switches to in-memory counters and
+# re-probes Redis with exponential back-off.
+if redis_pool.url:
+    limiter = Limiter(
+        key_func=get_remote_address,
+        storage_uri=redis_pool.url,
+        storage_options={'connection_pool': redis_pool.sync_pool()},
+        in_memory_fallback_enabled=True
+    )
 else:
+    logger.info("REDIS_URL not set, rate limiting in memory.")
     limiter = Limiter(key_func=get_remote_address)
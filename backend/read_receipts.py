@@ -0,0 +1,183 @@
+"""
+Coalesced read receipts
+-------------------------
+Scrolling through a busy chat fires a `message_read` per message plus
+`messages_read_batch` bursts. Instead of a find, an update and a broadcast
+for each one, reads are collected per (user, conversation) for READ_FLUSH_MS
+and applied together:
+- one find to check the ids belong to the conversation and to pick out
+  vanish-mode messages
+- one `bulk_write` that moves each reader's watermark forward (read_state.py)
+  and resets their unread counter to the messages left above it
+- one `bulk_write` that starts the `expires_at` timers, only when some
+  vanish-mode message is in the batch
+- one merged `messages_read_batch` broadcast per (user, conversation), and
+  an `unread_count` event ({conversation_id, unread_count}, the absolute
+  count) to the reader's own room so their other devices update the
+  conversation list. Sends emit `unread_increment` ({conversation_id, by})
+  instead, since the writer never reads the counter back.
+
+Tuning (backend/.env):
+  READ_FLUSH_MS=250          # how long reads are coalesced
+  READ_MAX_PENDING=2000      # flush early once this many message ids are queued
+"""
+
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateMany
+
+from database import db
+from read_state import ReadState, read_state, advance_op
+from socket_instance import sio
+from presence import user_room
+
+logger = logging.getLogger(__name__)
+
+READ_FLUSH_MS = float(os.getenv('READ_FLUSH_MS', '250'))
+READ_MAX_PENDING = int(os.getenv('READ_MAX_PENDING', '2000'))
+
+
+def _iso(value) -> str:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class ReadReceiptPipeline:
+    def __init__(self, messages, state: ReadState, emit: Callable[..., Awaitable], flush_ms: float = READ_FLUSH_MS,
+                 max_pending: int = READ_MAX_PENDING):
+        self.messages = messages
+        self.state = state
+        self.emit = emit
+        self.flush_ms = flush_ms
+        self.max_pending = max_pending
+        # (user_id, conversation_id) -> message ids in arrival order (dict keys as an ordered set)
+        self._pending: Dict[Tuple[str, str], Dict[str, None]] = {}
+        self._pending_count = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        self.stats = {'events': 0, 'message_ids': 0, 'flushes': 0, 'write_ops': 0, 'broadcasts': 0,
+                      'failed': 0, 'flush_seconds': 0.0}
+
+    def add(self, user_id: str, conversation_id: str, message_ids: Iterable[str]):
+        """Queue a read event; it is written and broadcast with the rest of its window."""
+        ids = self._pending.setdefault((user_id, conversation_id), {})
+        before = len(ids)
+        ids.update(dict.fromkeys(message_ids))
+        self._pending_count += len(ids) - before
+        self.stats['events'] += 1
+        if self._pending_count >= self.max_pending or self.flush_ms <= 0:
+            self._start_flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.flush_ms / 1000)
+        self._flush_task = None
+        await self._flush(self._take_batch())
+
+    def _start_flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        task = asyncio.create_task(self._flush(self._take_batch()))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    def _take_batch(self) -> Dict[Tuple[str, str], List[str]]:
+        batch, self._pending, self._pending_count = self._pending, {}, 0
+        return {key: list(ids) for key, ids in batch.items() if ids}
+
+    async def _flush(self, batch: Dict[Tuple[str, str], List[str]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        all_ids = list({mid for ids in batch.values() for mid in ids})
+        reads: Dict[Tuple[str, str], List[str]] = {}
+        unread: Dict[Tuple[str, str], int] = {}
+        try:
+            found = await self.messages.find(
+                {'message_id': {'$in': all_ids}},
+                {'_id': 0, 'message_id': 1, 'conversation_id': 1, 'timestamp': 1, 'expires_in': 1, 'expires_at': 1}
+            ).to_list(len(all_ids))
+            by_id = {m['message_id']: m for m in found}
+
+            now = datetime.now(timezone.utc)
+            expires_at_map: Dict[str, str] = {}
+            starts: Dict[int, List[str]] = {}
+            for (user_id, conversation_id), ids in batch.items():
+                # Ids from another conversation (or made up) must not move this watermark
+                ids = [mid for mid in ids if by_id.get(mid, {}).get('conversation_id') == conversation_id]
+                if not ids:
+                    continue
+                reads[(user_id, conversation_id)] = ids
+                for mid in ids:
+                    msg = by_id[mid]
+                    if msg.get('expires_at'):
+                        expires_at_map[mid] = _iso(msg['expires_at'])
+                    elif msg.get('expires_in', 0) > 0 and mid not in expires_at_map:
+                        starts.setdefault(msg['expires_in'], []).append(mid)
+                        expires_at_map[mid] = (now + timedelta(seconds=msg['expires_in'])).isoformat()
+
+            # The counter becomes what is left above the watermark after this read
+            current = await self.state.get_many(reads)
+            marks = {key: max(max(ids), current.get(key, {}).get('last_read_id') or '') for key, ids in reads.items()}
+            counts = await asyncio.gather(*(self.state.count_unread(u, c, marks[(u, c)]) for u, c in reads))
+            unread = dict(zip(reads, counts))
+            watermark_ops = []
+            for (user_id, conversation_id), ids in reads.items():
+                newest = by_id[max(ids)]
+                watermark_ops.append(advance_op(user_id, conversation_id, newest['message_id'],
+                                                newest.get('timestamp', ''), unread=unread[(user_id, conversation_id)]))
+
+            await self.state.advance(watermark_ops)
+            # One update per distinct timer length; `expires_at: None` keeps the first start
+            timer_ops = [
+                UpdateMany({'message_id': {'$in': ids}, 'expires_at': None},
+                           {'$set': {'expires_at': now + timedelta(seconds=expires_in)}})
+                for expires_in, ids in starts.items()
+            ]
+            if timer_ops:
+                await self.messages.bulk_write(timer_ops, ordered=False)
+            self.stats['write_ops'] += len(watermark_ops) + len(timer_ops)
+        except Exception as e:
+            logger.error(f"Read receipt flush failed: {e}")
+            self.stats['failed'] += len(batch)
+            return
+        finally:
+            self.stats['flushes'] += 1
+            self.stats['message_ids'] += len(all_ids)
+            self.stats['flush_seconds'] += time.perf_counter() - started
+
+        for (user_id, conversation_id), ids in reads.items():
+            try:
+                await self.emit('messages_read_batch', {
+                    'conversation_id': conversation_id,
+                    'message_ids': ids,
+                    'user_id': user_id,
+                    'last_read_id': max(ids),
+                    'expires_at_map': {mid: expires_at_map[mid] for mid in ids if mid in expires_at_map},
+                }, room=conversation_id)
+                await self.emit('unread_count', {
+                    'conversation_id': conversation_id,
+                    'unread_count': unread[(user_id, conversation_id)],
+                }, room=user_room(user_id))
+                self.stats['broadcasts'] += 1
+            except Exception as e:
+                logger.error(f"Read receipt broadcast failed: {e}")
+
+    async def close(self):
+        """Apply anything still queued (called on shutdown)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush(self._take_batch())
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+
+# Global pipeline shared by the message_read and messages_read_batch handlers
+read_receipts = ReadReceiptPipeline(db.messages, read_state, sio.emit)
@@ -0,0 +1,198 @@
+"""
+Per-conversation read watermarks
+----------------------------------
+Instead of adding every reader to every message's `read_by` array, each
+(conversation, user) has one small `read_state` document holding the newest
+message the user has read (`last_read_id`, `last_read_at`). Message IDs sort
+in creation order, so a message counts as read by a user when its ID is at or
+below their watermark. Advancing a watermark is a single `$max` upsert, and
+it never moves backwards.
+
+`apply_read_by()` is the compatibility shim. It fills each message's
+`read_by` from the watermarks (merged with any legacy array on the document),
+so existing clients keep showing per-message receipts.
+
+Each document also carries the user's `unread` counter for the conversation.
+Sends bump it with `$inc` (batched by message_writer.py), and read flushes
+reset it to what is left above the new watermark (read_receipts.py), so the
+conversation list reads counters instead of counting messages. Only counters
+that already exist are bumped: a document without one (never listed, or a
+watermark from the backfill) is counted from the messages on first listing.
+The counter can drift: a read racing a send, deletions, vanish-mode expiry;
+`scripts/reconcile_unread.py` recounts everything from the messages.
+
+`scripts/backfill_read_state.py` builds watermarks from legacy `read_by` arrays.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+
+def advance_op(user_id: str, conversation_id: str, message_id: str, timestamp: str,
+               unread: Optional[int] = None) -> UpdateOne:
+    """Move a user's watermark forward to `message_id` (no-op if it is already past it)."""
+    fields = {'updated_at': datetime.now(timezone.utc).isoformat()}
+    if unread is not None:
+        fields['unread'] = unread
+    return UpdateOne(
+        {'conversation_id': conversation_id, 'user_id': user_id},
+        {'$max': {'last_read_id': message_id, 'last_read_at': timestamp}, '$set': fields},
+        upsert=True
+    )
+
+
+def unread_filter(user_id: str, conversation_id: str, after: str) -> dict:
+    """Messages from others in a conversation above a watermark ('' for none)."""
+    return {
+        'conversation_id': conversation_id,
+        'message_id': {'$gt': after},
+        'sender_id': {'$ne': user_id},
+        'is_deleted': {'$ne': True},
+    }
+
+
+def apply_read_by(messages: List[dict], watermarks: Dict[str, str]) -> List[dict]:
+    """Per-message `read_by` for existing clients, derived from the watermarks (in place)."""
+    for msg in messages:
+        readers = dict.fromkeys(msg.get('read_by') or [])
+        if msg.get('sender_id'):
+            readers[msg['sender_id']] = None
+        for user_id, last_read_id in watermarks.items():
+            if last_read_id >= msg['message_id']:
+                readers[user_id] = None
+        msg['read_by'] = list(readers)
+    return messages
+
+
+class ReadState:
+    def __init__(self, collection, messages):
+        self.collection = collection
+        self.messages = messages
+
+    async def advance(self, ops: List[UpdateOne]):
+        if ops:
+            await self.collection.bulk_write(ops, ordered=False)
+
+    async def increment(self, counts: Dict[Tuple[str, str], int]):
+        """
+        Add to unread counters, {(user_id, conversation_id): n}, in one bulk
+        write. Counters that do not exist yet are left for counters() to count:
+        starting them at n would miss every message sent before.
+        """
+        if not counts:
+            return
+        await self.collection.bulk_write([
+            UpdateOne({'conversation_id': conversation_id, 'user_id': user_id, 'unread': {'$exists': True}},
+                      {'$inc': {'unread': n}})
+            for (user_id, conversation_id), n in counts.items()
+        ], ordered=False)
+
+    async def get_many(self, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], dict]:
+        """Read state documents for (user_id, conversation_id) pairs, in one query."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        docs = await self.collection.find(
+            {'$or': [{'user_id': u, 'conversation_id': c} for u, c in keys]},
+            {'_id': 0, 'user_id': 1, 'conversation_id': 1, 'last_read_id': 1, 'unread': 1}
+        ).to_list(len(keys))
+        return {(d['user_id'], d['conversation_id']): d for d in docs}
+
+    async def count_unread(self, user_id: str, conversation_id: str, after: str) -> int:
+        return await self.messages.count_documents(unread_filter(user_id, conversation_id, after))
+
+    async def remove_conversation(self, conversation_id: str):
+        await self.collection.delete_many({'conversation_id': conversation_id})
+
+    async def remove_user(self, user_id: str):
+        await self.collection.delete_many({'user_id': user_id})
+
+    async def watermarks(self, conversation_id: str) -> Dict[str, str]:
+        """{user_id: last_read_id} for everyone who has read something in a conversation."""
+        docs = await self.collection.find(
+            {'conversation_id': conversation_id},
+            {'_id': 0, 'user_id': 1, 'last_read_id': 1}
+        ).to_list(None)
+        return {d['user_id']: d['last_read_id'] for d in docs if d.get('last_read_id')}
+
+    async def for_user(self, user_id: str, conversation_ids: Iterable[str]) -> Dict[str, dict]:
+        """{conversation_id: {last_read_id, unread}} for one user; either field may be missing."""
+        conversation_ids = list(conversation_ids)
+        if not conversation_ids:
+            return {}
+        docs = await self.collection.find(
+            {'user_id': user_id, 'conversation_id': {'$in': conversation_ids}},
+            {'_id': 0, 'conversation_id': 1, 'last_read_id': 1, 'unread': 1}
+        ).to_list(len(conversation_ids))
+        return {d['conversation_id']: d for d in docs}
+
+    async def counters(self, user_id: str, conversations: List[dict]) -> Dict[str, dict]:
+        """
+        {conversation_id: {last_read_id, unread}} for the conversation list.
+        Stored counters are used as they are; conversations that have none yet
+        (created before counters, or never read) are counted once and the
+        result is stored.
+        """
+        states = await self.for_user(user_id, [c['conversation_id'] for c in conversations])
+        missing = [c for c in conversations if 'unread' not in states.get(c['conversation_id'], {})]
+        if missing:
+            watermarks = {cid: s['last_read_id'] for cid, s in states.items() if s.get('last_read_id')}
+            counts = await self.unread_counts(user_id, missing, watermarks)
+            await self.set_unread({(user_id, c['conversation_id']): counts.get(c['conversation_id'], 0) for c in missing})
+            for conv in missing:
+                state = states.setdefault(conv['conversation_id'], {'conversation_id': conv['conversation_id']})
+                state['unread'] = counts.get(conv['conversation_id'], 0)
+        return states
+
+    async def set_unread(self, counts: Dict[Tuple[str, str], int]):
+        if not counts:
+            return
+        await self.collection.bulk_write([
+            UpdateOne({'conversation_id': conversation_id, 'user_id': user_id}, {'$set': {'unread': n}}, upsert=True)
+            for (user_id, conversation_id), n in counts.items()
+        ], ordered=False)
+
+    async def reconcile(self, conversation_id: str, participants: Iterable[str]) -> Dict[str, int]:
+        """Recount every participant's unread counter from the messages and store it."""
+        participants = list(participants)
+        marks = await self.watermarks(conversation_id)
+        counts = await asyncio.gather(*(
+            self.count_unread(user_id, conversation_id, marks.get(user_id, '')) for user_id in participants
+        ))
+        result = dict(zip(participants, counts))
+        await self.set_unread({(user_id, conversation_id): n for user_id, n in result.items()})
+        return result
+
+    async def unread_counts(self, user_id: str, conversations: List[dict],
+                            watermarks: Dict[str, str]) -> Dict[str, int]:
+        """
+        Messages from others above the user's watermark, per conversation. The
+        denormalized last_message skips conversations that are fully read, and
+        the rest are counted in one aggregation using the
+        (conversation_id, message_id) index.
+        """
+        branches = []
+        for conv in conversations:
+            last = conv.get('last_message') or {}
+            mark = watermarks.get(conv['conversation_id'], '')
+            if last.get('message_id') and last['message_id'] > mark:
+                branches.append({'conversation_id': conv['conversation_id'], 'message_id': {'$gt': mark}})
+        if not branches:
+            return {}
+        rows = await self.messages.aggregate([
+            {'$match': {'$or': branches, 'sender_id': {'$ne': user_id}, 'is_deleted': {'$ne': True}}},
+            {'$group': {'_id': '$conversation_id', 'count': {'$sum': 1}}},
+        ]).to_list(None)
+        return {row['_id']: row['count'] for row in rows}
+
+
+# Global read state used by the read receipt pipeline and the chat router
+read_state = ReadState(db.read_state, db.messages)
@@ -0,0 +1,147 @@
+"""
+Shared Redis connections
+--------------------------
+One `redis.asyncio` connection pool per process, used by request handlers
+(OTPs), presence, the Nova rate limit and the spam limiter, plus a synchronous twin pool with the
+same settings for slowapi, whose storage layer is synchronous.
+
+Calls made through `redis_pool.call()` or `redis_pool.pipeline()` never raise
+on Redis trouble: a failure marks Redis as down for REDIS_RETRY_SECONDS and
+the caller gets the default back, so it can take its fallback path (e.g. the
+Mongo `otps` collection) without waiting on a dead server again for every
+request.
+
+Tuning (backend/.env):
+  REDIS_URL=redis://localhost:6379/0   # empty disables Redis entirely
+  REDIS_MAX_CONNECTIONS=64
+  REDIS_SOCKET_TIMEOUT=0.5             # seconds, connect and read
+  REDIS_RETRY_SECONDS=5                # back-off after a failure
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Iterable, Optional, Sequence
+
+import redis
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '64'))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.5'))
+REDIS_RETRY_SECONDS = float(os.getenv('REDIS_RETRY_SECONDS', '5'))
+
+_FAILURES = (RedisError, OSError, asyncio.TimeoutError)
+
+
+class RedisPool:
+    def __init__(self, url: str = REDIS_URL, max_connections: int = REDIS_MAX_CONNECTIONS,
+                 socket_timeout: float = REDIS_SOCKET_TIMEOUT, retry_seconds: float = REDIS_RETRY_SECONDS,
+                 clock=time.monotonic):
+        self.url = url or None
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self.retry_seconds = retry_seconds
+        self.clock = clock
+        self._client: Optional[aioredis.Redis] = None
+        self._sync_pool: Optional[redis.ConnectionPool] = None
+        self._down_until = 0.0
+        self.last_error: Optional[str] = None
+        self.counters = {'calls': 0, 'failures': 0, 'skipped': 0}
+
+    def _pool_options(self) -> dict:
+        return {
+            'max_connections': self.max_connections,
+            'socket_timeout': self.socket_timeout,
+            'socket_connect_timeout': self.socket_timeout,
+            'health_check_interval': 30,
+        }
+
+    @property
+    def client(self) -> Optional[aioredis.Redis]:
+        """The shared asyncio client (None when Redis is not configured)."""
+        if self.url is None:
+            return None
+        if self._client is None:
+            pool = aioredis.ConnectionPool.from_url(self.url, **self._pool_options())
+            self._client = aioredis.Redis(connection_pool=pool)
+        return self._client
+
+    def sync_pool(self) -> Optional[redis.ConnectionPool]:
+        """Blocking pool with the same settings, for libraries without asyncio support."""
+        if self.url is None:
+            return None
+        if self._sync_pool is None:
+            self._sync_pool = redis.ConnectionPool.from_url(self.url, **self._pool_options())
+        return self._sync_pool
+
+    def available(self) -> bool:
+        """False when Redis is unconfigured or failed within the last retry window."""
+        return self.url is not None and self.clock() >= self._down_until
+
+    def mark_down(self, error: Exception):
+        if self.available():
+            logger.warning(f"Redis unavailable, using fallbacks for {self.retry_seconds}s: {error}")
+        self._down_until = self.clock() + self.retry_seconds
+        self.last_error = str(error)
+        self.counters['failures'] += 1
+
+    async def call(self, command: str, *args, default: Any = None, **kwargs) -> Any:
+        """
+        Run one client command, e.g. `await redis_pool.call('get', key)`.
+        Returns `default` instead of raising when Redis is down or the command fails.
+        """
+        if not self.available():
+            self.counters['skipped'] += 1
+            return default
+        self.counters['calls'] += 1
+        try:
+            return await getattr(self.client, command)(*args, **kwargs)
+        except _FAILURES as e:
+            self.mark_down(e)
+            return default
+
+    async def pipeline(self, commands: Iterable[Sequence], transaction: bool = True, default: Any = None) -> Any:
+        """
+        Run several commands in one round trip, e.g. `[('zcard', key), ('expire', key, 60)]`,
+        inside MULTI/EXEC when `transaction`. Returns the list of results, or
+        `default` on Redis trouble exactly like call().
+        """
+        if not self.available():
+            self.counters['skipped'] += 1
+            return default
+        self.counters['calls'] += 1
+        try:
+            async with self.client.pipeline(transaction=transaction) as pipe:
+                for command, *args in commands:
+                    getattr(pipe, command)(*args)
+                return await pipe.execute()
+        except _FAILURES as e:
+            self.mark_down(e)
+            return default
+
+    async def ping(self) -> bool:
+        return bool(await self.call('ping', default=False))
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            'configured': self.url is not None,
+            'available': self.available(),
+            'last_error': self.last_error,
+        }
+
+    async def close(self):
+        """Drop every pooled connection (shutdown). The pools reconnect on next use."""
+        if self._client is not None:
+            await self._client.connection_pool.disconnect()
+        if self._sync_pool is not None:
+            self._sync_pool.disconnect()
+
+
+# Global pool shared by every Redis user in this process
+redis_pool = RedisPool()
@@ -1,55 +1,125 @@
-from fastapi import APIRouter, HTTPException, Depends, Response, Request, BackgroundTasks
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Response, Request
 from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError
 from google.oauth2 import id_token
 from google.auth.transport import requests
 
 from database import db
 from models import UserRegister, OTPVerify, UserLogin, ChangePassword
 from utils import (
-    generate_otp, hash_password, verify_password, 
-    create_access_token, create_refresh_token, send_email_func, GOOGLE_CLIENT_ID
+    generate_otp, normalize_email, create_access_token, create_refresh_token, GOOGLE_CLIENT_ID
 )
-from dependencies import get_current_user
-from rate_limiter import limiter, redis_client
+from dependencies import get_current_user, invalidate_principal
+from rate_limiter import limiter
+from redis_pool import redis_pool
+from password_hasher import password_hasher, PasswordHasherBusy
+from email_outbox import email_outbox
+from user_search import user_search
+from avatars import build_avatar
+from read_state import read_state
+from conversation_cache import conversation_cache
+from ids import new_id
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/auth", tags=["Auth"])
 
+OTP_TTL_SECONDS = 600
+
+
+async def _store_otp(email: str, otp: str):
+    """Keep the OTP in Redis with a TTL; the Mongo `otps` collection is the fallback store."""
+    if await redis_pool.call('setex', f"otp:{email}", OTP_TTL_SECONDS, otp, default=False):
+        return
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=OTP_TTL_SECONDS)
+    await db.otps.delete_many({'email': email})
+    await db.otps.insert_one({
+        'email': email,
+        'otp': otp,
+        'expires_at': expires_at.isoformat()
+    })
+
+
+async def _consume_otp(email: str, otp: str) -> bool:
+    """Check an OTP against Redis, then Mongo, deleting it once it matches."""
+    stored_otp = await redis_pool.call('get', f"otp:{email}")
+    if stored_otp and stored_otp.decode('utf-8') == otp:
+        await redis_pool.call('delete', f"otp:{email}")
+        return True
+
+    otp_doc = await db.otps.find_one({'email': email})
+    if not otp_doc or datetime.fromisoformat(otp_doc['expires_at']) < datetime.now(timezone.utc) or otp_doc['otp'] != otp:
+        return False
+    await db.otps.delete_many({'email': email})
+    return True
+
+
+async def _hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail='Server busy, try again shortly', headers={'Retry-After': '1'})
+
+
+async def _verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail='Server busy, try again shortly', headers={'Retry-After': '1'})
+
+
+def _login_query(login: str) -> dict:
+    """Email (case-insensitive through email_normalized) or exact username; both are index lookups."""
+    return {'$or': [{'email_normalized': normalize_email(login)}, {'username': login}]}
+
+
+async def _find_user(query: dict, email: str) -> Optional[dict]:
+    """
+    find_one by `query`, falling back to accounts from before email_normalized
+    existed (scripts/migrate_email_normalized.py not run yet). The fallback
+    matches `email` as typed or lower-cased, on the unique email index, and
+    fills in the account's email_normalized so the next lookup needs no fallback.
+    """
+    user = await db.users.find_one(query)
+    if user is not None or '@' not in email:
+        return user
+    user = await db.users.find_one({
+        'email': {'$in': list(dict.fromkeys([email.strip(), normalize_email(email)]))},
+        'email_normalized': {'$exists': False},
+    })
+    if user is None:
+        return None
+    key = normalize_email(user['email'])
+    try:
+        await db.users.update_one({'user_id': user['user_id'], 'email_normalized': {'$exists': False}},
+                                  {'$set': {'email_normalized': key}})
+    except DuplicateKeyError:
+        # Another account differing only by case holds the key; the migration reports it
+        logger.warning(f"email_normalized {key} already taken, left unset for {user['user_id']}")
+    return user
+
+
 @router.post('/register')
 @limiter.limit("5/minute")
-async def register(request: Request, user_data: UserRegister, background_tasks: BackgroundTasks):
-    existing = await db.users.find_one({
-        '$or': [{'email': user_data.email}, {'username': user_data.username}]
-    })
+async def register(request: Request, user_data: UserRegister):
+    existing = await _find_user({
+        '$or': [{'email_normalized': normalize_email(user_data.email)}, {'username': user_data.username}]
+    }, user_data.email)
     if existing:
         raise HTTPException(status_code=400, detail='User already exists')
     
     otp = generate_otp()
-    expires_at = datetime.now(timezone.utc) + timedelta(minutes=10)
-    
-    if redis_client:
-        try:
-            # 600 seconds = 10 minutes
-            redis_client.setex(f"otp:{user_data.email}", 600, otp)
-        except Exception:
-            await db.otps.delete_many({'email': user_data.email})
-            await db.otps.insert_one({
-                'email': user_data.email,
-                'otp': otp,
-                'expires_at': expires_at.isoformat()
-            })
-    else:
-        await db.otps.delete_many({'email': user_data.email})
-        await db.otps.insert_one({
-            'email': user_data.email,
-            'otp': otp,
-            'expires_at': expires_at.isoformat()
-        })
+    await _store_otp(user_data.email, otp)
     
+    password_hash = await _hash_password(user_data.password)
     await db.pending_users.delete_many({'email': user_data.email})
     await db.pending_users.insert_one({
         'email': user_data.email,
         'username': user_data.username,
-        'password_hash': hash_password(user_data.password),
+        'password_hash': password_hash,
         'real_name': user_data.real_name,
         'unique_id': user_data.unique_id,
         'public_key': user_data.public_key,
@@ -58,43 +128,32 @@ async def register(request: Request, user_data: UserRegister, background_tasks:
     
     html = f"<h2>Welcome to QuickChat!</h2><p>Your OTP is: <b>{otp}</b></p>"
     
-    # Send email in the background so the user gets an immediate response
-    background_tasks.add_task(send_email_func, user_data.email, "QuickChat - Verification Code", html)
+    # Queued in the outbox; the sender task delivers it so the user gets an immediate response
+    await email_outbox.enqueue(user_data.email, "QuickChat - Verification Code", html)
     
     return {'message': 'OTP sent'}
 
 @router.post('/verify-otp')
 @limiter.limit("5/minute")
 async def verify_otp(request: Request, data: OTPVerify, response: Response):
-    otp_valid = False
-    if redis_client:
-        try:
-            stored_otp = redis_client.get(f"otp:{data.email}")
-            if stored_otp and stored_otp.decode('utf-8') == data.otp:
-                otp_valid = True
-                redis_client.delete(f"otp:{data.email}")
-        except Exception:
-            pass
-
-    if not otp_valid:
-        otp_doc = await db.otps.find_one({'email': data.email})
-        if not otp_doc or datetime.fromisoformat(otp_doc['expires_at']) < datetime.now(timezone.utc) or otp_doc['otp'] != data.otp:
-            raise HTTPException(status_code=400, detail='Invalid or expired OTP')
-        await db.otps.delete_many({'email': data.email})
+    if not await _consume_otp(data.email, data.otp):
+        raise HTTPException(status_code=400, detail='Invalid or expired OTP')
     
     pending = await db.pending_users.find_one({'email': data.email})
     if not pending:
         raise HTTPException(status_code=400, detail='User data missing')
     
-    user_id = f"user_{datetime.now(timezone.utc).timestamp()}".replace('.', '_')
+    user_id = new_id('user')
     user_doc = {
         'user_id': user_id,
         'email': pending['email'],
+        'email_normalized': normalize_email(pending['email']),
         'username': pending['username'],
         'password_hash': pending['password_hash'],
         'real_name': pending['real_name'],
         'unique_id': pending['unique_id'],
         'profile_photo': '',
+        'avatar': None,
         'bio': '',
         'online_status': 'offline',
         'verified': True,
@@ -104,6 +163,7 @@ async def verify_otp(request: Request, data: OTPVerify, response: Response):
     }
     
     await db.users.insert_one(user_doc)
+    await user_search.index_user(user_doc)
     await db.pending_users.delete_many({'email': data.email})
     await db.pending_users.delete_many({'email': data.email})
     
@@ -127,15 +187,14 @@ async def verify_otp(request: Request, data: OTPVerify, response: Response):
 @router.post('/login')
 @limiter.limit("10/minute")
 async def login(request: Request, data: UserLogin, response: Response):
-    # Case-insensitive lookup for email, exact match for username
-    user = await db.users.find_one({
-        '$or': [
-            {'email': {'$regex': f'^{data.login}$', '$options': 'i'}}, 
-            {'username': data.login}
-        ]
-    })
-    if not user or not verify_password(data.password, user['password_hash']):
+    user = await _find_user(_login_query(data.login), data.login)
+    if not user or not await _verify_password(data.password, user.get('password_hash')):
         raise HTTPException(status_code=401, detail='Invalid credentials')
+
+    # Upgrade hashes made with an older BCRYPT_ROUNDS while we have the plaintext
+    new_hash = await password_hasher.rehash_if_needed(data.password, user['password_hash'])
+    if new_hash:
+        await db.users.update_one({'user_id': user['user_id']}, {'$set': {'password_hash': new_hash}})
     
     access_token = create_access_token({'sub': user['user_id']})
     refresh_token = create_refresh_token({'sub': user['user_id']})
@@ -184,15 +243,13 @@ async def google_auth(request: Request, response: Response):
         print(f"Google Auth Error: {e}")
         raise HTTPException(status_code=401, detail=f"Invalid Google token: {str(e)}")
 
-    # Make case-insensitive query for email
-    email_regex = {'$regex': f"^{email}$", '$options': 'i'}
-    user = await db.users.find_one({'email': email_regex})
+    user = await _find_user({'email_normalized': normalize_email(email)}, email)
     is_new_user = False
     
     if not user:
         # User does not exist, create them immediately
         is_new_user = True
-        user_id = f"user_{datetime.now(timezone.utc).timestamp()}".replace('.', '_')
+        user_id = new_id('user')
         username = f"{email.split('@')[0]}{int(datetime.now(timezone.utc).timestamp()) % 10000}"
         
         # We enforce a public key if it's a new user
@@ -202,11 +259,13 @@ async def google_auth(request: Request, response: Response):
         user = {
             'user_id': user_id,
             'email': email,
+            'email_normalized': normalize_email(email),
             'username': username,
             'password_hash': '', # No password for Google users
             'real_name': real_name,
             'unique_id': username, # use generated username as unique_id initially
             'profile_photo': profile_photo,
+            'avatar': await build_avatar(profile_photo),
             'bio': '',
             'online_status': 'offline',
             'verified': True,
@@ -215,6 +274,7 @@ async def google_auth(request: Request, response: Response):
             'blocked_users': []
         }
         await db.users.insert_one(user)
+        await user_search.index_user(user)
     
     access_token = create_access_token({'sub': user['user_id']})
     refresh_token = create_refresh_token({'sub': user['user_id']})
@@ -249,18 +309,23 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 @router.post('/change-password')
 async def change_password(data: ChangePassword, current_user: dict = Depends(get_current_user)):
     user = await db.users.find_one({'user_id': current_user['user_id']})
-    if not verify_password(data.old_password, user['password_hash']):
+    if not await _verify_password(data.old_password, user.get('password_hash')):
         raise HTTPException(status_code=400, detail="Incorrect old password")
     
-    new_hash = hash_password(data.new_password)
+    new_hash = await _hash_password(data.new_password)
     await db.users.update_one({'user_id': current_user['user_id']}, {'$set': {'password_hash': new_hash}})
+    invalidate_principal(current_user['user_id'])
     return {"message": "Password updated successfully"}
 
 @router.delete('/delete-account')
 async def delete_account(current_user: dict = Depends(get_current_user)):
     user_id = current_user['user_id']
     await db.users.delete_one({'user_id': user_id})
+    await user_search.remove_user(user_id)
+    await read_state.remove_user(user_id)
+    invalidate_principal(user_id)
     await db.conversations.update_many({}, {'$pull': {'participants': user_id}})
+    conversation_cache.invalidate_user(user_id)
     return {"message": "Account deleted successfully"}
 
 @router.post('/refresh')
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends, Body, Request
+import asyncio
+from fastapi import APIRouter, HTTPException, Depends, Body, Request, Response, Query
 from typing import Optional
 from datetime import datetime, timezone, timedelta
 from bson import ObjectId
@@ -7,11 +8,20 @@ from database import db
 from models import ConversationCreate
 from dependencies import get_current_user
 from spam_protection import spam_protection
-from encryption import encrypt_message, decrypt_message
-from socket_instance import sio, active_users
+from encryption import encrypt_message, decrypt_message, decrypt_many
+from utils import encode_cursor, decode_cursor
+from ids import new_id
+from socket_instance import sio, presence
+from presence import user_room
 from push_service import send_push_notification
 from rate_limiter import limiter
-from cloudinary_utils import upload_to_cdn, is_cdn_enabled
+from media_storage import store_attachment
+from blob_store import with_blob_url, request_base_url
+from avatars import list_avatar
+from read_state import read_state, apply_read_by
+from typing_indicators import typing_tracker
+from message_writer import message_writer
+from conversation_cache import conversation_cache
 
 router = APIRouter(prefix="/api", tags=["Chat"])
 
@@ -25,7 +35,7 @@ async def create_conversation(request: Request, data: ConversationCreate, curren
     if existing:
         return {k: v for k, v in existing.items() if k != '_id'}
     
-    conv_id = f"conv_{datetime.now(timezone.utc).timestamp()}".replace('.', '_')
+    conv_id = new_id('conv')
     doc = {
         'conversation_id': conv_id,
         'type': 'direct',
@@ -36,60 +46,50 @@ async def create_conversation(request: Request, data: ConversationCreate, curren
         'archived_by': []
     }
     await db.conversations.insert_one(doc)
+    conversation_cache.invalidate(conv_id)
     return {k: v for k, v in doc.items() if k != '_id'}
 
 @router.get('/conversations')
-async def get_conversations(current_user: dict = Depends(get_current_user)):
+async def get_conversations(
+    request: Request,
+    response: Response,
+    limit: int = Query(default=100, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     user_id = current_user['user_id']
     # Threshold for "New" conversations (last 30 minutes)
     new_threshold = (datetime.now(timezone.utc) - timedelta(minutes=30)).isoformat()
     
-    pipeline = [
-        # Step 1: Filter conversations this user belongs to (not archived)
-        {
-            '$match': {
-                'participants': user_id,
-                'archived_by': {'$ne': user_id}
-            }
-        },
-        # Step 2: Join the last message in each conversation
-        {
-            '$lookup': {
-                'from': 'messages',
-                'let': { 'conv_id': '$conversation_id' },
-                'pipeline': [
-                    { '$match': { '$expr': { '$eq': ['$conversation_id', '$$conv_id'] } } },
-                    { '$sort': { 'timestamp': -1 } },
-                    { '$limit': 1 },
-                    { '$project': { '_id': 0 } }
-                ],
-                'as': 'last_message_arr'
-            }
-        },
-        # Step 3: Flatten last_message array → single object or null
-        {
-            '$addFields': {
-                'last_message': { '$arrayElemAt': ['$last_message_arr', 0] }
-            }
-        },
-        # Step 4: Privacy Filter - Only show if has messages, is pinned, OR is very new
-        {
-            '$match': {
-                '$or': [
-                    { 'last_message': { '$ne': None } },
-                    { 'pinned_by': user_id },
-                    { 'created_at': { '$gte': new_threshold } }
-                ]
-            }
-        },
-        # Step 5: Sort and limit
-        { '$sort': { 'updated_at': -1 } },
-        { '$limit': 100 },
-        { '$unset': 'last_message_arr' },
-        { '$project': { '_id': 0 } }
-    ]
+    # last_message is denormalized onto the conversation by the send path, so this is
+    # a single find on the (participants, updated_at) index instead of a $lookup per row.
+    query: dict = {
+        'participants': user_id,
+        'archived_by': {'$ne': user_id},
+        # Privacy Filter - Only show if has messages, is pinned, OR is very new
+        '$or': [
+            { 'last_message': { '$ne': None } },
+            { 'pinned_by': user_id },
+            { 'created_at': { '$gte': new_threshold } }
+        ]
+    }
+    if cursor:
+        try:
+            after_updated_at, after_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query['$and'] = [{'$or': [
+            {'updated_at': {'$lt': after_updated_at}},
+            {'updated_at': after_updated_at, 'conversation_id': {'$lt': after_id}}
+        ]}]
 
-    convs = await db.conversations.aggregate(pipeline).to_list(100)
+    convs = await db.conversations.find(query, {'_id': 0}) \
+        .sort([('updated_at', -1), ('conversation_id', -1)]) \
+        .limit(limit).to_list(limit)
+
+    # Next page cursor travels in a header so the body stays a plain list for existing clients
+    if len(convs) == limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(convs[-1].get('updated_at'), convs[-1]['conversation_id'])
 
     # Collect all unique other-user IDs in one pass
     other_ids = []
@@ -104,16 +104,28 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
     # Fetch all other users in a SINGLE query
     users_cursor = db.users.find(
         {'user_id': {'$in': other_ids}},
-        {'_id': 0, 'user_id': 1, 'username': 1, 'real_name': 1, 'profile_photo': 1, 'online_status': 1, 'public_key': 1}
+        {'_id': 0, 'user_id': 1, 'username': 1, 'real_name': 1, 'avatar': 1, 'public_key': 1}
     )
     users_list = await users_cursor.to_list(len(other_ids))
-    users_map = {u['user_id']: u for u in users_list}
+    # Avatar URL + version instead of the inline profile_photo (see avatars.py)
+    base_url = request_base_url(request)
+    users_map = {u['user_id']: list_avatar(u, base_url) for u in users_list}
+    # Live status from the presence registry rather than the users.online_status mirror
+    online = await presence.online_users(users_map)
+    for uid, u in users_map.items():
+        u['online_status'] = 'online' if uid in online else 'offline'
+
+    # Read position and unread counter from the user's read state (see read_state.py)
+    states = await read_state.counters(user_id, convs)
 
     # Assemble final response
     for conv in convs:
         other_id = conv.pop('_other_id')
         conv['other_user'] = users_map.get(other_id)
         conv['is_pinned'] = user_id in conv.get('pinned_by', [])
+        state = states.get(conv['conversation_id'], {})
+        conv['last_read_id'] = state.get('last_read_id')
+        conv['unread_count'] = max(state.get('unread', 0), 0)
 
         # Decrypt last message preview
         last_msg = conv.get('last_message')
@@ -129,7 +141,10 @@ async def get_conversations(current_user: dict = Depends(get_current_user)):
 @router.get('/conversations/{conversation_id}/messages')
 async def get_messages(
     conversation_id: str,
-    limit: int = 50,
+    request: Request,
+    response: Response,
+    limit: int = Query(default=50, ge=1, le=1000),
+    cursor: Optional[str] = None,
     before: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
@@ -137,10 +152,19 @@ async def get_messages(
 ):
     query: dict = {'conversation_id': conversation_id}
     
+    # message_id is unique and time-ordered, so paging on (conversation_id, message_id)
+    # never skips or repeats messages that share a timestamp.
+    if cursor:
+        try:
+            before_id, = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query['message_id'] = {'$lt': before_id}
+
     ts_query: dict = {}
-    if before:
-        # Note: messages are sorted by timestamp DESCending. 
-        # So "before" means older than the provided timestamp.
+    if before and not cursor:
+        # Legacy timestamp paging, kept for older clients.
+        # "before" means older than the provided timestamp.
         ts_query['$lt'] = before
     
     if start_date:
@@ -151,17 +175,21 @@ async def get_messages(
     if ts_query:
         query['timestamp'] = ts_query
 
-    messages = await db.messages.find(query, {'_id': 0}).sort('timestamp', -1).limit(limit).to_list(limit)
+    messages = await db.messages.find(query, {'_id': 0}).sort('message_id', -1).limit(limit).to_list(limit)
+    if len(messages) == limit:
+        response.headers['X-Next-Cursor'] = encode_cursor(messages[-1]['message_id'])
     
-    for msg in messages:
+    # Large pages are decrypted off the event loop; repeat fetches hit the cache
+    plaintexts = await decrypt_many([msg.get('content') or '' for msg in messages])
+    base_url = request_base_url(request)
+    for msg, plaintext in zip(messages, plaintexts):
         if msg.get('content'):
-            try:
-                msg['content'] = decrypt_message(msg['content'])
-            except Exception:
-                pass # Continue processing other messages on error
+            msg['content'] = plaintext
+        with_blob_url(msg, base_url)
         
     messages.reverse()
-    return messages
+    # read_by for existing clients, derived from the participants' read watermarks
+    return apply_read_by(messages, await read_state.watermarks(conversation_id))
 
 @router.post('/conversations/{conversation_id}/messages')
 @limiter.limit("60/minute")
@@ -176,12 +204,12 @@ async def save_attachment_message(
     expires_in: Optional[int] = Body(default=0),
     current_user: dict = Depends(get_current_user)
 ):
-    is_spam, reason = spam_protection.check_spam(current_user['user_id'])
+    is_spam, reason = await spam_protection.check_spam(current_user['user_id'])
     if is_spam:
         raise HTTPException(status_code=429, detail=reason)
 
     # Blocked check
-    conv = await db.conversations.find_one({'conversation_id': conversation_id})
+    conv = await conversation_cache.get(conversation_id)
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
         
@@ -194,25 +222,20 @@ async def save_attachment_message(
         if current_user['user_id'] in recipient.get('blocked_users', []) or other_id in current_user.get('blocked_users', []):
              raise HTTPException(status_code=403, detail="Communication restricted due to blocking.")
 
-    # ---- CDN Upload (Phase 13) -------------------------------------------
-    # If Cloudinary is configured, upload media to CDN and store the URL.
-    # The content going into the DB is either a CDN URL or the original (encrypted) data URI.
-    stored_content = content
+    # ---- Media storage ---------------------------------------------------
+    # Attachments leave the message: data URIs go to the CDN (or the blob store
+    # without one), E2EE ciphertext goes to the blob store as opaque bytes, and
+    # the message keeps the CDN URL or the blob hash (see media_storage.py).
+    stored_content, media_fields = content, {}
     is_media_type = message_type and message_type not in ("text", "location", "poll")
-    
-    if is_media_type and is_cdn_enabled() and content.startswith("data:"):
-        # Content at this point is already E2EE-encrypted on the frontend.
-        # We decode it to get the original data URI and upload to CDN.
-        # Note: If E2EE is enabled, we're uploading the encrypted ciphertext as a binary blob.
-        # The CDN URL is safe to expose because only users with the correct key can decrypt.
-        cdn_url = await upload_to_cdn(content, file_name=file_name)
-        if cdn_url:
-            stored_content = cdn_url  # Replace data URI with CDN URL
-    # ---- End CDN Upload ----------------------------------------------------
+    if is_media_type and content:
+        stored_content, media_fields = await store_attachment(content, current_user['user_id'], file_name=file_name)
+    # ---- End media storage -------------------------------------------------
 
-    encrypted_content = encrypt_message(stored_content) if stored_content else ''
+    # Inline data URIs can be megabytes; Fernet over that would stall the loop
+    encrypted_content = await asyncio.to_thread(encrypt_message, stored_content) if stored_content else ''
     
-    msg_id = f"msg_{datetime.now(timezone.utc).timestamp()}".replace('.', '_')
+    msg_id = new_id('msg')
     doc = {
         'message_id': msg_id,
         'conversation_id': conversation_id,
@@ -228,28 +251,30 @@ async def save_attachment_message(
         'is_deleted': False,
         'expires_in': expires_in
     }
-    await db.messages.insert_one(doc)
-    await db.conversations.update_one({'conversation_id': conversation_id}, {'$set': {'updated_at': doc['timestamp']}})
+    doc.update(media_fields)
+    recipients = [p for p in conv.get('participants', []) if p != current_user['user_id']]
+    await message_writer.persist(doc, recipients=recipients)
     
     response_doc = doc.copy()
     response_doc['content'] = stored_content  # Return stored content (URL or original data)
     response_doc.pop('_id', None)
+    with_blob_url(response_doc, request_base_url(request))
     if temp_id:
         response_doc['temp_id'] = temp_id
     await sio.emit('new_message', response_doc, room=conversation_id)
+    await typing_tracker.stop(current_user['user_id'], conversation_id)
+    for recipient_id in recipients:
+        await sio.emit('unread_increment', {'conversation_id': conversation_id, 'by': 1}, room=user_room(recipient_id))
     
-    conv = await db.conversations.find_one({'conversation_id': conversation_id})
-    if conv:
-        other_id = next((p for p in conv.get('participants', []) if p != current_user['user_id']), None)
-        if other_id and other_id not in active_users:
-            sender_name = current_user.get('real_name', 'Someone')
-            await send_push_notification(other_id, {
-                "title": sender_name,
-                "body": f"Sent a {message_type}",
-                "data": { "url": f"/?chat={conversation_id}" } 
-            })
+    if other_id and not await presence.is_online(other_id):
+        sender_name = current_user.get('real_name', 'Someone')
+        send_push_notification(other_id, {
+            "title": sender_name,
+            "body": f"Sent a {message_type}",
+            "data": { "url": f"/?chat={conversation_id}" } 
+        })
 
-    return {k: v for k, v in doc.items() if k != '_id'}
+    return with_blob_url({k: v for k, v in doc.items() if k != '_id'}, request_base_url(request))
 
 @router.put('/conversations/{conversation_id}/archive')
 async def archive_conversation(conversation_id: str, archived: bool = Body(..., embed=True), current_user: dict = Depends(get_current_user)):
@@ -267,21 +292,22 @@ async def get_archived(current_user: dict = Depends(get_current_user)):
 
 @router.delete('/conversations/{conversation_id}')
 async def delete_conversation(conversation_id: str, current_user: dict = Depends(get_current_user)):
-    conv = await db.conversations.find_one({'conversation_id': conversation_id, 'participants': current_user['user_id']})
-    if not conv:
+    if not await conversation_cache.is_participant(conversation_id, current_user['user_id']):
         raise HTTPException(status_code=404, detail="Conversation not found")
         
     await db.conversations.delete_one({'conversation_id': conversation_id})
+    conversation_cache.invalidate(conversation_id)
     await db.messages.delete_many({'conversation_id': conversation_id})
+    await read_state.remove_conversation(conversation_id)
     return {'message': 'Deleted'}
 
 @router.delete('/conversations/{conversation_id}/messages')
 async def clear_messages(conversation_id: str, current_user: dict = Depends(get_current_user)):
-    conv = await db.conversations.find_one({'conversation_id': conversation_id, 'participants': current_user['user_id']})
-    if not conv:
+    if not await conversation_cache.is_participant(conversation_id, current_user['user_id']):
         raise HTTPException(status_code=404, detail="Conversation not found")
         
     await db.messages.delete_many({'conversation_id': conversation_id})
+    await db.conversations.update_one({'conversation_id': conversation_id}, {'$set': {'last_message': None}})
     return {'message': 'Chat cleared'}
 
 @router.post('/conversations/{conversation_id}/pin')
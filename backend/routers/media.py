@@ -0,0 +1,189 @@
+import asyncio
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
+
+from database import db
+from dependencies import get_current_user
+from models import UploadCreate
+from rate_limiter import limiter
+from blob_store import blob_store, blob_ref, parse_range, iter_file, RangeNotSatisfiable
+from media_storage import (
+    spool_path, write_chunk, store_upload, local_media_path, can_read_blob,
+    UPLOAD_MAX_BYTES, UPLOAD_CHUNK_MAX_BYTES, UPLOAD_SESSION_TTL_SECONDS, UPLOAD_WRITE_BUFFER
+)
+
+router = APIRouter(prefix="/api", tags=["Media"])
+
+# One writer per upload on this worker; the conditional update on `received` guards across workers
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _status(session: dict) -> dict:
+    return {
+        'upload_id': session['upload_id'],
+        'size': session['size'],
+        'offset': session['received'],
+        'chunk_size': session.get('chunk_size', UPLOAD_CHUNK_MAX_BYTES),
+        'complete': bool(session.get('url')),
+        'url': session.get('url'),
+    }
+
+
+async def _get_session(upload_id: str, user_id: str) -> dict:
+    session = await db.uploads.find_one({'upload_id': upload_id, 'user_id': user_id}, {'_id': 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return session
+
+
+@router.post('/uploads')
+@limiter.limit("30/minute")
+async def create_upload(request: Request, data: UploadCreate, current_user: dict = Depends(get_current_user)):
+    """Start a resumable upload; the client then PUTs the bytes in one or more chunks."""
+    if data.size <= 0 or data.size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File must be between 1 byte and {UPLOAD_MAX_BYTES} bytes")
+    session = {
+        'upload_id': secrets.token_urlsafe(18),
+        'user_id': current_user['user_id'],
+        'file_name': data.file_name,
+        'mime_type': data.mime_type,
+        'size': data.size,
+        'received': 0,
+        'chunk_size': UPLOAD_CHUNK_MAX_BYTES,
+        'url': None,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'expires_at': datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS),
+    }
+    await db.uploads.insert_one(session)
+    return _status(session)
+
+
+@router.get('/uploads/{upload_id}')
+async def get_upload(upload_id: str, current_user: dict = Depends(get_current_user)):
+    """Where to resume: `offset` is the number of bytes already stored."""
+    return _status(await _get_session(upload_id, current_user['user_id']))
+
+
+@router.put('/uploads/{upload_id}')
+async def put_upload_chunk(upload_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Append the request body at the `Upload-Offset` header. The body is streamed
+    to the spool file in UPLOAD_WRITE_BUFFER pieces. If the connection drops
+    mid-chunk, what arrived is kept and GET tells the client where to resume.
+    """
+    session = await _get_session(upload_id, current_user['user_id'])
+    if session.get('url'):
+        return _status(session)
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Offset header required")
+
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+    if lock.locked():
+        raise HTTPException(status_code=409, detail="Another chunk is being written")
+    async with lock:
+        try:
+            return await _write_chunk(session, offset, request)
+        finally:
+            _upload_locks.pop(upload_id, None)
+
+
+async def _write_chunk(session: dict, offset: int, request: Request) -> dict:
+    upload_id = session['upload_id']
+    if offset != session['received']:
+        raise HTTPException(status_code=409, detail={'message': 'Offset mismatch', 'offset': session['received']})
+
+    limit = min(UPLOAD_CHUNK_MAX_BYTES, session['size'] - offset)
+    path = spool_path(upload_id)
+    written = offset
+    buffer = bytearray()
+    disconnected = False
+    try:
+        async for piece in request.stream():
+            if written + len(buffer) + len(piece) - offset > limit:
+                raise HTTPException(status_code=413, detail=f"Chunk exceeds {limit} bytes")
+            buffer += piece
+            if len(buffer) >= UPLOAD_WRITE_BUFFER:
+                await write_chunk(path, written, bytes(buffer))
+                written += len(buffer)
+                buffer.clear()
+    except ClientDisconnect:
+        disconnected = True
+    if buffer:
+        await write_chunk(path, written, bytes(buffer))
+        written += len(buffer)
+
+    result = await db.uploads.update_one(
+        {'upload_id': upload_id, 'received': offset},
+        {'$set': {'received': written}}
+    )
+    if result.modified_count == 0 and written != offset:
+        raise HTTPException(status_code=409, detail="Upload changed concurrently, query the offset and resume")
+    session['received'] = written
+    if disconnected:
+        return _status(session)
+
+    if written == session['size']:
+        url = await store_upload(path, session['mime_type'], session.get('file_name'))
+        # `blob` lets the uploader fetch it back before it is attached to a message
+        stored = {'url': url}
+        if blob_ref(url):
+            stored['blob'] = blob_ref(url)
+        await db.uploads.update_one({'upload_id': upload_id}, {'$set': stored})
+        session['url'] = url
+    return _status(session)
+
+
+@router.get('/media/{name}')
+async def get_media(name: str):
+    """Locally stored upload. Names are unguessable and content never changes."""
+    path = local_media_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(path, headers={'Cache-Control': 'public, max-age=31536000, immutable'})
+
+
+@router.get('/blobs/{sha256}')
+async def get_blob(sha256: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Attachment bytes by content hash, for the uploader and the participants of
+    conversations it was sent in. Supports a single `Range`, `If-Range` and
+    `If-None-Match`; the hash is the ETag since the content can never change.
+    """
+    if not await can_read_blob(sha256, current_user['user_id']):
+        # Same answer as a missing blob: hashes of other people's files are not confirmed
+        raise HTTPException(status_code=404, detail="Not found")
+    info = await blob_store.info(sha256)
+    if info is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    etag = f'"{sha256}"'
+    size = info['size']
+    # identity: keeps GZipMiddleware away from ranges and already-compressed media
+    headers = {
+        'ETag': etag,
+        # private: shared caches must not hand it to someone who was never checked
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Accept-Ranges': 'bytes',
+        'Content-Encoding': 'identity',
+    }
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if request.headers.get('if-range', etag) == etag:
+        try:
+            byte_range = parse_range(request.headers.get('range'), size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+    start, end = byte_range or (0, size - 1)
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(iter_file(info['path'], start, end), status_code=206 if byte_range else 200,
+                             media_type=info['mime_type'], headers=headers)
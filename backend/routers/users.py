@@ -1,27 +1,69 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import FileResponse
+from typing import Optional
 from database import db
 from models import UserUpdate, InviteFriend
-from dependencies import get_current_user
-from utils import send_email_func
+from dependencies import get_current_user, invalidate_principal
+from email_outbox import email_outbox
+from user_search import user_search
+from utils import encode_cursor, decode_cursor
 from cloudinary_utils import upload_to_cdn
+from avatars import build_avatar, refresh_avatar, list_avatar, avatar_owner
+from blob_store import blob_store, request_base_url
+from socket_instance import presence
 
 router = APIRouter(prefix="/api/users", tags=["Users"])
 
 @router.get('/search')
-async def search_users(query: str, current_user: dict = Depends(get_current_user)):
-    users = await db.users.find({
-        'user_id': {'$ne': current_user['user_id']},
-        '$or': [
-            {'username': {'$regex': query, '$options': 'i'}},
-            {'real_name': {'$regex': query, '$options': 'i'}},
-            {'unique_id': {'$regex': query, '$options': 'i'}}
-        ]
-    }, {'_id': 0, 'password_hash': 0}).limit(20).to_list(20)
+async def search_users(
+    query: str,
+    request: Request,
+    response: Response,
+    limit: int = Query(default=20, ge=1, le=50),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    after = None
+    if cursor:
+        try:
+            after = tuple(decode_cursor(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if len(after) != 2:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Prefix match on the user_search index, exact matches first
+    users, position = await user_search.search(query, limit, after, exclude=[current_user['user_id']],
+                                               base_url=request_base_url(request))
+    if position is not None:
+        response.headers['X-Next-Cursor'] = encode_cursor(*position)
     return users
 
+PRESENCE_QUERY_MAX = 200
+
+@router.get('/presence')
+async def get_presence(ids: str = Query(..., description="Comma-separated user ids"),
+                       current_user: dict = Depends(get_current_user)):
+    """Which of the given users are online, from the presence registry (not users.online_status)."""
+    user_ids = [u for u in dict.fromkeys(ids.split(',')) if u]
+    if len(user_ids) > PRESENCE_QUERY_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PRESENCE_QUERY_MAX} ids per request")
+    online = await presence.online_users(user_ids)
+    return {'online': [u for u in user_ids if u in online]}
+
 @router.put('/profile')
 async def update_profile(data: UserUpdate, current_user: dict = Depends(get_current_user)):
     update_data = {k: v for k, v in data.model_dump().items() if v is not None}
+
+    if 'profile_photo' in update_data:
+        owner = avatar_owner(update_data['profile_photo'])
+        if owner == current_user['user_id']:
+            # A client echoing back the avatar URL from a list response; nothing changed
+            del update_data['profile_photo']
+        elif owner is not None:
+            raise HTTPException(status_code=400, detail="profile_photo cannot be another user's avatar URL")
+        else:
+            update_data['avatar'] = await build_avatar(update_data['profile_photo'])
     
     # Intercept chat_wallpaper if it contains a raw base64 image and upload to CDN
     if 'chat_wallpaper' in update_data and update_data['chat_wallpaper']:
@@ -44,7 +86,11 @@ async def update_profile(data: UserUpdate, current_user: dict = Depends(get_curr
 
     if update_data:
         await db.users.update_one({'user_id': current_user['user_id']}, {'$set': update_data})
-    return await db.users.find_one({'user_id': current_user['user_id']}, {'_id': 0, 'password_hash': 0})
+        invalidate_principal(current_user['user_id'])
+    user = await db.users.find_one({'user_id': current_user['user_id']}, {'_id': 0, 'password_hash': 0})
+    if 'real_name' in update_data and user:
+        await user_search.index_user(user)
+    return user
 
 @router.post('/invite')
 async def invite_friend(data: InviteFriend, current_user: dict = Depends(get_current_user)):
@@ -53,23 +99,65 @@ async def invite_friend(data: InviteFriend, current_user: dict = Depends(get_cur
     <p>{current_user['real_name']} (@{current_user['username']}) has invited you to join QuickChat.</p>
     <p>Sign up today to connect!</p>
     """
-    success = await send_email_func(data.email, "Join me on QuickChat!", html)
-    if not success:
+    try:
+        await email_outbox.enqueue(data.email, "Join me on QuickChat!", html)
+    except Exception:
         raise HTTPException(status_code=500, detail="Failed to send invitation")
     return {"message": "Invitation sent successfully"}
 
 @router.post('/block/{user_id}')
 async def block_user(user_id: str, current_user: dict = Depends(get_current_user)):
     await db.users.update_one({'user_id': current_user['user_id']}, {'$addToSet': {'blocked_users': user_id}})
+    invalidate_principal(current_user['user_id'])
     return {'message': 'User blocked'}
 
 @router.post('/unblock/{user_id}')
 async def unblock_user(user_id: str, current_user: dict = Depends(get_current_user)):
     await db.users.update_one({'user_id': current_user['user_id']}, {'$pull': {'blocked_users': user_id}})
+    invalidate_principal(current_user['user_id'])
     return {'message': 'User unblocked'}
 
 @router.get('/blocked')
-async def get_blocked_users(current_user: dict = Depends(get_current_user)):
+async def get_blocked_users(request: Request, current_user: dict = Depends(get_current_user)):
     user = await db.users.find_one({'user_id': current_user['user_id']})
     blocked_ids = user.get('blocked_users', [])
-    return await db.users.find({'user_id': {'$in': blocked_ids}}, {'_id': 0, 'password_hash': 0}).to_list(1000)
+    users = await db.users.find(
+        {'user_id': {'$in': blocked_ids}},
+        {'_id': 0, 'user_id': 1, 'username': 1, 'real_name': 1, 'unique_id': 1, 'avatar': 1}
+    ).to_list(1000)
+    base_url = request_base_url(request)
+    return [list_avatar(u, base_url) for u in users]
+
+@router.get('/{user_id}/avatar')
+async def get_avatar(user_id: str, request: Request, v: Optional[str] = None):
+    """
+    Avatar thumbnail. Unauthenticated so it works as an <img> src. With the
+    current `?v=` version the response is immutable, otherwise browsers
+    revalidate with the ETag. Users whose photo is an external URL have no
+    thumbnail here (404).
+    """
+    user = await db.users.find_one({'user_id': user_id}, {'_id': 0, 'avatar': 1})
+    if user is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    # Users from before thumbnails existed get theirs built on first request
+    avatar = user['avatar'] if 'avatar' in user else await refresh_avatar(db.users, user_id)
+    if not avatar:
+        raise HTTPException(status_code=404, detail="No avatar")
+    # External photos (Google sign-in, CDN) are linked directly from list responses. Not
+    # redirecting to them keeps this endpoint from sending anyone to a URL a user chose.
+    info = await blob_store.info(avatar['sha256']) if avatar.get('sha256') else None
+    # Thumbnails are always JPEG; anything else was stored as uploaded by an older version
+    if info is None or info['mime_type'] != 'image/jpeg':
+        raise HTTPException(status_code=404, detail="No avatar")
+    etag = f'"{avatar["sha256"]}"'
+    cache = 'public, max-age=31536000, immutable' if v == avatar['version'] else 'public, no-cache'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': cache,
+        # Served on the API origin without auth: never sniffed or run as a document
+        'X-Content-Type-Options': 'nosniff',
+        'Content-Security-Policy': "default-src 'none'; sandbox",
+    }
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(info['path'], media_type=info['mime_type'], headers=headers)
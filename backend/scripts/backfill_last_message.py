@@ -0,0 +1,53 @@
+"""
+One-off migration: populate conversations.last_message from the messages collection.
+
+Conversations created before the denormalized summary existed have no
+last_message field and would drop out of the conversation list. Safe to re-run;
+a conversation is only updated when its stored summary is missing or older.
+"""
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from message_writer import last_message_update
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+async def backfill():
+    logger.info('Backfilling conversations.last_message...')
+    updated = scanned = 0
+    try:
+        batch = []
+        async for conv in db.conversations.find({}, {'_id': 0, 'conversation_id': 1}):
+            scanned += 1
+            last = await db.messages.find_one(
+                {'conversation_id': conv['conversation_id']},
+                {'_id': 0},
+                sort=[('timestamp', -1)]
+            )
+            if last:
+                batch.append(last_message_update(last))
+            if len(batch) >= BATCH_SIZE:
+                result = await db.conversations.bulk_write(batch, ordered=False)
+                updated += result.modified_count
+                batch = []
+        if batch:
+            result = await db.conversations.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+        logger.info(f'Scanned {scanned} conversations, updated {updated}')
+    except Exception as e:
+        logger.error(f'Backfill failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(backfill())
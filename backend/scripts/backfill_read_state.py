@@ -0,0 +1,66 @@
+"""
+One-off migration: build read watermarks from legacy per-message read_by arrays.
+
+For every (conversation, reader) the newest message listing the reader in
+read_by becomes their watermark. Until this has run, conversations read
+before watermarks existed show as unread. Safe to re-run: watermarks only
+move forward.
+"""
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from read_state import advance_op
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+async def backfill(messages=None, read_state=None):
+    messages = messages if messages is not None else db.messages
+    read_state = read_state if read_state is not None else db.read_state
+    pipeline = [
+        {'$match': {'read_by.0': {'$exists': True}}},
+        {'$project': {'_id': 0, 'conversation_id': 1, 'message_id': 1, 'timestamp': 1, 'sender_id': 1, 'read_by': 1}},
+        {'$unwind': '$read_by'},
+        # A sender "reading" their own message says nothing about what they have seen
+        {'$match': {'$expr': {'$ne': ['$read_by', '$sender_id']}}},
+        {'$group': {
+            '_id': {'conversation_id': '$conversation_id', 'user_id': '$read_by'},
+            'last_read_id': {'$max': '$message_id'},
+            'last_read_at': {'$max': '$timestamp'},
+        }},
+    ]
+    written = 0
+    batch = []
+    async for row in messages.aggregate(pipeline, allowDiskUse=True):
+        key = row['_id']
+        op = advance_op(key['user_id'], key['conversation_id'], row['last_read_id'], row.get('last_read_at') or '')
+        batch.append(op)
+        if len(batch) >= BATCH_SIZE:
+            await read_state.bulk_write(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        await read_state.bulk_write(batch, ordered=False)
+        written += len(batch)
+    logger.info(f'Wrote {written} read watermarks')
+
+async def main():
+    logger.info('Backfilling read watermarks from read_by...')
+    try:
+        await backfill()
+    except Exception as e:
+        logger.error(f'Backfill failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Benchmark: request latency of an authenticated endpoint on a running server.
+
+Run once with PRINCIPAL_CACHE_TTL=0 (every request hits db.users) and once with
+the default TTL to see what the principal cache saves per request.
+
+Usage:
+  python scripts/bench_api_latency.py --token <access token>
+  python scripts/bench_api_latency.py --login alice --password secret --path /api/conversations
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--path', default='/api/conversations')
+    parser.add_argument('--token')
+    parser.add_argument('--login')
+    parser.add_argument('--password')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=30) as client:
+        token = args.token
+        if not token:
+            res = await client.post('/api/auth/login', json={'login': args.login, 'password': args.password})
+            res.raise_for_status()
+            token = res.json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        latencies = []
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one():
+            async with sem:
+                started = time.perf_counter()
+                res = await client.get(args.path, headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                res.raise_for_status()
+
+        await one()  # warm-up
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+        print(f"GET {args.path}  requests={args.requests} concurrency={args.concurrency}")
+        print(f"throughput: {args.requests / elapsed:8.1f} req/s")
+        print(f"latency ms: mean={statistics.mean(latencies):.2f} p50={percentile(latencies, 50):.2f} "
+              f"p95={percentile(latencies, 95):.2f} p99={percentile(latencies, 99):.2f}")
+
+        metrics = await client.get('/metrics')
+        if metrics.status_code == 200:
+            print(f"principal_cache: {metrics.json().get('principal_cache')}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
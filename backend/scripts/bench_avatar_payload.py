@@ -0,0 +1,94 @@
+"""
+Benchmark: conversation list size with inline profile photos vs avatar URLs.
+
+Builds a GET /api/conversations response for N conversations whose other users
+each have a base64 profile photo (like the Profile page uploads: a JPEG data
+URI), serializes it both ways, and reports raw and gzip sizes. Also reports
+the thumbnail size each avatar costs once before the browser caches it.
+
+Usage:
+  python scripts/bench_avatar_payload.py [--conversations 100] [--photo-px 512]
+"""
+import argparse
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import avatars
+from blob_store import BlobStore
+
+
+def photo_data_uri(px: int, seed: int) -> str:
+    """A JPEG with photo-like detail (smooth gradient plus noise)."""
+    noise = Image.effect_noise((px, px), 40 + seed % 20).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((px, px)).convert('RGB')
+    img = Image.blend(noise, gradient, 0.5)
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=85)
+    return 'data:image/jpeg;base64,' + base64.b64encode(out.getvalue()).decode()
+
+
+def conversation(i: int, other_user: dict) -> dict:
+    return {
+        'conversation_id': f'conv_{i:04d}',
+        'type': 'direct',
+        'participants': ['user_me', other_user['user_id']],
+        'created_at': '2026-01-01T00:00:00+00:00',
+        'updated_at': f'2026-01-02T00:{i // 60:02d}:{i % 60:02d}+00:00',
+        'pinned_by': [],
+        'archived_by': [],
+        'last_message': {'message_id': f'msg_{i}', 'sender_id': other_user['user_id'], 'message_type': 'text',
+                         'content': 'See you tomorrow at the usual place?', 'timestamp': '2026-01-02T00:00:00+00:00',
+                         'is_edited': False, 'is_deleted': False},
+        'other_user': other_user,
+        'is_pinned': False,
+    }
+
+
+def sizes(payload) -> tuple:
+    body = json.dumps(payload).encode()
+    return len(body), len(gzip.compress(body, compresslevel=9))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=100)
+    parser.add_argument('--photo-px', type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        avatars.blob_store = store = BlobStore(tmp)
+        inline, slim, thumb_bytes, photo_bytes = [], [], 0, 0
+        for i in range(args.conversations):
+            photo = photo_data_uri(args.photo_px, i)
+            photo_bytes += len(photo)
+            user = {'user_id': f'user_{i:04d}', 'username': f'friend{i}', 'real_name': f'Friend {i}',
+                    'online_status': 'online', 'public_key': base64.b64encode(os.urandom(294)).decode()}
+            avatar = await avatars.build_avatar(photo)
+            thumb_bytes += store.path(avatar['sha256']).stat().st_size
+            inline.append(conversation(i, {**user, 'profile_photo': photo}))
+            slim.append(conversation(i, avatars.list_avatar({**user, 'avatar': avatar}, 'https://chat.example.com')))
+
+    n = args.conversations
+    (old_raw, old_gz), (new_raw, new_gz) = sizes(inline), sizes(slim)
+    print(f"{n} conversations, {args.photo_px}px photos, avg inline photo {photo_bytes / n / 1024:.1f} KB, "
+          f"avg thumbnail {thumb_bytes / n / 1024:.1f} KB ({avatars.AVATAR_SIZE}px)")
+    print(f"{'response':>16} | {'raw KB':>10} | {'gzip KB':>10}")
+    print(f"{'inline photos':>16} | {old_raw / 1024:>10.1f} | {old_gz / 1024:>10.1f}")
+    print(f"{'avatar URLs':>16} | {new_raw / 1024:>10.1f} | {new_gz / 1024:>10.1f}")
+    print(f"{'reduction':>16} | {old_raw / new_raw:>9.0f}x | {old_gz / new_gz:>9.0f}x")
+    print(f"first load also fetches {thumb_bytes / 1024:.1f} KB of thumbnails, then 304s / cache hits")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""
+Benchmark: content spam scanning on short chat lines and 64 KB pastes.
+
+Compares the previous per-character / per-keyword scanner (reproduced below
+for reference) with ContentScanner, for the built-in keyword list and for a
+larger list to show how each scales with keyword count.
+
+Usage:
+  python scripts/bench_content_scanner.py [--keywords 500]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spam_protection import ContentScanner, SPAM_KEYWORDS
+
+
+def legacy_is_spam_message(message, keywords):
+    """The scanner this module replaced."""
+    for char in set(message):
+        if message.count(char) > len(message) * 0.7:
+            return True, "repeat"
+    if 'http://' in message or 'https://' in message:
+        if message.count('http://') + message.count('https://') > 2:
+            return True, "urls"
+    lowered = message.lower()
+    for keyword in keywords:
+        if keyword in lowered:
+            return True, "keywords"
+    if len(message) > 20 and message.isupper():
+        return True, "caps"
+    return False, "OK"
+
+
+def make_corpus(rng):
+    words = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 9))) for _ in range(2000)]
+    short = [' '.join(rng.choice(words) for _ in range(rng.randint(3, 12))) for _ in range(1000)]
+    # Pastes mix in punctuation, digits and non-ASCII so the character set is realistic
+    alphabet = string.ascii_letters + string.digits + string.punctuation + 'éüñçøßあいうえお中文字'
+    paste_words = words + [''.join(rng.choice(alphabet) for _ in range(6)) for _ in range(500)]
+    pastes = []
+    for _ in range(10):
+        text = []
+        while sum(len(w) + 1 for w in text) < 64 * 1024:
+            text.append(rng.choice(paste_words))
+        pastes.append(' '.join(text)[:64 * 1024])
+    return short, pastes
+
+
+def bench(fn, corpus, repeat):
+    seconds = timeit.timeit(lambda: [fn(m) for m in corpus], number=repeat)
+    return seconds / (repeat * len(corpus)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keywords', type=int, default=500, help='size of the large keyword list')
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    short, pastes = make_corpus(rng)
+    big_list = SPAM_KEYWORDS + [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(6, 14)))
+                                for _ in range(args.keywords)]
+
+    print(f"{'keywords':>9} | {'corpus':<12} | {'legacy us/msg':>14} | {'scanner us/msg':>15}")
+    for keywords in (SPAM_KEYWORDS, big_list):
+        scanner = ContentScanner(keywords=keywords, keywords_file='')
+        for name, corpus, repeat in (('short lines', short, 20), ('64 KB paste', pastes, 3)):
+            legacy = bench(lambda m: legacy_is_spam_message(m, keywords), corpus, repeat)
+            new = bench(scanner.scan, corpus, repeat)
+            print(f"{len(keywords):>9} | {name:<12} | {legacy:>14.1f} | {new:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark: how long a history page blocks the event loop while decrypting.
+
+A probe coroutine wakes every millisecond; the longest gap between wake-ups
+is the worst stall any other socket would have seen during the page.
+
+Usage:
+  python scripts/bench_decrypt.py [--sizes 50 500 5000] [--content-chars 120]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import encryption
+from encryption import encrypt_message, decrypt_message, decrypt_many
+
+
+async def measure(work):
+    """Run `work` while probing loop responsiveness; returns (wall ms, max stall ms)."""
+    stalls = []
+    done = False
+
+    async def probe():
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(0.005)
+    started = time.perf_counter()
+    await work()
+    wall = time.perf_counter() - started
+    done = True
+    await probe_task
+    return wall * 1000, max(stalls) * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--content-chars', type=int, default=120)
+    args = parser.parse_args()
+
+    print(f"{'page':>6} | {'serial wall/stall ms':>22} | {'decrypt_many cold':>22} | {'decrypt_many warm':>22}")
+    for size in args.sizes:
+        page = [encrypt_message(f"{i:06d} " + 'x' * args.content_chars) for i in range(size)]
+
+        async def serial():
+            for ct in page:
+                decrypt_message(ct)
+
+        encryption.decrypted_cache = encryption.DecryptedCache()
+        serial_res = await measure(serial)
+        cold = await measure(lambda: decrypt_many(page))
+        warm = await measure(lambda: decrypt_many(page))
+        fmt = lambda r: f"{r[0]:9.1f} / {r[1]:9.2f}"
+        print(f"{size:>6} | {fmt(serial_res):>22} | {fmt(cold):>22} | {fmt(warm):>22}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+"""
+Benchmark: socket delivery latency while a burst of logins is being checked.
+
+A Socket.IO server runs on this process's event loop (as in production) and
+echoes every `probe` event back. A client in a separate thread sends a probe
+every few milliseconds and records the round trip. Meanwhile the server loop
+verifies bcrypt passwords for a login storm, either inline (the old
+`verify_password` call inside the handler) or through `password_hasher`.
+
+Usage:
+  python scripts/bench_login_storm.py [--logins 40] [--rounds 12] [--interval-ms 5]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio
+import uvicorn
+
+from utils import hash_password, verify_password
+from password_hasher import PasswordHasher
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))] * 1000 if samples else float('nan')
+
+
+def run_client(url, interval, stop, rtts, ready):
+    async def main():
+        client = socketio.AsyncClient()
+        pending = {}
+
+        @client.on('probe')
+        async def on_probe(seq):
+            sent = pending.pop(seq)
+            rtts.append((sent, time.perf_counter() - sent))
+
+        await client.connect(url, transports=['websocket'])
+        ready.set()
+        seq = 0
+        while not stop.is_set():
+            seq += 1
+            pending[seq] = time.perf_counter()
+            await client.emit('probe', seq)
+            await asyncio.sleep(interval)
+        await asyncio.sleep(0.5)
+        await client.disconnect()
+
+    asyncio.run(main())
+
+
+async def storm(mode, logins, password, hashed, hasher):
+    async def login():
+        if mode == 'inline':
+            return verify_password(password, hashed)
+        return await hasher.verify(password, hashed)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(login() for _ in range(logins)))
+    assert all(results)
+    return started, time.perf_counter()
+
+
+async def run_mode(mode, args, hashed, hasher):
+    sio = socketio.AsyncServer(async_mode='asgi')
+
+    @sio.on('probe')
+    async def on_probe(sid, seq):
+        await sio.emit('probe', seq, to=sid)
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(socketio.ASGIApp(sio), host='127.0.0.1', port=port, log_level='warning'))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    stop, ready, rtts = threading.Event(), threading.Event(), []
+    client = threading.Thread(target=run_client, args=(f'http://127.0.0.1:{port}', args.interval_ms / 1000, stop, rtts, ready))
+    client.start()
+    while not ready.is_set():
+        await asyncio.sleep(0.01)
+
+    await asyncio.sleep(0.5)
+    started, finished = await storm(mode, args.logins, 'correct horse', hashed, hasher)
+    await asyncio.sleep(0.2)
+    stop.set()
+    while client.is_alive():
+        await asyncio.sleep(0.05)
+
+    server.should_exit = True
+    await server_task
+    # Probes sent while the storm was running, however late their echo arrived
+    during = [rtt for sent, rtt in rtts if started <= sent <= finished]
+    return finished - started, during
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=40)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--interval-ms', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    hashed = hash_password('correct horse', args.rounds)
+    workers = args.workers or min(4, os.cpu_count() or 1)
+    hasher = PasswordHasher(workers=workers, queue_max=args.logins, rounds=args.rounds)
+
+    print(f"{args.logins} logins at bcrypt cost {args.rounds}, probe every {args.interval_ms} ms, {workers} hash worker(s)\n")
+    print(f"{'mode':<10}{'storm s':>10}{'probes':>9}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for mode in ('inline', 'executor'):
+        storm_seconds, rtts = await run_mode(mode, args, hashed, hasher)
+        print(f"{mode:<10}{storm_seconds:>10.2f}{len(rtts):>9}{percentile(rtts, 0.5):>10.1f}"
+              f"{percentile(rtts, 0.99):>10.1f}{max(rtts, default=0) * 1000:>10.1f}")
+    print(f"\npassword_hasher.stats(): {hasher.stats()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,122 @@
+"""
+Benchmark: per-message writes vs. write-behind batching (MessageWriter).
+
+Usage:
+  python scripts/bench_message_writer.py                      # real MongoDB from MONGO_URL, scratch DB
+  python scripts/bench_message_writer.py --simulated-rtt-ms 1 # no MongoDB: fixed round-trip per call
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_writer import MessageWriter
+
+
+class SimulatedCollection:
+    """
+    Stand-in collection: every call holds one of `pool` connections (Motor's
+    default maxPoolSize is 100) for a network round trip plus a per-document cost.
+    """
+    def __init__(self, rtt_ms: float, pool: asyncio.Semaphore, per_doc_us: float = 5):
+        self.rtt = rtt_ms / 1000
+        self.per_doc = per_doc_us / 1_000_000
+        self.pool = pool
+        self.calls = 0
+
+    async def _round_trip(self, docs: int = 1):
+        self.calls += 1
+        async with self.pool:
+            await asyncio.sleep(self.rtt + docs * self.per_doc)
+
+    async def insert_one(self, doc):
+        await self._round_trip()
+
+    async def update_one(self, *args, **kwargs):
+        await self._round_trip()
+
+    async def insert_many(self, docs, ordered=True):
+        await self._round_trip(len(docs))
+
+    async def bulk_write(self, ops, ordered=True):
+        await self._round_trip(len(ops))
+
+
+def make_doc(i: int, conversations: int) -> dict:
+    return {
+        'message_id': f"bench_{time.time_ns()}_{i}",
+        'conversation_id': f"bench_conv_{i % conversations}",
+        'sender_id': 'bench_user',
+        'content': 'x' * 64,
+        'message_type': 'text',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def run_inline(messages, conversations, total, concurrency, n_convs):
+    async def send(i):
+        doc = make_doc(i, n_convs)
+        await messages.insert_one(doc)
+        await conversations.update_one({'conversation_id': doc['conversation_id']}, {'$set': {'updated_at': doc['timestamp']}})
+    return await _drive(send, total, concurrency)
+
+
+async def run_batched(writer, total, concurrency, n_convs):
+    async def send(i):
+        await writer.persist(make_doc(i, n_convs))
+    return await _drive(send, total, concurrency)
+
+
+async def _drive(send, total, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await send(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - started)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=1000, help='simultaneous senders')
+    parser.add_argument('--conversations', type=int, default=50)
+    parser.add_argument('--flush-ms', type=float, default=5)
+    parser.add_argument('--simulated-rtt-ms', type=float, default=None)
+    parser.add_argument('--pool-size', type=int, default=100, help='simulated connection pool size')
+    args = parser.parse_args()
+
+    if args.simulated_rtt_ms is not None:
+        pool = asyncio.Semaphore(args.pool_size)
+        messages, conversations = SimulatedCollection(args.simulated_rtt_ms, pool), SimulatedCollection(args.simulated_rtt_ms, pool)
+        cleanup = None
+    else:
+        from database import client
+        bench_db = client['quickchat_bench']
+        messages, conversations = bench_db.messages, bench_db.conversations
+        cleanup = lambda: client.drop_database('quickchat_bench')
+
+    try:
+        before = await run_inline(messages, conversations, args.messages, args.concurrency, args.conversations)
+        writer = MessageWriter(messages, conversations, flush_ms=args.flush_ms)
+        after = await run_batched(writer, args.messages, args.concurrency, args.conversations)
+    finally:
+        if cleanup:
+            await cleanup()
+
+    print(f"messages={args.messages} concurrency={args.concurrency} flush_ms={args.flush_ms}")
+    print(f"inline insert_one + update_one : {before:10.0f} msg/s")
+    print(f"write-behind batching          : {after:10.0f} msg/s  ({after / before:.1f}x)")
+    print(f"batches={writer.stats['batches']} avg_batch={writer.stats['messages'] / max(writer.stats['batches'], 1):.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+"""
+Microbenchmark: per-message rate-limit checks with 100k active users.
+
+Compares the previous timestamp-list implementation (reproduced below for
+reference) with the sliding-window SpamProtection: checks/sec, memory held,
+and memory left after every user goes idle for an hour.
+
+Usage:
+  python scripts/bench_spam_limiter.py [--users 100000] [--checks 1000000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spam_protection import SpamProtection
+
+
+class LegacySpamProtection:
+    """The list-of-datetimes limiter this module replaced."""
+    def __init__(self, max_messages_per_minute=10, max_messages_per_hour=100):
+        self.max_messages_per_minute = max_messages_per_minute
+        self.max_messages_per_hour = max_messages_per_hour
+        self.user_messages = defaultdict(list)
+        self.blocked_users = {}
+
+    def check_spam(self, user_id):
+        now = datetime.now(timezone.utc)
+        if user_id in self.blocked_users:
+            if self.blocked_users[user_id] > now:
+                return True, "blocked"
+            del self.blocked_users[user_id]
+        one_hour_ago = now - timedelta(hours=1)
+        if user_id in self.user_messages:
+            self.user_messages[user_id] = [t for t in self.user_messages[user_id] if t > one_hour_ago]
+        if len(self.user_messages[user_id]) >= self.max_messages_per_hour:
+            self.blocked_users[user_id] = now + timedelta(hours=1)
+            return True, "hourly"
+        one_minute_ago = now - timedelta(minutes=1)
+        if sum(1 for t in self.user_messages[user_id] if t > one_minute_ago) >= self.max_messages_per_minute:
+            return True, "minute"
+        self.user_messages[user_id].append(now)
+        return False, "OK"
+
+
+def run(name, check, users, checks):
+    rng = random.Random(42)
+    ids = [f"user_{i}" for i in range(users)]
+    tracemalloc.start()
+    started = time.perf_counter()
+    for _ in range(checks):
+        check(ids[rng.randrange(users)])
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28} {checks / elapsed:12,.0f} checks/s   {current / 1024 / 1024:8.1f} MiB held")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--checks', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # High limits so every check does the full amount of work
+    legacy = LegacySpamProtection(max_messages_per_minute=10**9, max_messages_per_hour=10**9)
+    run('legacy timestamp lists', legacy.check_spam, args.users, args.checks)
+
+    clock = [time.time()]
+    limiter = SpamProtection(max_messages_per_minute=10**9, max_messages_per_hour=10**9, clock=lambda: clock[0])
+    run('sliding-window counters', limiter._check_memory, args.users, args.checks)
+
+    clock[0] += 3601
+    asyncio.run(limiter.check_spam('late_user'))
+    print(f"after 1h idle: legacy keeps {len(legacy.user_messages):,} users, "
+          f"sliding-window keeps {limiter.tracked_users():,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: user search latency at scale, legacy regex scan vs the user_search index.
+
+Seeds a scratch database (dropped afterwards unless --keep) with synthetic
+users, builds the prefix index, then times both query paths for a set of
+typed prefixes and reports documents examined from explain().
+
+Needs a MongoDB server (MONGO_URL). 1M users take a few minutes to seed.
+
+Usage:
+  python scripts/bench_user_search.py [--users 1000000] [--queries 50] [--keep]
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import time
+
+# Add parent directory to sys.path so we can import backend modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from user_search import UserSearchIndex
+from scripts.build_user_search import build
+
+FIRST = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi', 'ivan', 'judy',
+         'mallory', 'niaj', 'olivia', 'peggy', 'rupert', 'sybil', 'trent', 'victor', 'walter', 'zoe']
+LAST = ['smith', 'jones', 'brown', 'taylor', 'wilson', 'davies', 'evans', 'thomas', 'roberts', 'walker']
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+
+async def seed(users, count):
+    batch = []
+    for i in range(count):
+        first, last = random.choice(FIRST), random.choice(LAST)
+        handle = f"{first}{''.join(random.choices(string.ascii_lowercase + string.digits, k=5))}"
+        batch.append({
+            'user_id': f"user_{i:08d}",
+            'username': handle,
+            'unique_id': f"{handle}{i}",
+            'real_name': f"{first.title()} {last.title()}",
+            'profile_photo': 'x' * 2000 if i % 10 == 0 else '',
+        })
+        if len(batch) == 10000:
+            await users.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await users.insert_many(batch, ordered=False)
+
+
+def legacy_query(query):
+    return {
+        'user_id': {'$ne': 'user_00000000'},
+        '$or': [
+            {'username': {'$regex': query, '$options': 'i'}},
+            {'real_name': {'$regex': query, '$options': 'i'}},
+            {'unique_id': {'$regex': query, '$options': 'i'}}
+        ]
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client['quickchat_bench_search']
+    try:
+        if await db.users.estimated_document_count() != args.users:
+            await db.users.drop()
+            started = time.perf_counter()
+            await seed(db.users, args.users)
+            await db.users.create_index('user_id', unique=True)
+            print(f"seeded {args.users} users in {time.perf_counter() - started:.1f}s")
+            started = time.perf_counter()
+            await build(db.users, db.user_search)
+            print(f"built user_search in {time.perf_counter() - started:.1f}s")
+        index = UserSearchIndex(db.user_search, db.users)
+
+        prefixes = [random.choice(FIRST)[:random.randint(1, 4)] for _ in range(args.queries)]
+        prefixes += [f"{random.choice(FIRST)} {random.choice(LAST)[:2]}" for _ in range(args.queries // 5)]
+        # No matches: the legacy path's worst case (full collection scan)
+        prefixes += [f"qx{i}z" for i in range(args.queries // 5)]
+
+        results = {}
+        for name in ('legacy regex', 'user_search'):
+            latencies = []
+            for q in prefixes:
+                started = time.perf_counter()
+                if name == 'legacy regex':
+                    await db.users.find(legacy_query(q), {'_id': 0, 'password_hash': 0}).limit(20).to_list(20)
+                else:
+                    await index.search(q, 20, exclude=['user_00000000'])
+                latencies.append(time.perf_counter() - started)
+            results[name] = latencies
+
+        sample = prefixes[0]
+        legacy_plan = await db.users.find(legacy_query(sample)).limit(20).explain()
+        index_plan = await db.user_search.find({'term': {'$regex': '^' + sample}}).sort(
+            [('term', 1), ('user_id', 1)]).limit(200).explain()
+
+        print(f"\n{args.users} users, {len(prefixes)} queries, page size 20\n")
+        print(f"{'path':<14}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for name, latencies in results.items():
+            print(f"{name:<14}{percentile(latencies, 0.5):>10.1f}{percentile(latencies, 0.99):>10.1f}"
+                  f"{max(latencies) * 1000:>10.1f}")
+        print(f"\ndocs examined for {sample!r}: legacy={legacy_plan['executionStats']['totalDocsExamined']} "
+              f"user_search={index_plan['executionStats']['totalDocsExamined']}")
+    finally:
+        if not args.keep:
+            await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
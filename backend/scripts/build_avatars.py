@@ -0,0 +1,59 @@
+"""
+One-off migration: build avatar thumbnails for users who have none yet.
+
+update_profile and sign-up keep `users.avatar` current, and the avatar
+endpoint builds a missing one on first request. Run this once after deploying
+thumbnails so list views do not trigger those builds. Pass --all to rebuild
+every user, for example after changing AVATAR_SIZE.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import UpdateOne
+
+from database import db, client
+from avatars import build_avatar
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+
+async def build(users=None, rebuild_all=False):
+    users = users if users is not None else db.users
+    query = {} if rebuild_all else {'avatar': {'$exists': False}}
+    scanned = with_photo = 0
+    batch = []
+    async for user in users.find(query, {'_id': 0, 'user_id': 1, 'profile_photo': 1}):
+        scanned += 1
+        avatar = await build_avatar(user.get('profile_photo'))
+        with_photo += avatar is not None
+        batch.append(UpdateOne({'user_id': user['user_id']}, {'$set': {'avatar': avatar}}))
+        if len(batch) >= BATCH_SIZE:
+            await users.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await users.bulk_write(batch, ordered=False)
+    logger.info(f'Built avatars for {scanned} users ({with_photo} with a photo)')
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--all', action='store_true', help='rebuild every user, not only missing avatars')
+    args = parser.parse_args()
+    logger.info('Building avatar thumbnails...')
+    try:
+        await build(rebuild_all=args.all)
+    except Exception as e:
+        logger.error(f'Build failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,57 @@
+"""
+One-off migration: (re)build the user_search prefix index from db.users.
+
+Registration, profile updates and account deletion keep the index current;
+run this once after deploying user search, or any time to rebuild it from
+scratch.
+"""
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from user_search import search_terms
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+
+async def build(users=None, index=None):
+    users = users if users is not None else db.users
+    index = index if index is not None else db.user_search
+    await index.delete_many({})
+    await index.create_index([('term', 1), ('user_id', 1)], unique=True)
+    await index.create_index('user_id')
+
+    scanned = written = 0
+    batch = []
+    async for user in users.find({}, {'_id': 0, 'user_id': 1, 'username': 1, 'unique_id': 1, 'real_name': 1}):
+        scanned += 1
+        terms = search_terms(user)
+        batch.extend({'term': t, 'user_id': user['user_id'], 'terms': terms} for t in terms)
+        if len(batch) >= BATCH_SIZE:
+            await index.insert_many(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        await index.insert_many(batch, ordered=False)
+        written += len(batch)
+    logger.info(f'Indexed {scanned} users ({written} search terms)')
+
+async def main():
+    logger.info('Building user_search index...')
+    try:
+        await build()
+    except Exception as e:
+        logger.error(f'Build failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+One-off migration: populate users.email_normalized for existing accounts.
+
+Login and Google sign-in look users up by the exact, indexed
+`email_normalized` key instead of a case-insensitive regex on `email`.
+Accounts created before the field existed are still found by their exact (or
+lower-cased) `email` and get the key on their next login, but only this
+migration covers mixed-case addresses typed differently and reports
+conflicts, so run it after deploying.
+
+Accounts whose emails differ only by case would collide on the unique index;
+the oldest keeps the key and the others are listed for manual review. Safe to
+re-run.
+"""
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import UpdateOne
+from database import db, client
+from utils import normalize_email
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+async def migrate():
+    logger.info('Populating users.email_normalized...')
+    updated = scanned = 0
+    conflicts = []
+    try:
+        taken = {}
+        async for user in db.users.find({'email_normalized': {'$type': 'string'}}, {'_id': 0, 'user_id': 1, 'email_normalized': 1}):
+            taken[user['email_normalized']] = user['user_id']
+
+        batch = []
+        cursor = db.users.find(
+            {'email_normalized': {'$exists': False}, 'email': {'$type': 'string'}},
+            {'_id': 0, 'user_id': 1, 'email': 1}
+        ).sort('created_at', 1)
+        async for user in cursor:
+            scanned += 1
+            key = normalize_email(user['email'])
+            if key in taken:
+                conflicts.append((user['user_id'], user['email'], taken[key]))
+                continue
+            taken[key] = user['user_id']
+            batch.append(UpdateOne({'user_id': user['user_id']}, {'$set': {'email_normalized': key}}))
+            if len(batch) >= BATCH_SIZE:
+                result = await db.users.bulk_write(batch, ordered=False)
+                updated += result.modified_count
+                batch = []
+        if batch:
+            result = await db.users.bulk_write(batch, ordered=False)
+            updated += result.modified_count
+
+        await db.users.create_index(
+            'email_normalized', unique=True,
+            partialFilterExpression={'email_normalized': {'$type': 'string'}}
+        )
+        await db.users.create_index('username')
+        logger.info(f'Scanned {scanned} users, updated {updated}')
+        for user_id, email, owner in conflicts:
+            logger.warning(f'{user_id} ({email}) not migrated: same address as {owner}')
+    except Exception as e:
+        logger.error(f'Migration failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(migrate())
@@ -0,0 +1,115 @@
+"""
+One-off migration: move inline attachments out of the messages collection.
+
+Without a CDN, attachments used to be stored inline in the message document:
+a base64 data URI, or the NaCl ciphertext of one when the client uses
+end-to-end encryption. This writes each one to the content-addressed blob
+store (ciphertext as opaque bytes) and leaves only the hash in the message's
+`blob` field, so every copy of a forwarded file shares one blob. Messages
+whose `blob` is set but whose content still carries its /api/blobs URL lose
+the URL, since download URLs are now built when messages are read. Conversation previews
+that pointed at a migrated message are updated too, except for vanish-mode
+messages, whose previews never held the content. Safe to re-run.
+
+MongoDB does not give the space back to the OS by itself; run `compact` on
+the messages collection afterwards.
+"""
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import UpdateOne
+
+from database import db, client
+from encryption import decrypt_message
+from blob_store import blob_store
+from media_storage import blob_fields
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+INLINE_MEDIA_FILTER = {
+    'message_type': {'$nin': ['text', 'location', 'poll']},
+    # Not moved yet, or moved with the URL still in the content
+    '$or': [{'blob': {'$exists': False}}, {'content': {'$nin': ['', None]}}],
+    'is_deleted': {'$ne': True},
+}
+
+
+async def _flush(messages, conversations, message_ops, preview_ops):
+    moved = 0
+    if message_ops:
+        result = await messages.bulk_write(message_ops, ordered=False)
+        moved = result.modified_count
+    if preview_ops:
+        await conversations.bulk_write(preview_ops, ordered=False)
+    return moved
+
+
+def _already_attached(msg: dict):
+    # Legitimate blob URLs were attached when sent; any other one was refused then and stays refused
+    async def may_reference(sha256: str) -> bool:
+        return msg.get('blob') == sha256
+    return may_reference
+
+
+async def migrate(messages=None, conversations=None, store=None):
+    messages = messages if messages is not None else db.messages
+    conversations = conversations if conversations is not None else db.conversations
+    store = store or blob_store
+    scanned = moved = inline_bytes = 0
+    message_ops, preview_ops = [], []
+    projection = {'_id': 0, 'message_id': 1, 'content': 1, 'expires_in': 1, 'blob': 1}
+    cursor = messages.find(INLINE_MEDIA_FILTER, projection).batch_size(BATCH_SIZE)
+    async for msg in cursor:
+        scanned += 1
+        ciphertext = msg.get('content') or ''
+        content = await asyncio.to_thread(decrypt_message, ciphertext)
+        fields = await blob_fields(content, store, may_reference=_already_attached(msg))
+        if not fields:
+            continue
+        inline_bytes += len(ciphertext)
+        # Matching on the old content keeps a concurrent edit or delete from being overwritten
+        message_ops.append(UpdateOne(
+            {'message_id': msg['message_id'], 'content': ciphertext},
+            {'$set': {'content': '', **fields}}
+        ))
+        if not msg.get('expires_in'):
+            # Vanish-mode previews are a placeholder (last_message_summary), not the content
+            preview_ops.append(UpdateOne(
+                {'last_message.message_id': msg['message_id']},
+                {'$set': {'last_message.content': ''}}
+            ))
+        if len(message_ops) >= BATCH_SIZE:
+            moved += await _flush(messages, conversations, message_ops, preview_ops)
+            message_ops, preview_ops = [], []
+    moved += await _flush(messages, conversations, message_ops, preview_ops)
+    return {
+        'scanned': scanned,
+        'moved': moved,
+        'inline_bytes_removed': inline_bytes,
+        'blobs_stored': store.stats['stored'],
+        'deduplicated': store.stats['deduplicated'],
+    }
+
+
+async def main():
+    logger.info('Moving inline attachments to the blob store...')
+    try:
+        result = await migrate()
+        logger.info(f"Scanned {result['scanned']} media messages, moved {result['moved']} "
+                    f"({result['inline_bytes_removed']} inline bytes); "
+                    f"{result['blobs_stored']} blobs written, {result['deduplicated']} duplicates shared")
+    except Exception as e:
+        logger.error(f'Migration failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Recount unread counters from the messages collection.
+
+Counters are kept up to date incrementally (+1 per send, recount on read), so
+they can drift: a read racing a send, deleted messages, vanish-mode expiry,
+a failed counter write. This recounts every participant of every conversation
+(or only those active since --since) from their watermark and overwrites the
+stored counter. Safe to run at any time, e.g. nightly from cron.
+
+Usage:
+  python scripts/reconcile_unread.py [--since 2026-01-01T00:00:00+00:00] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import os
+
+# Add parent directory to sys.path so we can import 'database'
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db, client
+from read_state import read_state as default_read_state
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+async def reconcile(conversations=None, state=None, since=None, concurrency=8):
+    conversations = conversations if conversations is not None else db.conversations
+    state = state if state is not None else default_read_state
+    query = {'updated_at': {'$gte': since}} if since else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    totals = {'conversations': 0, 'counters': 0, 'unread': 0}
+
+    async def one(conv):
+        async with semaphore:
+            counts = await state.reconcile(conv['conversation_id'], conv.get('participants', []))
+        totals['conversations'] += 1
+        totals['counters'] += len(counts)
+        totals['unread'] += sum(counts.values())
+
+    tasks = set()
+    async for conv in conversations.find(query, {'_id': 0, 'conversation_id': 1, 'participants': 1}):
+        tasks.add(asyncio.create_task(one(conv)))
+        if len(tasks) >= concurrency * 4:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+    if tasks:
+        await asyncio.gather(*tasks)
+    logger.info(f"Recounted {totals['counters']} counters in {totals['conversations']} conversations "
+                f"({totals['unread']} unread messages)")
+    return totals
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--since', help='only conversations updated at or after this ISO timestamp')
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    logger.info('Reconciling unread counters...')
+    try:
+        await reconcile(since=args.since, concurrency=args.concurrency)
+    except Exception as e:
+        logger.error(f'Reconcile failed: {e}')
+    finally:
+        client.close()
+        logger.info('MongoDB connection closed')
+
+if __name__ == '__main__':
+    asyncio.run(main())
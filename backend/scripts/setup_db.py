@@ -16,7 +16,25 @@ async def setup():
     try:
         await db.users.create_index('user_id', unique=True)
         await db.users.create_index('email', unique=True)
+        await db.users.create_index(
+            'email_normalized', unique=True,
+            partialFilterExpression={'email_normalized': {'$type': 'string'}}
+        )
+        await db.users.create_index('username')
+        await db.user_search.create_index([('term', 1), ('user_id', 1)], unique=True)
+        await db.user_search.create_index('user_id')
+        await db.uploads.create_index('upload_id', unique=True)
+        await db.uploads.create_index('expires_at', expireAfterSeconds=0)
+        await db.blobs.create_index('sha256', unique=True)
+        await db.read_state.create_index([('user_id', 1), ('conversation_id', 1)], unique=True)
+        await db.read_state.create_index('conversation_id')
         await db.messages.create_index('conversation_id')
+        await db.messages.create_index('message_id', unique=True)
+        # Access checks on attachment downloads: which conversations reference a blob
+        await db.messages.create_index('blob', sparse=True)
+        # Keyset pagination of message history: (conversation_id, message_id)
+        await db.messages.create_index([('conversation_id', 1), ('message_id', -1)])
+        await db.conversations.create_index('conversation_id', unique=True)
         await db.messages.create_index('timestamp')
         # Compound index: speeds up "get last message per conversation" query used in aggregation
         await db.messages.create_index([('conversation_id', 1), ('timestamp', -1)])
@@ -24,7 +42,11 @@ async def setup():
         await db.conversations.create_index('updated_at')
         # Compound index: speeds up the main conversation list filter + sort
         await db.conversations.create_index([('participants', 1), ('updated_at', -1)])
+        # Same, with a tiebreaker for keyset pagination of the conversation list
+        await db.conversations.create_index([('participants', 1), ('updated_at', -1), ('conversation_id', -1)])
         await db.otps.create_index('email')
+        await db.email_outbox.create_index([('status', 1), ('next_attempt_at', 1)])
+        await db.email_outbox.create_index('outbox_id', unique=True)
         logger.info('Database indexes created successfully')
     except Exception as e:
         logger.error(f'Failed to create indexes: {e}')
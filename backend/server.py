@@ -10,13 +10,27 @@ from slowapi.errors import RateLimitExceeded
 from rate_limiter import limiter
 
 from database import db, client
-from socket_instance import sio, _allowed_origins
+from socket_instance import sio, presence, _allowed_origins
+from message_writer import message_writer
+from conversation_cache import conversation_cache
+from dependencies import principal_cache, token_cache
+from encryption import decrypted_cache
+from push_service import push_dispatcher
+from redis_pool import redis_pool
+from password_hasher import password_hasher
+from email_outbox import email_outbox
+from nova import nova_client
+from media_storage import sweep_spool
+from blob_store import blob_store
+from read_receipts import read_receipts
+from typing_indicators import typing_tracker
+from presence_broadcast import presence_broadcaster
 
 # Import to register Socket.IO events
 import socket_events
 
 # Import routers
-from routers import auth, users, chat, push, ai
+from routers import auth, users, chat, push, ai, media
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -28,15 +42,48 @@ async def lifespan(app: FastAPI):
     # Create indexes for optimal querying
     try:
         await db.messages.create_index([("conversation_id", 1), ("timestamp", -1)])
+        await db.messages.create_index([("conversation_id", 1), ("message_id", -1)])
         await db.messages.create_index("expires_at", expireAfterSeconds=0)
         await db.conversations.create_index("participants")
+        await db.conversations.create_index([("participants", 1), ("updated_at", -1), ("conversation_id", -1)])
         await db.users.create_index("email", unique=True)
+        # Exact-match login/lookup key; partial so accounts not yet migrated don't collide on null
+        await db.users.create_index(
+            "email_normalized", unique=True,
+            partialFilterExpression={"email_normalized": {"$type": "string"}}
+        )
+        await db.users.create_index("username")
+        await db.user_search.create_index([("term", 1), ("user_id", 1)], unique=True)
+        await db.user_search.create_index("user_id")
+        await db.uploads.create_index("upload_id", unique=True)
+        await db.uploads.create_index("expires_at", expireAfterSeconds=0)
+        await db.blobs.create_index("sha256", unique=True)
+        await db.read_state.create_index([("user_id", 1), ("conversation_id", 1)], unique=True)
+        await db.read_state.create_index("conversation_id")
         await db.users.create_index("unique_id", unique=True)
+        await db.users.create_index("user_id", unique=True)
+        await db.conversations.create_index("conversation_id", unique=True)
+        await db.messages.create_index("message_id", unique=True)
+        # Access checks on attachment downloads: which conversations reference a blob
+        await db.messages.create_index("blob", sparse=True)
+        await db.email_outbox.create_index([("status", 1), ("next_attempt_at", 1)])
+        await db.email_outbox.create_index("outbox_id", unique=True)
         logger.info('MongoDB indexes verified/created successfully.')
     except Exception as e:
         logger.error(f"Failed to create MongoDB indexes: {e}")
 
+    presence.start()
+    email_outbox.start()
+    await sweep_spool()
     yield
+    await presence.stop()
+    await presence_broadcaster.close()
+    await message_writer.close()
+    await read_receipts.close()
+    await push_dispatcher.stop()
+    await email_outbox.stop()
+    await nova_client.close()
+    await redis_pool.close()
     client.close()
     logger.info('MongoDB connection closed')
 
@@ -55,6 +102,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.include_router(auth.router)
@@ -62,10 +110,30 @@ app.include_router(users.router)
 app.include_router(chat.router)
 app.include_router(push.router)
 app.include_router(ai.router)
+app.include_router(media.router)
 
 @app.get("/")
 @app.head("/")
 async def root():
     return {"status": "ok", "service": "QuickChat API"}
 
+@app.get("/metrics")
+async def metrics():
+    # In-process counters for this worker (cache effectiveness, write batching).
+    return {
+        "conversation_cache": conversation_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "decrypted_cache": decrypted_cache.stats(),
+        "push": push_dispatcher.stats(),
+        "message_writer": message_writer.stats,
+        "redis": redis_pool.stats(),
+        "password_hasher": password_hasher.stats(),
+        "email": await email_outbox.stats(),
+        "blobs": blob_store.stats,
+        "read_receipts": read_receipts.stats,
+        "typing": typing_tracker.stats(),
+        "presence": presence_broadcaster.stats,
+    }
+
 app_asgi = socketio.ASGIApp(sio, app)
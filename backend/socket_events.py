@@ -1,39 +1,70 @@
-import jwt
-from datetime import datetime, timezone, timedelta
+import asyncio
+import logging
+from typing import Dict
+from datetime import datetime, timezone
 from database import db
-from utils import SECRET_KEY, ALGORITHM
+from dependencies import decode_token
 from encryption import encrypt_message
 from spam_protection import spam_protection, is_spam_message
-from socket_instance import sio, active_users, user_sockets
+from socket_instance import sio, presence
+from presence import user_room
+from presence_broadcast import presence_broadcaster
 from push_service import send_push_notification
+from message_writer import message_writer, last_message_summary
+from conversation_cache import conversation_cache
+from ids import new_id
+from media_storage import store_attachment
+from blob_store import with_blob_url, environ_base_url
+from read_receipts import read_receipts
+from typing_indicators import typing_tracker
+from nova import nova_client, nova_rate_limit, build_payload, NOVA_MODEL, NOVA_MAX_STREAMS_PER_SOCKET
 from models import (
-    SendMessageEvent, TypingEvent, MessageReadEvent, 
+    SendMessageEvent, MessageReadEvent, 
     MessagesReadBatchEvent, ReactionEvent, CallUserEvent, 
     AcceptCallEvent, RejectCallEvent, EndCallEvent,
-    IceCandidateEvent, EditMessageEvent, DeleteMessageEvent
+    IceCandidateEvent, EditMessageEvent, DeleteMessageEvent,
+    NovaStreamEvent
 )
 from pydantic import ValidationError
+
+logger = logging.getLogger(__name__)
+
+# Nova answers being streamed to each socket: {sid: {request_id: task}}
+nova_streams: Dict[str, Dict[str, asyncio.Task]] = {}
+
 @sio.on('connect')
 async def connect(sid, environ, auth):
     if not auth or 'token' not in auth: return False
     try:
-        payload = jwt.decode(auth['token'], SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get('sub')
-        active_users[user_id] = sid
-        user_sockets[sid] = user_id
-        await db.users.update_one({'user_id': user_id}, {'$set': {'online_status': 'online'}})
-        await sio.emit('user_online', {'user_id': user_id}, skip_sid=sid)
-        return True
-    except: return False
+        payload = decode_token(auth['token'])
+    except Exception:
+        return False
+    user_id = payload.get('sub')
+    if not user_id: return False
+    await sio.enter_room(sid, user_room(user_id))
+    # The token is valid, so presence trouble is logged rather than refusing the socket
+    try:
+        # Only the first device flips the user online; extra tabs are silent.
+        # Contacts hear about it in the next presence_diff batch.
+        if await presence.connect(user_id, sid):
+            presence_broadcaster.changed(user_id, True)
+    except Exception as e:
+        logger.error(f"Presence registration failed for {user_id}: {e}")
+    return True
 
 @sio.on('disconnect')
 async def disconnect(sid):
-    if sid in user_sockets:
-        user_id = user_sockets[sid]
-        await db.users.update_one({'user_id': user_id}, {'$set': {'online_status': 'offline'}})
-        active_users.pop(user_id, None) # Safe removal without throwing KeyError
-        user_sockets.pop(sid, None)
-        await sio.emit('user_offline', {'user_id': user_id})
+    try:
+        await typing_tracker.disconnect(sid)
+        user_id, went_offline = await presence.disconnect(sid)
+    finally:
+        # Stop generating answers nobody will read. Only once presence has forgotten
+        # the sid: until then nova_stream may still register a stream for it.
+        for task in nova_streams.pop(sid, {}).values():
+            task.cancel()
+    # Another tab or device is still connected: the user stays online.
+    if user_id and went_offline:
+        presence_broadcaster.changed(user_id, False)
 
 @sio.on('join_conversation')
 async def join_conversation(sid, data):
@@ -42,8 +73,8 @@ async def join_conversation(sid, data):
 
 @sio.on('send_message')
 async def handle_message(sid, data):
-    if sid not in user_sockets: return
-    user_id = user_sockets[sid]
+    user_id = presence.user_id(sid)
+    if not user_id: return
     
     try:
         validated_data = SendMessageEvent(**data)
@@ -51,13 +82,13 @@ async def handle_message(sid, data):
         await sio.emit('error', {'message': 'Invalid payload format'}, to=sid)
         return
 
-    is_spam, reason = spam_protection.check_spam(user_id)
+    is_spam, reason = await spam_protection.check_spam(user_id)
     if is_spam:
         await sio.emit('error', {'message': reason}, to=sid)
         return
 
     conversation_id = data.get('conversation_id')
-    conversation = await db.conversations.find_one({'conversation_id': conversation_id})
+    conversation = await conversation_cache.get(conversation_id)
     if not conversation:
         await sio.emit('error', {'message': 'Conversation not found'}, to=sid)
         return
@@ -89,9 +120,14 @@ async def handle_message(sid, data):
             await sio.emit('error', {'message': reason}, to=sid)
             return
 
+    # Attachments sent over the socket go to media storage like the REST upload
+    media_fields = {}
+    if msg_type not in ('text', 'location', 'poll') and content:
+        content, media_fields = await store_attachment(content, user_id, file_name=validated_data.file_name)
+
     encrypted_content = encrypt_message(content) if content else ''
     
-    msg_id = f"msg_{datetime.now(timezone.utc).timestamp()}".replace('.', '_')
+    msg_id = new_id('msg')
     doc = {
         'message_id': msg_id,
         'conversation_id': conversation_id,
@@ -107,124 +143,78 @@ async def handle_message(sid, data):
         'is_edited': False,
         'is_deleted': False
     }
+    doc.update(media_fields)
     
-    await db.messages.insert_one(doc)
-    await db.conversations.update_one(
-        {'conversation_id': doc['conversation_id']}, 
-        {'$set': {'updated_at': doc['timestamp']}}
-    )
+    recipients = [p for p in conversation.get('participants', []) if p != user_id]
+    try:
+        # Coalesced with other in-flight sends; returns once the write is durable.
+        await message_writer.persist(doc, recipients=recipients)
+    except Exception:
+        await sio.emit('error', {'message': 'Message could not be saved', 'temp_id': validated_data.temp_id}, to=sid)
+        return {'status': 'error', 'temp_id': validated_data.temp_id}
     
     response_doc = doc.copy()
     response_doc['content'] = content
     response_doc.pop('_id', None)
+    with_blob_url(response_doc, environ_base_url(sio.get_environ(sid)))
     temp_id = validated_data.temp_id
     if temp_id:
         response_doc['temp_id'] = temp_id
     
     await sio.emit('new_message', response_doc, room=doc['conversation_id'])
+    await typing_tracker.stop(user_id, conversation_id)
+    # +1 for the conversation list, which may not be in the conversation room; reads send
+    # the absolute count as `unread_count` (read_receipts.py)
+    for recipient_id in recipients:
+        await sio.emit('unread_increment', {'conversation_id': conversation_id, 'by': 1}, room=user_room(recipient_id))
 
-    if other_id and other_id not in active_users:
+    if other_id and not await presence.is_online(other_id):
         sender_name = sender.get('real_name', 'Someone') if sender else 'Someone'
-        await send_push_notification(other_id, {
+        # Queued for the push workers; the handler does not wait on push endpoints
+        send_push_notification(other_id, {
             "title": sender_name,
             "body": content if msg_type == 'text' else f"Sent a {msg_type}",
             "data": { "url": f"/?chat={conversation_id}" } 
         })
 
+    # Socket.IO ack for clients that emit with a callback: the message is persisted.
+    return {'status': 'ok', 'message_id': msg_id, 'temp_id': temp_id}
+
 @sio.on('typing')
 async def handle_typing(sid, data):
-    if sid in user_sockets:
-        try:
-            validated_data = TypingEvent(**data)
-            await sio.emit('user_typing', {
-                'user_id': user_sockets[sid],
-                'conversation_id': validated_data.conversation_id
-            }, room=validated_data.conversation_id, skip_sid=sid)
-        except ValidationError:
-            pass
+    user_id = presence.user_id(sid)
+    # Fires per keystroke burst: a plain type check instead of building a TypingEvent
+    if user_id and isinstance(data, dict) and isinstance(data.get('conversation_id'), str):
+        await typing_tracker.typing(sid, user_id, data['conversation_id'])
 
+# Reads are coalesced per (user, conversation) and written/broadcast once per window
 @sio.on('message_read')
 async def handle_read(sid, data):
-    if sid in user_sockets:
+    user_id = presence.user_id(sid)
+    if user_id:
         try:
             val = MessageReadEvent(**data)
-            
-            # Fetch message to check for Vanish Mode
-            msg = await db.messages.find_one({'message_id': val.message_id}, {'expires_in': 1, 'expires_at': 1})
-            expires_at_str = None
-            if msg:
-                updates = {'$addToSet': {'read_by': user_sockets[sid]}}
-                
-                # If message has expires_in > 0 and no expires_at yet, start the timer
-                if msg.get('expires_in', 0) > 0 and not msg.get('expires_at'):
-                    expires_at = datetime.now(timezone.utc) + timedelta(seconds=msg['expires_in'])
-                    updates['$set'] = {'expires_at': expires_at}
-                    expires_at_str = expires_at.isoformat()
-                elif msg.get('expires_at'):
-                    # if it was already set, we could broadcast it anyway but normally it's already there
-                    expires_at_str = msg['expires_at'].isoformat() if isinstance(msg['expires_at'], datetime) else msg['expires_at']
-                    
-                await db.messages.update_one({'message_id': val.message_id}, updates)
-                
-            await sio.emit('message_read', {
-                'message_id': val.message_id, 
-                'user_id': user_sockets[sid],
-                'expires_at': expires_at_str
-            }, room=val.conversation_id)
         except ValidationError:
-            pass
+            return
+        read_receipts.add(user_id, val.conversation_id, [val.message_id])
 
 @sio.on('messages_read_batch')
 async def handle_read_batch(sid, data):
-    if sid in user_sockets:
-        message_ids = data.get('message_ids', [])
-        conversation_id = data.get('conversation_id')
-        if message_ids:
-            # We must process Vanish mode for batch reads
-            cursor = db.messages.find({'message_id': {'$in': message_ids}}, {'message_id': 1, 'expires_in': 1, 'expires_at': 1})
-            messages = await cursor.to_list(length=len(message_ids))
-            
-            updates_by_expires = {}
-            expires_at_map = {}
-            base_updates = []
-            
-            for msg in messages:
-                if msg.get('expires_in', 0) > 0 and not msg.get('expires_at'):
-                    # Message is in vanish mode and timer hasn't started!
-                    expires_at = datetime.now(timezone.utc) + timedelta(seconds=msg['expires_in'])
-                    await db.messages.update_one(
-                        {'message_id': msg['message_id']},
-                        {
-                            '$addToSet': {'read_by': user_sockets[sid]},
-                            '$set': {'expires_at': expires_at}
-                        }
-                    )
-                    expires_at_map[msg['message_id']] = expires_at.isoformat()
-                else:
-                    # Message is normal OR already vanishing
-                    base_updates.append(msg['message_id'])
-                    if msg.get('expires_at'):
-                         expires_at_map[msg['message_id']] = msg['expires_at'].isoformat() if isinstance(msg['expires_at'], datetime) else msg['expires_at']
-            
-            # Batch update read_by for messages that didn't need a specific new expires_at
-            if base_updates:
-                await db.messages.update_many(
-                    {'message_id': {'$in': base_updates}},
-                    {'$addToSet': {'read_by': user_sockets[sid]}}
-                )
-
-            await sio.emit('messages_read_batch', {
-                'message_ids': message_ids,
-                'user_id': user_sockets[sid],
-                'expires_at_map': expires_at_map
-            }, room=conversation_id)
+    user_id = presence.user_id(sid)
+    if user_id:
+        try:
+            val = MessagesReadBatchEvent(**data)
+        except ValidationError:
+            return
+        if val.message_ids:
+            read_receipts.add(user_id, val.conversation_id, val.message_ids)
 
 @sio.on('react_to_message')
 async def react_to_message(sid, data):
-    if sid in user_sockets:
+    user_id = presence.user_id(sid)
+    if user_id:
         try:
             val = ReactionEvent(**data)
-            user_id = user_sockets[sid]
             reaction = {'user_id': user_id, 'emoji': val.emoji}
             
             # Check if this exact reaction already exists
@@ -259,10 +249,10 @@ async def react_to_message(sid, data):
 
 @sio.on('edit_message')
 async def edit_message(sid, data):
-    if sid in user_sockets:
+    user_id = presence.user_id(sid)
+    if user_id:
         try:
             val = EditMessageEvent(**data)
-            user_id = user_sockets[sid]
             
             msg = await db.messages.find_one({'message_id': val.message_id})
             if not msg or msg['sender_id'] != user_id:
@@ -281,6 +271,11 @@ async def edit_message(sid, data):
                 {'message_id': val.message_id},
                 {'$set': {'content': encrypted_content, 'is_edited': True}}
             )
+            # Keep the conversation list preview in sync if this is the latest message
+            await db.conversations.update_one(
+                {'conversation_id': msg['conversation_id'], 'last_message.message_id': val.message_id},
+                {'$set': {'last_message': last_message_summary({**msg, 'content': encrypted_content, 'is_edited': True})}}
+            )
             
             await sio.emit('message_edited', {
                 'message_id': val.message_id,
@@ -291,10 +286,10 @@ async def edit_message(sid, data):
 
 @sio.on('delete_message')
 async def delete_message(sid, data):
-    if sid in user_sockets:
+    user_id = presence.user_id(sid)
+    if user_id:
         try:
             val = DeleteMessageEvent(**data)
-            user_id = user_sockets[sid]
             
             msg = await db.messages.find_one({'message_id': val.message_id})
             if not msg or msg['sender_id'] != user_id:
@@ -320,6 +315,12 @@ async def delete_message(sid, data):
                     }
                 }
             )
+            await db.conversations.update_one(
+                {'conversation_id': msg['conversation_id'], 'last_message.message_id': val.message_id},
+                {'$set': {'last_message': last_message_summary({
+                    **msg, 'content': empty_encrypted, 'is_deleted': True, 'message_type': 'text'
+                })}}
+            )
             
             await sio.emit('message_deleted', {
                 'message_id': val.message_id
@@ -329,26 +330,29 @@ async def delete_message(sid, data):
 
 @sio.on('call_user')
 async def call_user(sid, data):
-    if sid not in user_sockets: return
+    user_id = presence.user_id(sid)
+    if not user_id: return
     try:
         val = CallUserEvent(**data)
-        if val.callee_id in active_users:
-            caller = await db.users.find_one({'user_id': user_sockets[sid]}, {'_id':0})
+        if await presence.is_online(val.callee_id):
+            caller = await db.users.find_one({'user_id': user_id}, {'_id':0})
             await sio.emit('incoming_call', {
-                'caller': caller, 'caller_id': user_sockets[sid],
+                'caller': caller, 'caller_id': user_id,
                 'signal': val.signal, 'call_type': val.call_type
-            }, room=active_users[val.callee_id])
+            }, room=user_room(val.callee_id))
     except ValidationError:
         pass
 
 @sio.on('accept_call')
 async def accept_call(sid, data):
+    user_id = presence.user_id(sid)
+    if not user_id: return
     try:
         val = AcceptCallEvent(**data)
-        if val.caller_id in active_users:
+        if await presence.is_online(val.caller_id):
             await sio.emit('call_accepted', {
-                'callee_id': user_sockets[sid], 'signal': val.signal
-            }, room=active_users[val.caller_id])
+                'callee_id': user_id, 'signal': val.signal
+            }, room=user_room(val.caller_id))
     except ValidationError:
         pass
 
@@ -356,30 +360,106 @@ async def accept_call(sid, data):
 async def reject_call(sid, data):
     try:
         val = RejectCallEvent(**data)
-        if val.caller_id in active_users:
-            await sio.emit('call_rejected', {}, room=active_users[val.caller_id])
+        if await presence.is_online(val.caller_id):
+            await sio.emit('call_rejected', {}, room=user_room(val.caller_id))
     except ValidationError:
         pass
 
 @sio.on('end_call')
 async def end_call(sid, data):
-    if sid not in user_sockets: return
+    user_id = presence.user_id(sid)
+    if not user_id: return
     try:
         val = EndCallEvent(**data)
-        if val.other_user_id in active_users:
-            await sio.emit('call_ended', {}, room=active_users[val.other_user_id])
+        if await presence.is_online(val.other_user_id):
+            await sio.emit('call_ended', {}, room=user_room(val.other_user_id))
     except ValidationError:
         pass
 
 @sio.on('ice_candidate')
 async def handle_ice_candidate(sid, data):
-    if sid not in user_sockets: return
+    user_id = presence.user_id(sid)
+    if not user_id: return
     try:
         val = IceCandidateEvent(**data)
-        if val.target_id in active_users:
+        if await presence.is_online(val.target_id):
             await sio.emit('ice_candidate', {
                 'candidate': val.candidate,
-                'sender_id': user_sockets[sid]
-            }, room=active_users[val.target_id])
+                'sender_id': user_id
+            }, room=user_room(val.target_id))
     except ValidationError:
         pass
+
+@sio.on('nova_stream')
+async def nova_stream(sid, data):
+    """Stream a Nova answer as `nova_token` events, then `nova_done` (or `nova_error`)."""
+    user_id = presence.user_id(sid)
+    if not user_id: return
+    try:
+        val = NovaStreamEvent(**data)
+    except ValidationError:
+        await sio.emit('error', {'message': 'Invalid payload format'}, to=sid)
+        return
+    if not nova_client.configured:
+        await sio.emit('nova_error', {'request_id': val.request_id, 'detail': 'AI feature is not configured.'}, to=sid)
+        return
+
+    def at_capacity() -> bool:
+        streams = nova_streams.get(sid, {})
+        return val.request_id not in streams and len(streams) >= NOVA_MAX_STREAMS_PER_SOCKET
+
+    if at_capacity():
+        await sio.emit('nova_error', {'request_id': val.request_id,
+                                      'detail': 'Wait for the current answer to finish.'}, to=sid)
+        return
+    if not await nova_rate_limit.allow(user_id):
+        await sio.emit('nova_error', {'request_id': val.request_id,
+                                      'detail': 'Too many questions, try again in a minute.'}, to=sid)
+        return
+    # Checked again after the await: from here to registering the task nothing yields, so a
+    # socket presence still knows about is cancelled by its disconnect handler later
+    if presence.user_id(sid) is None:
+        return
+    if at_capacity():
+        await sio.emit('nova_error', {'request_id': val.request_id,
+                                      'detail': 'Wait for the current answer to finish.'}, to=sid)
+        return
+
+    streams = nova_streams.setdefault(sid, {})
+    if val.request_id in streams:
+        streams[val.request_id].cancel()
+    task = asyncio.create_task(_stream_nova(sid, val.request_id, user_id, val))
+    streams[val.request_id] = task
+
+    def forget(_):
+        if nova_streams.get(sid, {}).get(val.request_id) is task:
+            del nova_streams[sid][val.request_id]
+            if not nova_streams[sid]:
+                del nova_streams[sid]
+
+    task.add_done_callback(forget)
+    return {'status': 'ok', 'request_id': val.request_id}
+
+async def _stream_nova(sid, request_id, user_id, val: NovaStreamEvent):
+    parts = []
+    try:
+        user = await db.users.find_one({'user_id': user_id}, {'_id': 0, 'real_name': 1})
+        payload = build_payload(
+            [{'role': m.role, 'content': m.content} for m in val.messages],
+            val.model or NOVA_MODEL,
+            (user or {}).get('real_name', 'User')
+        )
+        async for delta in nova_client.stream(payload):
+            parts.append(delta)
+            await sio.emit('nova_token', {'request_id': request_id, 'delta': delta}, to=sid)
+        await sio.emit('nova_done', {'request_id': request_id, 'content': ''.join(parts)}, to=sid)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        await sio.emit('nova_error', {'request_id': request_id, 'detail': 'Nova is currently unavailable.'}, to=sid)
+
+@sio.on('nova_cancel')
+async def nova_cancel(sid, data):
+    task = nova_streams.get(sid, {}).get((data or {}).get('request_id'))
+    if task:
+        task.cancel()
@@ -1,21 +1,54 @@
 import socketio
 import os
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
+from presence import PresenceRegistry
+from redis_pool import redis_pool
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+logger = logging.getLogger(__name__)
+
 _cors_env = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000')
 _allowed_origins = [o.strip() for o in _cors_env.split(',') if o.strip()]
 
 redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
-# try:
-#     mgr = socketio.AsyncRedisManager(redis_url)
-# except Exception:
-#     mgr = None
-#     print("Warning: Redis not configured or not available. Running socket.io without external manager.")
-mgr = None
+# 'auto'   -> Redis pub/sub when REDIS_URL answers a ping, in-process otherwise
+# 'redis'  -> always use Redis (startup fails loudly if it is unreachable)
+# 'memory' -> single-process manager, no cross-worker fan-out
+SOCKETIO_MANAGER = os.getenv('SOCKETIO_MANAGER', 'auto').lower()
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'quickchat-socketio')
+
+
+def _redis_reachable(url: str) -> bool:
+    try:
+        import redis
+        return bool(redis.from_url(url, socket_timeout=1, socket_connect_timeout=1).ping())
+    except Exception as e:
+        logger.warning(f"Redis not reachable at {url}: {e}")
+        return False
+
+
+def create_client_manager(url: str = redis_url, mode: str = SOCKETIO_MANAGER, channel: str = SOCKETIO_CHANNEL):
+    """
+    Build the Socket.IO client manager.
+
+    With a Redis manager every `sio.emit(..., room=...)` is published on a
+    pub/sub channel, so sockets connected to any worker or node receive it.
+    Returns None for the default in-process manager.
+    """
+    if mode == 'memory':
+        return None
+    if mode == 'redis' or _redis_reachable(url):
+        logger.info(f"Socket.IO using Redis client manager on channel '{channel}'.")
+        return socketio.AsyncRedisManager(url, channel=channel)
+    logger.warning("Socket.IO running with in-process client manager (single worker only).")
+    return None
+
+
+mgr = create_client_manager()
 
 sio = socketio.AsyncServer(
     async_mode='asgi',
@@ -25,6 +58,9 @@ sio = socketio.AsyncServer(
     ping_interval=25
 )
 
-# In-memory storage for sockets
-active_users = {}  # {user_id: socket_id}
-user_sockets = {}  # {socket_id: user_id}
+# Multi-device presence: {user_id: {sid, ...}}. Shared through Redis whenever the
+# Socket.IO manager is, so every worker sees the same online/offline state.
+if mgr is not None:
+    presence = PresenceRegistry(pool=redis_pool)
+else:
+    presence = PresenceRegistry()
@@ -2,78 +2,197 @@
 Spam protection and rate limiting for QuickChat
 """
 
-from datetime import datetime, timedelta, timezone
-from collections import defaultdict
-from typing import Dict, List
+import os
+import re
+import time
+import random
+import logging
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from redis_pool import redis_pool
+
+logger = logging.getLogger(__name__)
+
+SPAM_LIMITER_BACKEND = os.getenv('SPAM_LIMITER_BACKEND', 'memory').lower()
+
+MINUTE = 60
+HOUR = 3600
+
+_BLOCKED_MSG = "You are temporarily blocked due to spam. Try again later."
+_HOURLY_MSG = "You've exceeded the hourly message limit. Try again later."
+_MINUTE_MSG = "You're sending messages too quickly. Please slow down."
+
+
+class _Window:
+    """
+    Sliding-window counter: the current fixed window's count plus the previous
+    window's count weighted by how much of it still overlaps the last `size`
+    seconds. Two integers per window instead of one timestamp per message.
+    """
+    __slots__ = ('index', 'current', 'previous')
+
+    def __init__(self):
+        self.index = 0
+        self.current = 0
+        self.previous = 0
+
+    def estimate(self, now: float, size: int) -> float:
+        index = int(now // size)
+        if index != self.index:
+            self.previous = self.current if index == self.index + 1 else 0
+            self.current = 0
+            self.index = index
+        overlap = 1 - (now - index * size) / size
+        return self.previous * overlap + self.current
+
+
+class _UserState:
+    __slots__ = ('minute', 'hour', 'blocked_until', 'last_seen')
+
+    def __init__(self):
+        self.minute = _Window()
+        self.hour = _Window()
+        self.blocked_until = 0.0
+        self.last_seen = 0.0
+
+
+# Atomic equivalent of SpamProtection._check_memory for a Redis backend shared by all workers.
+# KEYS[1] = block key, KEYS[2] = counter key prefix
+# ARGV = now, per-minute limit, per-hour limit, block seconds
+# Returns 0 = allowed, 1 = blocked, 2 = hourly limit hit (now blocked), 3 = per-minute limit hit
+_REDIS_CHECK_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 1 end
+local now = tonumber(ARGV[1])
+local function window(size)
+  local idx = math.floor(now / size)
+  local cur_key = KEYS[2] .. ':' .. size .. ':' .. idx
+  local cur = tonumber(redis.call('GET', cur_key) or '0')
+  local prev = tonumber(redis.call('GET', KEYS[2] .. ':' .. size .. ':' .. (idx - 1)) or '0')
+  return prev * (1 - (now - idx * size) / size) + cur, cur_key
+end
+local hour_est, hour_key = window(3600)
+if hour_est >= tonumber(ARGV[3]) then
+  redis.call('SET', KEYS[1], 1, 'EX', tonumber(ARGV[4]))
+  return 2
+end
+local minute_est, minute_key = window(60)
+if minute_est >= tonumber(ARGV[2]) then return 3 end
+redis.call('INCR', hour_key)
+redis.call('EXPIRE', hour_key, 7200)
+redis.call('INCR', minute_key)
+redis.call('EXPIRE', minute_key, 120)
+return 0
+"""
+
+_REDIS_RESULTS = {0: (False, "OK"), 1: (True, _BLOCKED_MSG), 2: (True, _HOURLY_MSG), 3: (True, _MINUTE_MSG)}
+
 
 class SpamProtection:
-    def __init__(self, max_messages_per_minute: int = 10, max_messages_per_hour: int = 100):
+    """
+    Per-user message rate limits with constant-time checks.
+    State for users idle longer than an hour (and not blocked) is evicted, so
+    memory tracks active users only. Pass an async Redis client to share the
+    limits across workers; on Redis errors the local counters are used.
+    """
+    def __init__(self, max_messages_per_minute: int = 10, max_messages_per_hour: int = 100,
+                 block_seconds: int = HOUR, redis=None, clock=time.time):
         self.max_messages_per_minute = max_messages_per_minute
         self.max_messages_per_hour = max_messages_per_hour
-        self.user_messages: Dict[str, List[datetime]] = defaultdict(list)
-        self.blocked_users: Dict[str, datetime] = {}
+        self.block_seconds = block_seconds
+        self.redis = redis
+        self._clock = clock
+        # Ordered by last activity so idle users can be evicted from the front in O(1)
+        self._users: "OrderedDict[str, _UserState]" = OrderedDict()
+        self._script = redis.register_script(_REDIS_CHECK_SCRIPT) if redis is not None else None
 
-    def check_spam(self, user_id: str) -> tuple[bool, str]:
+    async def check_spam(self, user_id: str) -> tuple[bool, str]:
         """
         Check if user is spamming
         Returns (is_spam, message)
         """
-        now = datetime.now(timezone.utc)
-        
+        if self._script is not None:
+            try:
+                code = await self._script(
+                    keys=[f"spam:block:{user_id}", f"spam:count:{user_id}"],
+                    args=[self._clock(), self.max_messages_per_minute, self.max_messages_per_hour, self.block_seconds]
+                )
+                return _REDIS_RESULTS[int(code)]
+            except Exception as e:
+                logger.warning(f"Redis spam check failed, using local limits: {e}")
+        return self._check_memory(user_id)
+
+    def _check_memory(self, user_id: str) -> tuple[bool, str]:
+        now = self._clock()
+        self._evict_idle(now)
+
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+        else:
+            self._users.move_to_end(user_id)
+        state.last_seen = now
+
         # Check if user is temporarily blocked
-        if user_id in self.blocked_users:
-            if self.blocked_users[user_id] > now:
-                return True, "You are temporarily blocked due to spam. Try again later."
-            else:
-                del self.blocked_users[user_id]
-        
-        # Clean old messages
-        one_hour_ago = now - timedelta(hours=1)
-        if user_id in self.user_messages:
-            self.user_messages[user_id] = [
-                msg_time for msg_time in self.user_messages[user_id]
-                if msg_time > one_hour_ago
-            ]
-        
+        if state.blocked_until > now:
+            return True, _BLOCKED_MSG
+
         # Check hourly limit
-        messages_in_hour = len(self.user_messages[user_id])
-        if messages_in_hour >= self.max_messages_per_hour:
+        if state.hour.estimate(now, HOUR) >= self.max_messages_per_hour:
             # Block user for 1 hour
-            self.blocked_users[user_id] = now + timedelta(hours=1)
-            return True, "You've exceeded the hourly message limit. Try again later."
-        
+            state.blocked_until = now + self.block_seconds
+            return True, _HOURLY_MSG
+
         # Check per-minute limit
-        one_minute_ago = now - timedelta(minutes=1)
-        messages_in_minute = sum(
-            1 for msg_time in self.user_messages[user_id]
-            if msg_time > one_minute_ago
-        )
-        
-        if messages_in_minute >= self.max_messages_per_minute:
-            return True, "You're sending messages too quickly. Please slow down."
-        
+        if state.minute.estimate(now, MINUTE) >= self.max_messages_per_minute:
+            return True, _MINUTE_MSG
+
         # Record message
-        self.user_messages[user_id].append(now)
+        state.hour.current += 1
+        state.minute.current += 1
         return False, "OK"
 
-    def get_user_block_status(self, user_id: str) -> bool:
+    def _evict_idle(self, now: float):
+        # Anyone idle for a full hour has no weight left in either window
+        horizon = now - HOUR
+        while self._users:
+            user_id, state = next(iter(self._users.items()))
+            if state.last_seen > horizon:
+                break
+            self._users.popitem(last=False)
+            if state.blocked_until > now:
+                # Still blocked: keep it, re-queued at the back
+                self._users[user_id] = state
+                state.last_seen = now
+
+    async def get_user_block_status(self, user_id: str) -> bool:
         """Check if user is currently blocked"""
-        if user_id in self.blocked_users:
-            if self.blocked_users[user_id] > datetime.now(timezone.utc):
-                return True
-            else:
-                del self.blocked_users[user_id]
-        return False
-
-    def reset_user(self, user_id: str):
+        if self.redis is not None:
+            try:
+                return bool(await self.redis.exists(f"spam:block:{user_id}"))
+            except Exception as e:
+                logger.warning(f"Redis block lookup failed: {e}")
+        state = self._users.get(user_id)
+        return bool(state) and state.blocked_until > self._clock()
+
+    async def reset_user(self, user_id: str):
         """Reset spam record for a user (admin action)"""
-        if user_id in self.user_messages:
-            del self.user_messages[user_id]
-        if user_id in self.blocked_users:
-            del self.blocked_users[user_id]
+        self._users.pop(user_id, None)
+        if self.redis is not None:
+            keys = [f"spam:block:{user_id}"] + [k async for k in self.redis.scan_iter(f"spam:count:{user_id}:*")]
+            await self.redis.delete(*keys)
+
+    def tracked_users(self) -> int:
+        return len(self._users)
+
+
+def _create_spam_protection() -> SpamProtection:
+    if SPAM_LIMITER_BACKEND == 'redis':
+        return SpamProtection(redis=redis_pool.client)
+    return SpamProtection()
 
 # Global spam protection instance
-spam_protection = SpamProtection()
+spam_protection = _create_spam_protection()
 
 # Keyword-based spam detection
 SPAM_KEYWORDS = [
@@ -83,36 +202,133 @@ SPAM_KEYWORDS = [
     'adult content', 'xxx'
 ]
 
+# Optional newline-separated keyword file; picked up again whenever it changes
+SPAM_KEYWORDS_FILE = os.getenv('SPAM_KEYWORDS_FILE', '')
+_KEYWORD_FILE_CHECK_SECONDS = 30
+
+_URL_PATTERN = re.compile(r'https?://')
+
+# Above this length the repeated-character check samples instead of building a histogram
+_HISTOGRAM_MAX_LENGTH = 512
+_REPEAT_SAMPLES = 128
+
+
+def _compile_keywords(keywords) -> Optional["re.Pattern"]:
+    """
+    Compile keywords into one regex shaped like a prefix trie, e.g.
+    ['click here', 'click link'] -> 'click\\ (?:here|link)'. The regex engine then
+    walks all keywords together in a single pass (Aho-Corasick style) instead
+    of rescanning the text once per keyword.
+    """
+    trie: dict = {}
+    for word in {k.lower() for k in keywords if k}:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}
+    if not trie:
+        return None
+
+    def build(node: dict) -> str:
+        terminal = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # A keyword ending here already matched; the longer ones are optional
+        return '(?:' + body + ')?' if terminal else body
+
+    return re.compile(build(trie))
+
+
+class ContentScanner:
+    """
+    Content spam checks that cost a fixed number of C-level passes over the
+    text, independent of how many distinct characters or keywords there are.
+    """
+    def __init__(self, keywords=SPAM_KEYWORDS, keywords_file: str = SPAM_KEYWORDS_FILE,
+                 repeat_ratio: float = 0.7, max_urls: int = 2, caps_min_length: int = 20):
+        self.repeat_ratio = repeat_ratio
+        self.max_urls = max_urls
+        self.caps_min_length = caps_min_length
+        self.keywords_file = keywords_file
+        self._keywords_mtime = None
+        self._next_file_check = 0.0
+        self.reload(keywords)
+
+    def reload(self, keywords):
+        """Swap in a new keyword list; the compiled matcher is replaced atomically."""
+        self.keywords = list(keywords)
+        self._keyword_pattern = _compile_keywords(self.keywords)
+
+    def _maybe_reload_file(self):
+        if not self.keywords_file:
+            return
+        now = time.monotonic()
+        if now < self._next_file_check:
+            return
+        self._next_file_check = now + _KEYWORD_FILE_CHECK_SECONDS
+        try:
+            mtime = os.path.getmtime(self.keywords_file)
+            if mtime != self._keywords_mtime:
+                with open(self.keywords_file, encoding='utf-8') as f:
+                    self.reload([line.strip() for line in f if line.strip()])
+                self._keywords_mtime = mtime
+                logger.info(f"Loaded {len(self.keywords)} spam keywords from {self.keywords_file}")
+        except OSError as e:
+            logger.warning(f"Could not read spam keywords file: {e}")
+
+    def contains_keywords(self, message: str) -> bool:
+        self._maybe_reload_file()
+        pattern = self._keyword_pattern
+        return bool(pattern and pattern.search(message.lower()))
+
+    def _has_dominant_char(self, message: str) -> bool:
+        limit = len(message) * self.repeat_ratio
+        if len(message) <= _HISTOGRAM_MAX_LENGTH:
+            return max(Counter(message).values()) > limit
+        # A character filling >70% of the text fills ~70% of a random sample too;
+        # the odds of it showing up in under 40% of 128 samples are below 1e-12.
+        # Only those frequent candidates get an exact count.
+        sample = Counter(random.choices(message, k=_REPEAT_SAMPLES))
+        return any(
+            seen >= _REPEAT_SAMPLES * 0.4 and message.count(ch) > limit
+            for ch, seen in sample.items()
+        )
+
+    def scan(self, message: str) -> tuple[bool, str]:
+        if not message:
+            return False, "OK"
+
+        # Check for repeated characters (e.g., "AAAAAAAA")
+        if self._has_dominant_char(message):
+            return True, "Message contains excessive repeated characters"
+
+        # Check for URLs (potential phishing)
+        if 'http' in message and len(_URL_PATTERN.findall(message)) > self.max_urls:
+            return True, "Message contains too many URLs"
+
+        # Check for spam keywords
+        if self.contains_keywords(message):
+            return True, "Message contains spam keywords"
+
+        # Check for all caps messages (limit to reasonable length)
+        if len(message) > self.caps_min_length and message.isupper():
+            return True, "Message is in all caps"
+
+        return False, "OK"
+
+
+content_scanner = ContentScanner()
+
+
 def contains_spam_keywords(message: str) -> bool:
     """Check if message contains known spam keywords"""
-    message_lower = message.lower()
-    for keyword in SPAM_KEYWORDS:
-        if keyword in message_lower:
-            return True
-    return False
+    return content_scanner.contains_keywords(message)
 
 def is_spam_message(message: str) -> tuple[bool, str]:
     """
     Check if message is spam
     Returns (is_spam, reason)
     """
-    # Check for repeated characters (e.g., "AAAAAAAA")
-    for char in set(message):
-        if message.count(char) > len(message) * 0.7:
-            return True, "Message contains excessive repeated characters"
-    
-    # Check for URLs (potential phishing)
-    if 'http://' in message or 'https://' in message:
-        url_count = message.count('http://') + message.count('https://')
-        if url_count > 2:
-            return True, "Message contains too many URLs"
-    
-    # Check for spam keywords
-    if contains_spam_keywords(message):
-        return True, "Message contains spam keywords"
-    
-    # Check for all caps messages (limit to reasonable length)
-    if len(message) > 20 and message.isupper():
-        return True, "Message is in all caps"
-    
-    return False, "OK"
+    return content_scanner.scan(message)
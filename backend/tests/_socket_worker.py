@@ -0,0 +1,33 @@
+"""
+Minimal Socket.IO worker used by test_socket_manager.py.
+
+Each process builds its own AsyncServer through socket_instance.create_client_manager,
+so rooms joined on one worker are only reachable from another through Redis.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio
+import uvicorn
+from socket_instance import create_client_manager
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    client_manager=create_client_manager(os.environ['REDIS_URL'], mode='redis', channel=os.environ['SOCKETIO_CHANNEL']),
+    cors_allowed_origins='*'
+)
+
+@sio.on('join_conversation')
+async def join_conversation(sid, data):
+    await sio.enter_room(sid, data['conversation_id'])
+    return True
+
+@sio.on('send_message')
+async def send_message(sid, data):
+    await sio.emit('new_message', data, room=data['conversation_id'])
+    return True
+
+if __name__ == '__main__':
+    uvicorn.run(socketio.ASGIApp(sio), host='127.0.0.1', port=int(sys.argv[1]), log_level='warning')
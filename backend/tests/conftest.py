@@ -2,7 +2,34 @@ import pytest
 from fastapi.testclient import TestClient
 from server import app
 
+import avatars
+import media_storage
+from blob_store import BlobStore
+from routers import media
+
 @pytest.fixture
 def client():
     with TestClient(app) as test_client:
         yield test_client
+
+
+class FakeBlobs:
+    """In-memory stand-in for the `blobs` metadata collection."""
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs.setdefault(query['sha256'], dict(update['$setOnInsert']))
+
+    async def find_one(self, query, projection=None):
+        return self.docs.get(query['sha256'])
+
+
+@pytest.fixture
+def local_blobs(tmp_path, monkeypatch):
+    """A blob store under tmp_path, used by media storage, avatars and the download endpoint."""
+    store = BlobStore(tmp_path / 'blobs', FakeBlobs())
+    monkeypatch.setattr(media_storage, 'blob_store', store)
+    monkeypatch.setattr(media, 'blob_store', store)
+    monkeypatch.setattr(avatars, 'blob_store', store)
+    return store
@@ -0,0 +1,118 @@
+import asyncio
+import base64
+import io
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+from PIL import Image
+
+import avatars
+from dependencies import get_current_user
+from routers import users
+
+
+def _photo(px=600, color=(200, 30, 30)) -> str:
+    out = io.BytesIO()
+    Image.new('RGB', (px, px // 2), color).save(out, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(out.getvalue()).decode()
+
+
+class FakeUsers:
+    def __init__(self, docs):
+        self.docs = {d['user_id']: d for d in docs}
+
+    async def find_one(self, query, projection=None):
+        doc = self.docs.get(query['user_id'])
+        if doc is None:
+            return None
+        return {k: v for k, v in doc.items() if projection is None or projection.get(k)}
+
+    async def update_one(self, query, update):
+        self.docs[query['user_id']].update(update['$set'])
+
+
+def test_thumbnail_is_square_jpeg(local_blobs):
+    avatar = asyncio.run(avatars.build_avatar(_photo()))
+    with Image.open(local_blobs.path(avatar['sha256'])) as img:
+        assert img.format == 'JPEG' and img.size == (avatars.AVATAR_SIZE, avatars.AVATAR_SIZE)
+    assert avatar['version'] == avatar['sha256'][:12]
+    # Same photo uploaded again maps to the same version
+    assert asyncio.run(avatars.build_avatar(_photo())) == avatar
+
+
+def test_only_decodable_raster_images_become_avatars(local_blobs):
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+    for photo in ('data:image/svg+xml;base64,' + base64.b64encode(svg).decode(),
+                  'data:text/html;base64,' + base64.b64encode(b'<script>alert(1)</script>').decode(),
+                  'data:image/png;base64,' + base64.b64encode(b'not a png').decode()):
+        assert asyncio.run(avatars.build_avatar(photo)) is None
+    assert not [p for p in local_blobs.root.rglob('*') if p.is_file()]
+
+
+def test_list_avatar_shapes():
+    external = asyncio.run(avatars.build_avatar('https://lh3.googleusercontent.com/a/photo'))
+    assert avatars.list_avatar({'user_id': 'u1', 'avatar': external})['profile_photo'] == external['url']
+    assert avatars.list_avatar({'user_id': 'u1', 'avatar': None})['avatar_url'] == ''
+    built = avatars.list_avatar({'user_id': 'u1', 'avatar': {'sha256': 'ab' * 32, 'version': 'abababababab'}},
+                                'https://api.example')
+    assert built['profile_photo'] == built['avatar_url'] == 'https://api.example/api/users/u1/avatar?v=abababababab'
+    assert 'avatar' not in built
+    legacy = avatars.list_avatar({'user_id': 'u1'})
+    assert legacy['avatar_version'] == avatars.UNBUILT_VERSION
+    assert avatars.avatar_owner(built['avatar_url']) == avatars.avatar_owner('/api/users/u1/avatar') == 'u1'
+    assert avatars.avatar_owner('https://cdn.example/api/users/u1/avatar.png') is None
+    # An external URL that is really our own avatar endpoint would redirect to itself
+    assert asyncio.run(avatars.build_avatar('https://api.example/api/users/u1/avatar?v=1')) is None
+
+
+def test_avatar_endpoint_builds_lazily_and_caches_by_etag(local_blobs, monkeypatch):
+    monkeypatch.setattr(users, 'blob_store', local_blobs)
+    fake_users = FakeUsers([{'user_id': 'u1', 'profile_photo': _photo()}, {'user_id': 'u2', 'profile_photo': ''},
+                            {'user_id': 'u3', 'profile_photo': 'https://evil.example/phish'}])
+    monkeypatch.setattr(users, 'db', SimpleNamespace(users=fake_users))
+    app = FastAPI()
+    app.include_router(users.router)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as http:
+            first = await http.get('/api/users/u1/avatar?v=0')
+            version = fake_users.docs['u1']['avatar']['version']
+            pinned = await http.get(f'/api/users/u1/avatar?v={version}')
+            revalidated = await http.get('/api/users/u1/avatar', headers={'If-None-Match': first.headers['etag']})
+            none = await http.get('/api/users/u2/avatar')
+            external = await http.get('/api/users/u3/avatar')
+        return first, pinned, revalidated, none, external
+
+    first, pinned, revalidated, none, external = asyncio.run(scenario())
+    assert first.status_code == 200 and first.headers['content-type'] == 'image/jpeg'
+    assert first.headers['cache-control'] == 'public, no-cache'
+    assert first.headers['x-content-type-options'] == 'nosniff'
+    assert first.headers['content-security-policy'].startswith("default-src 'none'")
+    assert 'immutable' in pinned.headers['cache-control']
+    assert revalidated.status_code == 304
+    assert none.status_code == 404
+    assert fake_users.docs['u2']['avatar'] is None
+    # No open redirect to a URL a user put in their profile
+    assert external.status_code == 404 and 'location' not in external.headers
+
+
+def test_profile_update_ignores_echoed_avatar_url_and_refuses_others(monkeypatch):
+    fake_users = FakeUsers([{'user_id': 'u1', 'profile_photo': 'data:image/png;base64,AAAA', 'avatar': None}])
+    monkeypatch.setattr(users, 'db', SimpleNamespace(users=fake_users))
+    app = FastAPI()
+    app.include_router(users.router)
+    app.dependency_overrides[get_current_user] = lambda: {'user_id': 'u1'}
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as http:
+            echoed = await http.put('/api/users/profile', json={
+                'profile_photo': 'https://api.example/api/users/u1/avatar?v=0'})
+            other = await http.put('/api/users/profile', json={
+                'profile_photo': 'https://api.example/api/users/u2/avatar?v=0'})
+        return echoed, other
+
+    echoed, other = asyncio.run(scenario())
+    assert echoed.status_code == 200
+    assert fake_users.docs['u1']['profile_photo'] == 'data:image/png;base64,AAAA'
+    assert other.status_code == 400
@@ -0,0 +1,193 @@
+import asyncio
+import base64
+import os
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+import media_storage
+
+from blob_store import RangeNotSatisfiable, blob_path, parse_range, with_blob_url
+from dependencies import get_current_user
+from encryption import decrypt_message, encrypt_message
+from routers import media
+from scripts.migrate_inline_blobs import migrate
+
+
+def _data_uri(data: bytes, mime='image/png') -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+def test_identical_content_is_stored_once(local_blobs):
+    photo = os.urandom(5000)
+
+    async def scenario():
+        first = await local_blobs.put_data_uri(_data_uri(photo))
+        forwarded = await local_blobs.put_data_uri(_data_uri(photo))
+        other = await local_blobs.put_bytes(b'other', 'text/plain')
+        return first, forwarded, other
+
+    first, forwarded, other = asyncio.run(scenario())
+    assert first == forwarded != other
+    assert local_blobs.stats['stored'] == 2 and local_blobs.stats['deduplicated'] == 1
+    assert local_blobs.path(first).read_bytes() == photo
+    assert len([p for p in local_blobs.root.rglob('*') if p.is_file()]) == 2
+    assert asyncio.run(local_blobs.put_data_uri('https://cdn.example/x.png')) is None
+
+
+def test_attachments_leave_only_a_hash_on_the_message(local_blobs, monkeypatch):
+    photo = os.urandom(3000)
+    sealed = base64.b64encode(os.urandom(24) + os.urandom(3016)).decode()  # nonce + NaCl box, as the client sends it
+    uploads = Uploads([{'user_id': 'alice', 'blob': 'ab' * 32}])
+    monkeypatch.setattr(media_storage, 'db', SimpleNamespace(uploads=uploads, messages=SentIn()))
+    monkeypatch.setattr(media_storage, 'conversation_cache', SentIn())
+
+    async def scenario():
+        return [await media_storage.store_attachment(c, 'alice') for c in (
+            _data_uri(photo), sealed, 'https://cdn.example/a.png', blob_path('ab' * 32),
+        )] + [await media_storage.store_attachment(blob_path('ab' * 32), 'mallory')]
+
+    (plain, plain_fields), (e2ee, e2ee_fields), external, uploaded, guessed = asyncio.run(scenario())
+    assert plain == e2ee == '' and uploaded == ('', {'blob': 'ab' * 32})
+    # Someone else's hash is not attached, so it grants nobody access
+    assert guessed == (blob_path('ab' * 32), {})
+    assert local_blobs.path(plain_fields['blob']).read_bytes() == photo
+    assert e2ee_fields['blob_e2ee'] is True
+    assert local_blobs.path(e2ee_fields['blob']).read_bytes() == base64.b64decode(sealed)
+    assert external == ('https://cdn.example/a.png', {})
+    # The URL is built per read, from the origin the reader used
+    msg = with_blob_url({'blob': plain_fields['blob']}, 'https://api.example')
+    assert msg['blob_url'] == f"https://api.example/api/blobs/{plain_fields['blob']}"
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=50-500', 100) == (50, 99)
+    assert parse_range('bytes=0-1,5-6', 100) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range('bytes=100-', 100)
+
+
+class SentIn:
+    """Messages referencing any blob live in `conv`, whose only participant is `alice`."""
+
+    async def distinct(self, key, query):
+        return ['conv']
+
+    async def is_participant(self, conversation_id, user_id):
+        return conversation_id == 'conv' and user_id == 'alice'
+
+
+class Uploads:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    async def find_one(self, query, projection=None):
+        return next((r for r in self.rows if all(r.get(k) == v for k, v in query.items())), None)
+
+
+def test_download_serves_ranges_and_conditional_requests(local_blobs, monkeypatch):
+    video = os.urandom(300_000)
+    monkeypatch.setattr(media_storage, 'db', SimpleNamespace(uploads=Uploads(), messages=SentIn()))
+    monkeypatch.setattr(media_storage, 'conversation_cache', SentIn())
+    app = FastAPI()
+    app.include_router(media.router)
+    app.dependency_overrides[get_current_user] = lambda: {'user_id': 'alice'}
+
+    async def scenario():
+        url = blob_path(await local_blobs.put_bytes(video, 'video/mp4'))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as http:
+            whole = await http.get(url)
+            part = await http.get(url, headers={'Range': 'bytes=1000-1999'})
+            tail = await http.get(url, headers={'Range': 'bytes=-5'})
+            past_end = await http.get(url, headers={'Range': f'bytes={len(video)}-'})
+            cached = await http.get(url, headers={'If-None-Match': whole.headers['etag']})
+            missing = await http.get('/api/blobs/' + '0' * 64)
+            app.dependency_overrides[get_current_user] = lambda: {'user_id': 'mallory'}
+            outsider = await http.get(url)
+        return whole, part, tail, past_end, cached, missing, outsider
+
+    whole, part, tail, past_end, cached, missing, outsider = asyncio.run(scenario())
+    assert whole.status_code == 200 and whole.content == video
+    assert whole.headers['accept-ranges'] == 'bytes' and whole.headers['content-type'] == 'video/mp4'
+    assert part.status_code == 206 and part.content == video[1000:2000]
+    assert part.headers['content-range'] == f'bytes 1000-1999/{len(video)}'
+    assert tail.content == video[-5:]
+    assert past_end.status_code == 416
+    assert cached.status_code == 304
+    assert missing.status_code == 404
+    assert outsider.status_code == 404
+
+
+class FakeMessages:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, criteria, projection=None):
+        docs = [dict(d) for d in self.docs
+                if ('blob' not in d or d['content']) and d['message_type'] not in ('text', 'location', 'poll')]
+
+        class Cursor:
+            def batch_size(self, n):
+                return self
+
+            async def __aiter__(self):
+                for doc in docs:
+                    yield doc
+
+        return Cursor()
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            doc = next(d for d in self.docs if d['message_id'] == op._filter['message_id'])
+            doc.update(op._doc['$set'])
+        return SimpleNamespace(modified_count=len(ops))
+
+
+class FakeConversations:
+    def __init__(self):
+        self.ops = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.ops += ops
+
+
+def test_migration_moves_inline_blobs_and_shares_duplicates(local_blobs):
+    photo = _data_uri(os.urandom(2000))
+    sealed = base64.b64encode(os.urandom(2040)).decode()
+    messages = FakeMessages([
+        {'message_id': 'm1', 'message_type': 'image', 'content': encrypt_message(photo)},
+        {'message_id': 'm2', 'message_type': 'image', 'content': encrypt_message(photo)},
+        {'message_id': 'm3', 'message_type': 'text', 'content': encrypt_message('hi')},
+        {'message_id': 'm4', 'message_type': 'image', 'content': encrypt_message('https://cdn.example/a.png')},
+        {'message_id': 'm5', 'message_type': 'image', 'content': encrypt_message(sealed)},
+        # Moved by an earlier version, which kept the URL in the content
+        {'message_id': 'm6', 'message_type': 'image', 'blob': 'cd' * 32,
+         'content': encrypt_message('http://old-host/api/blobs/' + 'cd' * 32)},
+        # Vanish mode: moved, but its conversation preview is left alone
+        {'message_id': 'm7', 'message_type': 'image', 'content': encrypt_message(photo), 'expires_in': 30},
+        # A blob URL that was refused when sent is not attached by the migration either
+        {'message_id': 'm8', 'message_type': 'image', 'content': encrypt_message(blob_path('ef' * 32))},
+    ])
+    conversations = FakeConversations()
+
+    result = asyncio.run(migrate(messages, conversations, local_blobs))
+
+    assert result['moved'] == 5 and result['blobs_stored'] == 2 and result['deduplicated'] == 2
+    m1, m2, _, m4, m5, m6, m7, m8 = messages.docs
+    assert m1['content'] == m2['content'] == '' and m1['blob'] == m2['blob']
+    assert decrypt_message(m4['content']) == 'https://cdn.example/a.png'
+    assert m5['content'] == '' and m5['blob_e2ee'] is True
+    assert local_blobs.path(m5['blob']).read_bytes() == base64.b64decode(sealed)
+    assert m6['content'] == '' and m6['blob'] == 'cd' * 32
+    assert m7['content'] == '' and m7['blob'] == m1['blob']
+    assert 'blob' not in m8 and decrypt_message(m8['content']) == blob_path('ef' * 32)
+    assert len(conversations.ops) == 4
+    assert 'm7' not in [op._filter['last_message.message_id'] for op in conversations.ops]
+    # Re-running finds nothing left to move
+    assert asyncio.run(migrate(messages, conversations, local_blobs))['moved'] == 0
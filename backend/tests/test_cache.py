@@ -0,0 +1,53 @@
+import asyncio
+
+from cache import TTLCache
+from conversation_cache import ConversationCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1          # 'a' is now most recently used
+    cache.set('c', 3)                   # evicts 'b'
+    assert cache.get('b') is None
+    clock.now = 11
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 2, 1)
+
+
+class CountingCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.find_one_calls = 0
+
+    async def find_one(self, query, projection=None):
+        self.find_one_calls += 1
+        return self.docs.get(query['conversation_id'])
+
+
+def test_conversation_cache_serves_repeat_lookups_from_memory():
+    collection = CountingCollection({'conv_1': {'conversation_id': 'conv_1', 'participants': ['u1', 'u2']}})
+    cache = ConversationCache(collection, maxsize=10, ttl=60)
+
+    async def scenario():
+        for _ in range(5):
+            assert await cache.is_participant('conv_1', 'u1')
+        assert await cache.get('conv_missing') is None
+        cache.invalidate_user('u2')
+        assert not await cache.is_participant('conv_1', 'u3')
+
+    asyncio.run(scenario())
+    # 1 initial load + 1 missing id + 1 reload after invalidation
+    assert collection.find_one_calls == 3
+    assert cache.stats()['hits'] == 4
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+import dependencies
+from utils import create_access_token
+
+
+class CountingUsers:
+    def __init__(self, users):
+        self.users = users
+        self.calls = 0
+
+    async def find_one(self, query, projection=None):
+        self.calls += 1
+        user = self.users.get(query['user_id'])
+        return dict(user) if user else None
+
+
+@pytest.fixture
+def users(monkeypatch):
+    fake = CountingUsers({'user_1': {'user_id': 'user_1', 'username': 'alice'}})
+    monkeypatch.setattr(dependencies.db, 'users', fake, raising=False)
+    dependencies.principal_cache.clear()
+    dependencies.token_cache.clear()
+    yield fake
+    dependencies.principal_cache.clear()
+    dependencies.token_cache.clear()
+
+
+def _creds(user_id):
+    return HTTPAuthorizationCredentials(scheme='Bearer', credentials=create_access_token({'sub': user_id}))
+
+
+def test_principal_is_cached_until_invalidated(users):
+    creds = _creds('user_1')
+
+    async def scenario():
+        for _ in range(3):
+            user = await dependencies.get_current_user(creds)
+            assert user['blocked_users'] == []
+        dependencies.invalidate_principal('user_1')
+        await dependencies.get_current_user(creds)
+
+    asyncio.run(scenario())
+    assert users.calls == 2
+    assert dependencies.token_cache.stats()['hits'] == 3
+
+
+def test_returned_user_is_a_copy(users):
+    creds = _creds('user_1')
+
+    async def scenario():
+        (await dependencies.get_current_user(creds))['username'] = 'mallory'
+        return await dependencies.get_current_user(creds)
+
+    assert asyncio.run(scenario())['username'] == 'alice'
+
+
+def test_nested_fields_are_not_shared_with_the_cache(users):
+    creds = _creds('user_1')
+
+    async def scenario():
+        (await dependencies.get_current_user(creds))['blocked_users'].append('user_2')
+        return await dependencies.get_current_user(creds)
+
+    assert asyncio.run(scenario())['blocked_users'] == []
+
+
+def test_deleted_user_is_rejected_after_invalidation(users):
+    creds = _creds('user_1')
+
+    async def scenario():
+        await dependencies.get_current_user(creds)
+        del users.users['user_1']
+        dependencies.invalidate_principal('user_1')
+        with pytest.raises(HTTPException) as exc:
+            await dependencies.get_current_user(creds)
+        assert exc.value.status_code == 401
+
+    asyncio.run(scenario())
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from routers import auth
+from routers.auth import _login_query
+from utils import normalize_email
+
+MONGO_URL = os.getenv('MONGO_URL', 'mongodb://localhost:27017')
+
+
+def _mongo():
+    try:
+        mongo = MongoClient(MONGO_URL, serverSelectionTimeoutMS=500)
+        mongo.admin.command('ping')
+        return mongo
+    except PyMongoError:
+        return None
+
+
+def _stages(plan):
+    """Every stage name in a winning plan tree."""
+    names = [plan.get('stage')]
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            names += _stages(plan[key])
+    for child in plan.get('inputStages', []):
+        names += _stages(child)
+    return names
+
+
+def test_normalize_email():
+    assert normalize_email('  Alice@Example.COM ') == 'alice@example.com'
+
+
+def test_login_query_is_exact_match():
+    query = _login_query('Alice@Example.com')
+    assert query == {'$or': [{'email_normalized': 'alice@example.com'}, {'username': 'Alice@Example.com'}]}
+    # Regex metacharacters are just characters in an equality match
+    assert _login_query('.*')['$or'][0] == {'email_normalized': '.*'}
+
+
+def test_login_query_uses_indexes():
+    mongo = _mongo()
+    if mongo is None:
+        pytest.skip('MongoDB is not reachable')
+    db = mongo[f"quickchat_test_{uuid.uuid4().hex[:8]}"]
+    try:
+        db.users.create_index(
+            'email_normalized', unique=True,
+            partialFilterExpression={'email_normalized': {'$type': 'string'}}
+        )
+        db.users.create_index('username')
+        db.users.insert_many([
+            {'user_id': f"user_{i}", 'username': f"name{i}", 'email': f"User{i}@Example.com",
+             'email_normalized': f"user{i}@example.com"}
+            for i in range(200)
+        ])
+        explain = db.users.find(_login_query('USER7@example.com')).explain()
+        stages = _stages(explain['queryPlanner']['winningPlan'])
+        assert 'IXSCAN' in stages
+        assert 'COLLSCAN' not in stages
+    finally:
+        mongo.drop_database(db.name)
+        mongo.close()
+
+
+class _Users:
+    """Just enough of db.users to match equality, $in, $exists and $or queries."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _matches(self, doc, query):
+        for key, cond in query.items():
+            if key == '$or':
+                if not any(self._matches(doc, sub) for sub in cond):
+                    return False
+            elif isinstance(cond, dict) and '$in' in cond:
+                if doc.get(key) not in cond['$in']:
+                    return False
+            elif isinstance(cond, dict) and '$exists' in cond:
+                if (key in doc) != cond['$exists']:
+                    return False
+            elif doc.get(key) != cond:
+                return False
+        return True
+
+    async def find_one(self, query):
+        return next((dict(d) for d in self.docs if self._matches(d, query)), None)
+
+    async def update_one(self, query, update):
+        for doc in self.docs:
+            if self._matches(doc, query):
+                doc.update(update['$set'])
+                return
+
+
+def test_unmigrated_account_found_by_email_and_backfilled(monkeypatch):
+    legacy = {'user_id': 'u1', 'email': 'alice@example.com', 'username': 'alice'}
+    monkeypatch.setattr(auth, 'db', SimpleNamespace(users=_Users([legacy])))
+
+    async def scenario():
+        user = await auth._find_user(_login_query('Alice@Example.com'), 'Alice@Example.com')
+        assert user['user_id'] == 'u1'
+        assert legacy['email_normalized'] == 'alice@example.com'
+        # Backfilled, so the indexed query finds it without the fallback now
+        assert await auth.db.users.find_one(_login_query('alice@example.com')) is not None
+        # Usernames never take the email fallback
+        assert await auth._find_user(_login_query('nobody'), 'nobody') is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,140 @@
+import asyncio
+import smtplib
+
+from email_outbox import EmailOutbox
+
+
+class FakeOutboxCollection:
+    """The handful of collection operations the outbox uses, over a dict."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        self.docs[doc['outbox_id']] = dict(doc)
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=None):
+        due = [d for d in self.docs.values()
+               if d['status'] == query['status'] and d['next_attempt_at'] <= query['next_attempt_at']['$lte']]
+        if not due:
+            return None
+        doc = min(due, key=lambda d: d['next_attempt_at'])
+        doc.update(update['$set'])
+        for field, inc in update['$inc'].items():
+            doc[field] += inc
+        return dict(doc)
+
+    async def update_one(self, query, update):
+        self.docs[query['outbox_id']].update(update['$set'])
+
+    async def delete_many(self, query):
+        for outbox_id in query['outbox_id']['$in']:
+            self.docs.pop(outbox_id, None)
+
+    async def count_documents(self, query):
+        return sum(1 for d in self.docs.values() if d['status'] == query['status'])
+
+
+class FakeSMTP:
+    """Local stand-in for an SMTP server connection."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def sendmail(self, sender, recipients, raw):
+        if self.server.drop_next:
+            self.server.drop_next -= 1
+            raise smtplib.SMTPServerDisconnected('connection lost')
+        if recipients[0] in self.server.reject:
+            raise smtplib.SMTPRecipientsRefused({recipients[0]: (550, b'no such user')})
+        self.server.delivered.append((recipients[0], raw))
+
+    def quit(self):
+        self.server.quits += 1
+
+
+class FakeServer:
+    def __init__(self):
+        self.delivered = []
+        self.reject = set()
+        self.drop_next = 0
+        self.connects = 0
+        self.quits = 0
+
+    def connect(self):
+        self.connects += 1
+        return FakeSMTP(self)
+
+
+def test_batch_is_sent_over_one_connection():
+    server = FakeServer()
+    outbox = EmailOutbox(FakeOutboxCollection(), connect=server.connect, batch_max=10)
+
+    async def scenario():
+        for i in range(5):
+            await outbox.enqueue(f"user{i}@example.com", 'Hi', '<p>hello</p>')
+        assert (await outbox.stats())['queue_depth'] == 5
+        assert await outbox.process_due() == 5
+        await outbox.enqueue('late@example.com', 'Hi', '<p>hello</p>')
+        assert await outbox.process_due() == 1
+        return await outbox.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(server.delivered) == 6
+    assert server.connects == 1
+    assert stats['sent'] == 6 and stats['queue_depth'] == 0 and stats['connected']
+
+
+def test_dropped_connection_is_reopened():
+    server = FakeServer()
+    server.drop_next = 1
+    outbox = EmailOutbox(FakeOutboxCollection(), connect=server.connect)
+
+    async def scenario():
+        await outbox.enqueue('a@example.com', 'Hi', 'x')
+        await outbox.process_due()
+
+    asyncio.run(scenario())
+    assert [to for to, _ in server.delivered] == ['a@example.com']
+    assert server.connects == 2
+
+
+def test_failures_are_retried_then_parked():
+    server = FakeServer()
+    server.reject.add('bad@example.com')
+    collection = FakeOutboxCollection()
+    outbox = EmailOutbox(collection, connect=server.connect, max_attempts=2, retry_base=0)
+
+    async def scenario():
+        await outbox.enqueue('bad@example.com', 'Hi', 'x')
+        await outbox.enqueue('good@example.com', 'Hi', 'x')
+        await outbox.process_due()
+        # Retry becomes due immediately with retry_base=0
+        await outbox.process_due()
+        assert await outbox.process_due() == 0
+
+    asyncio.run(scenario())
+    [parked] = collection.docs.values()
+    assert parked['to'] == 'bad@example.com'
+    assert parked['status'] == 'failed' and parked['attempts'] == 2
+    assert outbox.counters['retried'] == 1 and outbox.counters['failed'] == 1
+
+
+def test_unreachable_server_fails_batch_fast():
+    collection = FakeOutboxCollection()
+    calls = []
+
+    def connect():
+        calls.append(1)
+        raise ConnectionRefusedError('refused')
+
+    outbox = EmailOutbox(collection, connect=connect, retry_base=60)
+
+    async def scenario():
+        for i in range(3):
+            await outbox.enqueue(f"u{i}@example.com", 'Hi', 'x')
+        await outbox.process_due()
+
+    asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(d['status'] == 'pending' and d['attempts'] == 1 for d in collection.docs.values())
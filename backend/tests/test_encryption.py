@@ -0,0 +1,26 @@
+import asyncio
+
+from encryption import DecryptedCache, encrypt_message, decrypt_many
+import encryption
+
+
+def test_decrypt_many_matches_serial_and_populates_cache(monkeypatch):
+    monkeypatch.setattr(encryption, 'decrypted_cache', DecryptedCache())
+    plaintexts = [f"message {i}" for i in range(300)]
+    page = [encrypt_message(p) for p in plaintexts] + ['']
+
+    assert asyncio.run(decrypt_many(page)) == plaintexts + ['']
+    assert asyncio.run(decrypt_many(page)) == plaintexts + ['']
+    assert encryption.decrypted_cache.stats()['hits'] == 300
+
+
+def test_decrypted_cache_is_bounded_by_size():
+    cache = DecryptedCache(max_bytes=1600)
+    for i in range(50):
+        cache.put(f"ct{i:02d}" + 'x' * 40, 'p' * 50)
+    assert cache.size <= 1600
+    assert cache.get('ct00' + 'x' * 40) is None
+    assert cache.get('ct49' + 'x' * 40) == 'p' * 50
+    # Entries larger than 1/16 of the budget are not cached at all
+    cache.put('big', 'y' * 200)
+    assert cache.get('big') is None
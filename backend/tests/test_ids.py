@@ -0,0 +1,23 @@
+from ids import IdGenerator, new_id
+
+
+def test_ids_are_unique_and_ordered_within_one_millisecond():
+    gen = IdGenerator(node='0000abcd', clock=lambda: 1_792_345_678.901)
+    ids = [gen.new_id('msg') for _ in range(1000)]
+    assert len(set(ids)) == 1000
+    assert ids == sorted(ids)
+    assert ids[0] == 'msg_17923456789010000abcd000000'
+
+
+def test_ids_stay_monotonic_when_the_clock_goes_backwards():
+    now = [1_800_000_000.0]
+    gen = IdGenerator(node='00000001', clock=lambda: now[0])
+    first = gen.new_id('msg')
+    now[0] -= 5
+    assert gen.new_id('msg') > first
+
+
+def test_new_ids_sort_after_legacy_ids():
+    legacy = 'msg_1718000000_123456'
+    assert new_id('msg') > legacy
+    assert len(new_id('msg')) == len('msg_') + 13 + 8 + 6
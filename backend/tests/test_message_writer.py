@@ -0,0 +1,111 @@
+import asyncio
+
+from pymongo.errors import BulkWriteError
+
+from message_writer import MessageWriter, last_message_summary
+
+
+class RecordingCollection:
+    def __init__(self, fail_indexes=()):
+        self.calls = []
+        self.fail_indexes = set(fail_indexes)
+
+    async def insert_many(self, docs, ordered=True):
+        self.calls.append(('insert_many', list(docs)))
+        if self.fail_indexes:
+            raise BulkWriteError({'writeErrors': [{'index': i, 'errmsg': 'duplicate key'} for i in self.fail_indexes]})
+
+    async def bulk_write(self, ops, ordered=True):
+        self.calls.append(('bulk_write', list(ops)))
+
+
+def _doc(i, conv):
+    return {'message_id': f'msg_{i}', 'conversation_id': conv, 'content': 'hi', 'timestamp': f'2026-01-01T00:00:{i:02d}+00:00'}
+
+
+def test_concurrent_sends_coalesce_into_one_batch():
+    messages, conversations = RecordingCollection(), RecordingCollection()
+
+    async def scenario():
+        writer = MessageWriter(messages, conversations, flush_ms=20)
+        docs = [_doc(i, f'conv_{i % 2}') for i in range(10)]
+        await asyncio.gather(*(writer.persist(d) for d in docs))
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert [c[0] for c in messages.calls] == ['insert_many']
+    assert len(messages.calls[0][1]) == 10
+    (name, ops), = conversations.calls
+    assert name == 'bulk_write' and len(ops) == 2
+    bumps = {op._filter['conversation_id']: op._doc['$max']['updated_at'] for op in ops}
+    assert bumps == {'conv_0': '2026-01-01T00:00:08+00:00', 'conv_1': '2026-01-01T00:00:09+00:00'}
+    previews = {op._filter['conversation_id']: op._doc['$set']['last_message']['message_id'] for op in ops}
+    assert previews == {'conv_0': 'msg_8', 'conv_1': 'msg_9'}
+    assert writer.stats['batches'] == 1 and writer.stats['messages'] == 10
+
+
+def test_failed_documents_reject_only_their_sender():
+    messages, conversations = RecordingCollection(fail_indexes=[1]), RecordingCollection()
+
+    async def scenario():
+        writer = MessageWriter(messages, conversations, flush_ms=5)
+        return await asyncio.gather(*(writer.persist(_doc(i, 'conv')) for i in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[1], Exception)
+    assert results[0]['message_id'] == 'msg_0' and results[2]['message_id'] == 'msg_2'
+
+
+class RecordingCounters:
+    def __init__(self):
+        self.increments = []
+
+    async def increment(self, counts):
+        self.increments.append(dict(counts))
+
+
+def test_recipient_counters_are_incremented_once_per_batch():
+    messages, conversations, counters = RecordingCollection(fail_indexes=[2]), RecordingCollection(), RecordingCounters()
+
+    async def scenario():
+        writer = MessageWriter(messages, conversations, flush_ms=10, read_state=counters)
+        sends = [writer.persist(_doc(i, 'conv_a'), recipients=['bob']) for i in range(3)]
+        sends.append(writer.persist(_doc(3, 'conv_g'), recipients=['bob', 'carol']))
+        await asyncio.gather(*sends, return_exceptions=True)
+
+    asyncio.run(scenario())
+    # msg_2 failed to insert, so it does not count
+    assert counters.increments == [{('bob', 'conv_a'): 2, ('bob', 'conv_g'): 1, ('carol', 'conv_g'): 1}]
+
+
+def test_max_batch_flushes_early():
+    messages, conversations = RecordingCollection(), RecordingCollection()
+
+    async def scenario():
+        writer = MessageWriter(messages, conversations, flush_ms=10_000, max_batch=4)
+        await asyncio.wait_for(asyncio.gather(*(writer.persist(_doc(i, 'conv')) for i in range(4))), timeout=1)
+
+    asyncio.run(scenario())
+    assert len(messages.calls) == 1
+
+
+def test_last_message_summary_drops_large_and_vanishing_content():
+    doc = _doc(1, 'conv')
+    assert last_message_summary(doc)['content'] == 'hi'
+    assert last_message_summary({**doc, 'content': 'x' * 100_000})['content'] == ''
+    assert last_message_summary({**doc, 'expires_in': 30})['content'] == ''
+
+
+def test_unexpected_flush_error_rejects_every_sender():
+    messages, conversations = RecordingCollection(), RecordingCollection()
+
+    async def scenario():
+        writer = MessageWriter(messages, conversations, flush_ms=5)
+        broken = {'message_id': 'msg_x', 'content': 'no conversation_id'}
+        return await asyncio.wait_for(
+            asyncio.gather(writer.persist(_doc(0, 'conv')), writer.persist(broken), return_exceptions=True),
+            timeout=1
+        )
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, KeyError) for r in results)
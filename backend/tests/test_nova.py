@@ -0,0 +1,234 @@
+import asyncio
+import json
+import socket
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from limits import parse as parse_limit
+
+import socket_events
+from dependencies import get_current_user
+from nova import NovaClient, NovaRateLimit, build_payload
+from presence import PresenceRegistry
+from routers import ai
+
+TOKENS = ['Hel', 'lo', ' there', '!']
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fake_completion_app(state, delay=0.0, tokens=TOKENS):
+    """Local stand-in for an OpenAI-style chat completions endpoint."""
+    app = FastAPI()
+
+    @app.post('/v1/chat/completions')
+    async def completions(request: Request):
+        body = await request.json()
+        state['peers'].append(request.client.port)
+        state['payloads'].append(body)
+        if not body.get('stream'):
+            return {'choices': [{'message': {'content': ''.join(tokens)}}]}
+
+        async def chunks():
+            sent = 0
+            try:
+                for token in tokens:
+                    yield f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n\n"
+                    sent += 1
+                    await asyncio.sleep(delay)
+                yield "data: [DONE]\n\n"
+            finally:
+                if sent < len(tokens):
+                    state['cancelled'] = True
+
+        return StreamingResponse(chunks(), media_type='text/event-stream')
+
+    return app
+
+
+@asynccontextmanager
+async def fake_server(delay=0.0, tokens=TOKENS):
+    state = {'peers': [], 'payloads': [], 'cancelled': False}
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_completion_app(state, delay, tokens), host='127.0.0.1',
+                                           port=port, log_level='warning'))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}/v1/chat/completions", state
+    finally:
+        server.should_exit = True
+        await task
+
+
+def test_build_payload_alternates_and_injects_name():
+    payload = build_payload([
+        {'role': 'assistant', 'content': 'hi'},
+        {'role': 'user', 'content': 'q1'},
+        {'role': 'user', 'content': 'dup'},
+        {'role': 'assistant', 'content': 'a1'},
+    ], 'm', 'Ada')
+    assert [m['role'] for m in payload['messages']] == ['user', 'assistant']
+    assert 'Ada' in payload['messages'][0]['content']
+
+
+def test_complete_reuses_pooled_connection():
+    async def scenario():
+        async with fake_server() as (url, state):
+            client = NovaClient(url=url, api_key='Bearer test')
+            first = await client.complete({'messages': []})
+            second = await client.complete({'messages': []})
+            await client.close()
+            return first, second, state
+
+    first, second, state = asyncio.run(scenario())
+    assert first == second == 'Hello there!'
+    assert len(set(state['peers'])) == 1
+
+
+def test_stream_yields_tokens_in_order():
+    async def scenario():
+        async with fake_server() as (url, state):
+            client = NovaClient(url=url, api_key='Bearer test')
+            tokens = [t async for t in client.stream({'messages': []})]
+            await client.close()
+            return tokens, state
+
+    tokens, state = asyncio.run(scenario())
+    assert tokens == TOKENS
+    assert state['payloads'][0]['stream'] is True
+
+
+def test_closing_stream_cancels_upstream():
+    async def scenario():
+        async with fake_server(delay=0.05, tokens=['t'] * 50) as (url, state):
+            client = NovaClient(url=url, api_key='Bearer test')
+            stream = client.stream({'messages': []})
+            assert await stream.__anext__() == 't'
+            await stream.aclose()
+            for _ in range(100):
+                if state['cancelled']:
+                    break
+                await asyncio.sleep(0.02)
+            await client.close()
+            return state
+
+    assert asyncio.run(scenario())['cancelled']
+
+
+def test_sse_endpoint_forwards_tokens(monkeypatch):
+    app = FastAPI()
+    app.include_router(ai.router)
+    app.dependency_overrides[get_current_user] = lambda: {'user_id': 'u1', 'real_name': 'Ada'}
+
+    async def scenario():
+        async with fake_server() as (url, _):
+            client = NovaClient(url=url, api_key='Bearer test')
+            monkeypatch.setattr(ai, 'nova_client', client)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+                res = await http.post('/api/ai/chat/stream', json={'messages': [{'role': 'user', 'content': 'hi'}]})
+            await client.close()
+            return res
+
+    res = asyncio.run(scenario())
+    assert res.headers['content-type'].startswith('text/event-stream')
+    events = [block.split('\n') for block in res.text.strip().split('\n\n')]
+    assert [e[0] for e in events] == ['event: token'] * len(TOKENS) + ['event: done']
+    assert [json.loads(e[1][6:])['delta'] for e in events[:-1]] == TOKENS
+
+
+class EndlessNova:
+    configured = True
+
+    async def stream(self, payload):
+        while True:
+            await asyncio.sleep(0.01)
+            yield 't'
+
+
+class NoUsers:
+    async def find_one(self, query, projection=None):
+        return None
+
+
+def test_socket_streams_are_capped_limited_and_cancelled_on_disconnect(monkeypatch):
+    errors = []
+
+    async def emit(event, data, to=None, room=None, **kwargs):
+        if event == 'nova_error':
+            errors.append(data['request_id'])
+
+    registry = PresenceRegistry()
+    monkeypatch.setattr(socket_events, 'presence', registry)
+    monkeypatch.setattr(socket_events, 'presence_broadcaster', SimpleNamespace(changed=lambda *args: None))
+    monkeypatch.setattr(socket_events, 'nova_client', EndlessNova())
+    monkeypatch.setattr(socket_events, 'db', SimpleNamespace(users=NoUsers()))
+    monkeypatch.setattr(socket_events.sio, 'emit', emit)
+    monkeypatch.setattr(socket_events, 'NOVA_MAX_STREAMS_PER_SOCKET', 2)
+    # In-process counts only: the test must not touch whatever Redis is configured
+    monkeypatch.setattr(socket_events, 'nova_rate_limit', NovaRateLimit(None, parse_limit('3/minute')))
+    user_id = 'u1'
+    ask = {'messages': [{'role': 'user', 'content': 'hi'}]}
+
+    async def scenario():
+        await registry.connect(user_id, 'sid1')
+        for request_id in ('r1', 'r2', 'r3'):
+            await socket_events.nova_stream('sid1', {**ask, 'request_id': request_id})
+        capped = list(errors)
+        await socket_events.nova_cancel('sid1', {'request_id': 'r1'})
+        await asyncio.sleep(0.02)
+        await socket_events.nova_stream('sid1', {**ask, 'request_id': 'r4'})  # 3rd request this minute
+        await socket_events.nova_stream('sid1', {**ask, 'request_id': 'r5'})  # over the rate limit
+        running = list(socket_events.nova_streams['sid1'].values())
+        await socket_events.disconnect('sid1')
+        await asyncio.sleep(0.02)
+        return capped, running
+
+    capped, running = asyncio.run(scenario())
+    assert capped == ['r3']
+    assert errors == ['r3', 'r5']
+    assert len(running) == 2 and all(task.done() for task in running)
+    assert 'sid1' not in socket_events.nova_streams
+
+
+class FakeRedisPool:
+    """redis_pool.call() over a dict; returns the default while `down`."""
+
+    def __init__(self):
+        self.values, self.expiry, self.down = {}, {}, False
+
+    async def call(self, command, *args, default=None):
+        if self.down:
+            return default
+        if command == 'incr':
+            self.values[args[0]] = self.values.get(args[0], 0) + 1
+            return self.values[args[0]]
+        self.expiry[args[0]] = args[1]
+
+
+def test_rate_limit_counts_in_redis_and_falls_back_to_memory():
+    pool, now = FakeRedisPool(), [120.0]
+    limit = NovaRateLimit(pool, parse_limit('2/minute'), clock=lambda: now[0])
+
+    async def scenario():
+        shared = [await limit.allow('u1') for _ in range(3)]
+        pool.down = True
+        local = [await limit.allow('u1') for _ in range(3)]
+        now[0] += 60
+        next_window = await limit.allow('u1')
+        return shared, local, next_window
+
+    shared, local, next_window = asyncio.run(scenario())
+    assert shared == [True, True, False]
+    assert pool.values == {'nova:rate:u1:2': 3} and pool.expiry == {'nova:rate:u1:2': 60}
+    assert local == [True, True, False] and next_window is True
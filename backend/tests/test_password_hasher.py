@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from password_hasher import PasswordHasher, PasswordHasherBusy
+from utils import hash_password, password_rounds
+
+
+def test_hash_and_verify_off_loop():
+    hasher = PasswordHasher(workers=2, queue_max=4, rounds=4)
+
+    async def scenario():
+        hashed = await hasher.hash('secret')
+        assert password_rounds(hashed) == 4
+        assert await hasher.verify('secret', hashed)
+        assert not await hasher.verify('wrong', hashed)
+        # Password-less (Google) accounts never match and never reach bcrypt
+        assert not await hasher.verify('secret', '')
+
+    asyncio.run(scenario())
+    stats = hasher.stats()
+    assert stats['hashed'] == 1 and stats['verified'] == 2
+    assert stats['in_flight'] == 0 and stats['latency_ms_p99'] is not None
+
+
+def test_rehash_only_when_cost_changed():
+    hasher = PasswordHasher(workers=1, queue_max=1, rounds=5)
+    old = hash_password('secret', 4)
+
+    async def scenario():
+        new = await hasher.rehash_if_needed('secret', old)
+        assert password_rounds(new) == 5
+        assert await hasher.rehash_if_needed('secret', new) is None
+
+    asyncio.run(scenario())
+    assert hasher.counters['rehashed'] == 1
+
+
+def test_rejects_when_queue_is_full():
+    hasher = PasswordHasher(workers=1, queue_max=1, rounds=4)
+    hashed = hash_password('secret', 4)
+
+    async def scenario():
+        calls = [hasher.verify('secret', hashed) for _ in range(3)]
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert results[:2] == [True, True]
+    assert isinstance(results[2], PasswordHasherBusy)
+    assert hasher.counters['rejected'] == 1
+
+
+def test_password_rounds_of_garbage_is_zero():
+    assert password_rounds('') == 0
+    assert password_rounds('not-a-hash') == 0
+
+
+@pytest.mark.parametrize('rounds', [4, 6])
+def test_hash_password_honours_rounds(rounds):
+    assert password_rounds(hash_password('x', rounds)) == rounds
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from presence import PresenceRegistry
+from redis_pool import RedisPool
+from socket_instance import _redis_reachable
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+requires_redis = pytest.mark.skipif(not _redis_reachable(REDIS_URL), reason='Redis is not reachable')
+
+
+def test_second_device_does_not_overwrite_first():
+    async def scenario():
+        registry = PresenceRegistry()
+        assert await registry.connect('user_a', 'sid_phone') is True
+        assert await registry.connect('user_a', 'sid_laptop') is False
+        assert await registry.sids('user_a') == {'sid_phone', 'sid_laptop'}
+
+        assert await registry.disconnect('sid_phone') == ('user_a', False)
+        assert await registry.is_online('user_a')
+        assert await registry.disconnect('sid_laptop') == ('user_a', True)
+        assert not await registry.is_online('user_a')
+        assert await registry.disconnect('sid_unknown') == (None, False)
+
+    asyncio.run(scenario())
+
+
+def test_foreign_sessions_expire_without_heartbeat():
+    async def scenario():
+        registry = PresenceRegistry(ttl=0)
+        await registry.connect('user_b', 'sid_1')
+        # Simulate a session owned by a node that died: not local, so nobody refreshes it.
+        registry.local_sids.clear()
+        registry._local_users.clear()
+        await asyncio.sleep(0.01)
+        assert not await registry.is_online('user_b')
+
+    asyncio.run(scenario())
+
+
+def test_redis_outage_falls_back_to_local_sockets():
+    async def scenario():
+        pool = RedisPool('redis://127.0.0.1:1/0', socket_timeout=0.2)
+        registry = PresenceRegistry(pool=pool)
+        assert await registry.connect('user_c', 'sid_1') is True
+        assert registry.user_id('sid_1') == 'user_c'
+        assert await registry.is_online('user_c')
+        assert await registry.online_users(['user_c', 'user_d']) == {'user_c'}
+        assert await registry.sids('user_c') == {'sid_1'}
+        assert await registry.disconnect('sid_1') == ('user_c', True)
+        await registry.heartbeat()
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_connect_leaves_no_socket_behind():
+    class BrokenPool:
+        async def pipeline(self, commands, transaction=True, default=None):
+            raise RuntimeError('boom')
+
+    async def scenario():
+        registry = PresenceRegistry(pool=BrokenPool())
+        with pytest.raises(RuntimeError):
+            await registry.connect('user_e', 'sid_1')
+        assert registry.local_sids == {} and registry._sessions == {}
+
+    asyncio.run(scenario())
+
+
+@requires_redis
+def test_redis_backend_is_shared_between_nodes():
+    async def scenario():
+        user_id = f"user_{uuid.uuid4().hex}"
+        node_a = PresenceRegistry(pool=RedisPool(REDIS_URL), node_id='node-a')
+        node_b = PresenceRegistry(pool=RedisPool(REDIS_URL), node_id='node-b')
+        try:
+            assert await node_a.connect(user_id, 'sid_a') is True
+            assert await node_b.connect(user_id, 'sid_b') is False
+            assert await node_b.online_users([user_id, 'user_nobody']) == {user_id}
+            assert await node_a.sids(user_id) == {'sid_a', 'sid_b'}
+
+            assert await node_a.disconnect('sid_a') == (user_id, False)
+            assert await node_a.is_online(user_id)
+            assert await node_b.disconnect('sid_b') == (user_id, True)
+            assert not await node_a.is_online(user_id)
+        finally:
+            await node_a.stop()
+            await node_b.stop()
+            await node_a.pool.close()
+            await node_b.pool.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+
+import socket_events
+from dependencies import get_current_user
+from presence import PresenceRegistry
+from presence_broadcast import PresenceBroadcaster
+from routers import users
+from utils import create_access_token
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, n):
+        return self.docs
+
+
+class FakeConversations:
+    def __init__(self, participants):
+        self.convs = [{'participants': p} for p in participants]
+        self.finds = 0
+
+    def find(self, criteria, projection=None):
+        self.finds += 1
+        wanted = set(criteria['participants']['$in'])
+        return FakeCursor([c for c in self.convs if wanted & set(c['participants'])])
+
+
+class RecordingUsers:
+    def __init__(self):
+        self.writes = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes.append(list(ops))
+
+
+class RecordingEmit:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, event, data, room=None):
+        self.calls.append((event, data, room))
+
+
+def test_changes_reach_only_online_contacts_in_one_diff_each():
+    conversations = FakeConversations([['alice', 'bob'], ['alice', 'carol'], ['bob', 'carol'], ['dave', 'erin']])
+    users, emit, registry = RecordingUsers(), RecordingEmit(), PresenceRegistry()
+
+    async def scenario():
+        await registry.connect('carol', 'sid_carol')
+        await registry.connect('erin', 'sid_erin')
+        broadcaster = PresenceBroadcaster(conversations, users, registry, emit, batch_ms=10)
+        broadcaster.changed('alice', True)
+        broadcaster.changed('bob', False)
+        await asyncio.sleep(0.03)
+        return broadcaster
+
+    broadcaster = asyncio.run(scenario())
+    # bob is offline and erin is nobody's contact here: only carol hears, once
+    assert emit.calls == [('presence_diff', {'online': ['alice'], 'offline': ['bob']}, 'user:carol')]
+    assert conversations.finds == 1
+    (ops,) = users.writes
+    assert {op._doc['$set']['online_status']: op._filter['user_id']['$in'] for op in ops} == {
+        'online': ['alice'], 'offline': ['bob']}
+    assert broadcaster.stats['diffs'] == 1 and broadcaster.stats['flushes'] == 1
+
+
+def test_reconnect_within_the_window_is_not_broadcast():
+    conversations = FakeConversations([['alice', 'bob']])
+    users, emit, registry = RecordingUsers(), RecordingEmit(), PresenceRegistry()
+
+    async def scenario():
+        await registry.connect('bob', 'sid_bob')
+        broadcaster = PresenceBroadcaster(conversations, users, registry, emit, batch_ms=10_000)
+        broadcaster.changed('alice', False)
+        broadcaster.changed('alice', True)
+        await broadcaster.close()
+        return broadcaster
+
+    broadcaster = asyncio.run(scenario())
+    assert emit.calls == [] and users.writes == [] and conversations.finds == 0
+    assert broadcaster.stats['cancelled'] == 1
+
+
+def test_bulk_presence_endpoint_reads_the_registry(monkeypatch):
+    registry = PresenceRegistry()
+    monkeypatch.setattr(users, 'presence', registry)
+    app = FastAPI()
+    app.include_router(users.router)
+    app.dependency_overrides[get_current_user] = lambda: {'user_id': 'me'}
+
+    async def scenario():
+        await registry.connect('bob', 'sid_bob')
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test') as http:
+            ok = await http.get('/api/users/presence', params={'ids': 'alice,bob,bob'})
+            too_many = await http.get('/api/users/presence', params={'ids': ','.join(f'u{i}' for i in range(201))})
+        return ok, too_many
+
+    ok, too_many = asyncio.run(scenario())
+    assert ok.json() == {'online': ['bob']}
+    assert too_many.status_code == 400
+
+
+def test_presence_failure_does_not_refuse_an_authenticated_socket(monkeypatch):
+    class BrokenRegistry:
+        async def connect(self, user_id, sid):
+            raise RuntimeError('registry down')
+
+    async def enter_room(sid, room):
+        pass
+
+    monkeypatch.setattr(socket_events, 'presence', BrokenRegistry())
+    monkeypatch.setattr(socket_events.sio, 'enter_room', enter_room)
+    monkeypatch.setattr(socket_events, 'presence_broadcaster', SimpleNamespace(changed=lambda *args: None))
+    token = create_access_token({'sub': 'alice'})
+
+    assert asyncio.run(socket_events.connect('sid1', {}, {'token': token})) is True
+    assert asyncio.run(socket_events.connect('sid2', {}, {'token': 'not-a-jwt'})) is False
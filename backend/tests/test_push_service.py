@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+
+from pywebpush import WebPushException
+
+from push_service import PushDispatcher, PushJob
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs
+
+
+class FakeSubscriptions:
+    def __init__(self, docs):
+        self.docs = docs
+        self.deleted = []
+
+    def find(self, query):
+        return FakeCursor([d for d in self.docs if d['user_id'] == query['user_id']])
+
+    async def delete_many(self, query):
+        ids = query['_id']['$in']
+        self.deleted.append(sorted(ids))
+        return SimpleNamespace(deleted_count=len(ids))
+
+
+def _response(status):
+    return SimpleNamespace(status_code=status, headers={})
+
+
+def test_retries_transient_failures_and_batches_dead_subscription_pruning():
+    subs = FakeSubscriptions([
+        {'_id': 1, 'user_id': 'u1', 'subscription': {'endpoint': 'ok'}},
+        {'_id': 2, 'user_id': 'u1', 'subscription': {'endpoint': 'flaky'}},
+        {'_id': 3, 'user_id': 'u1', 'subscription': {'endpoint': 'gone'}},
+        {'_id': 4, 'user_id': 'u1', 'subscription': {'endpoint': 'gone-too'}},
+    ])
+    attempts = {}
+
+    def send(subscription_info, **kwargs):
+        endpoint = subscription_info['endpoint']
+        attempts[endpoint] = attempts.get(endpoint, 0) + 1
+        if endpoint.startswith('gone'):
+            raise WebPushException('gone', response=_response(410))
+        if endpoint == 'flaky' and attempts[endpoint] < 3:
+            raise WebPushException('busy', response=_response(503))
+
+    async def scenario():
+        dispatcher = PushDispatcher(subs, send=send, workers=2, retry_base=0.01, prune_interval=3600)
+        assert dispatcher.enqueue(PushJob('u1', {'title': 'hi'}))
+        for _ in range(200):
+            await asyncio.sleep(0.01)
+            if dispatcher.counters['sent'] == 2 and not dispatcher._retry_handles:
+                break
+        await dispatcher.queue.join()
+        stats = dispatcher.stats()
+        await dispatcher.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert attempts == {'ok': 1, 'flaky': 3, 'gone': 1, 'gone-too': 1}
+    assert stats['sent'] == 2 and stats['retried'] == 2
+    assert subs.deleted == [[3, 4]]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    async def scenario():
+        dispatcher = PushDispatcher(FakeSubscriptions([]), send=lambda **kw: None, workers=1, queue_max=1)
+        # Workers have not run yet, so the second job finds the queue full
+        results = [dispatcher.enqueue(PushJob('u', {})) for _ in range(3)]
+        await dispatcher.stop()
+        return results, dispatcher.counters['dropped']
+
+    results, dropped = asyncio.run(scenario())
+    assert results == [True, False, False] and dropped == 2
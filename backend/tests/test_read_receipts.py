@@ -0,0 +1,268 @@
+import asyncio
+from datetime import datetime, timezone
+
+from read_receipts import ReadReceiptPipeline
+from read_state import ReadState, apply_read_by
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, n):
+        return self.docs
+
+
+class RecordingMessages:
+    def __init__(self, docs):
+        self.docs = {d['message_id']: d for d in docs}
+        self.finds = 0
+        self.writes = []
+
+    async def count_documents(self, criteria):
+        return sum(
+            1 for d in self.docs.values()
+            if d['conversation_id'] == criteria['conversation_id']
+            and d['message_id'] > criteria['message_id']['$gt']
+            and d.get('sender_id') != criteria['sender_id']['$ne']
+        )
+
+    def find(self, criteria, projection=None):
+        self.finds += 1
+        return FakeCursor([dict(self.docs[m]) for m in criteria['message_id']['$in'] if m in self.docs])
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes.append(list(ops))
+
+
+class RecordingState:
+    def __init__(self, messages, current=None):
+        self.messages = messages
+        self.current = current or {}
+        self.writes = []
+
+    async def advance(self, ops):
+        if ops:
+            self.writes.append(list(ops))
+
+    async def get_many(self, keys):
+        return {key: self.current[key] for key in keys if key in self.current}
+
+    async def count_unread(self, user_id, conversation_id, after):
+        return await ReadState(None, self.messages).count_unread(user_id, conversation_id, after)
+
+
+class RecordingEmit:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, event, data, room=None):
+        self.calls.append((event, data, room))
+
+
+def _msg(i, conv='conv', **extra):
+    return {'message_id': f'msg_{i:04d}', 'conversation_id': conv, 'timestamp': f'2026-01-01T00:00:{i % 60:02d}', **extra}
+
+
+def test_scroll_burst_becomes_one_watermark_write_and_one_broadcast():
+    messages = RecordingMessages([_msg(i) for i in range(60)])
+    state, emit = RecordingState(messages), RecordingEmit()
+
+    async def scenario():
+        pipeline = ReadReceiptPipeline(messages, state, emit, flush_ms=20)
+        for i in range(50):
+            pipeline.add('u1', 'conv', [f'msg_{i:04d}'])
+        pipeline.add('u1', 'conv', ['msg_0003', 'msg_0050'])
+        await asyncio.sleep(0.05)
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+    assert messages.finds == 1
+    assert messages.writes == []  # no vanish-mode messages, nothing written to messages
+    (ops,) = state.writes
+    (op,) = ops
+    assert op._filter == {'conversation_id': 'conv', 'user_id': 'u1'}
+    assert op._doc['$max']['last_read_id'] == 'msg_0050'
+    (event, data, room), counter = emit.calls
+    assert event == 'messages_read_batch' and room == 'conv'
+    assert counter == ('unread_count', {'conversation_id': 'conv', 'unread_count': 9}, 'user:u1')
+    assert data['user_id'] == 'u1' and len(data['message_ids']) == 51 and data['last_read_id'] == 'msg_0050'
+    assert pipeline.stats['events'] == 51 and pipeline.stats['broadcasts'] == 1
+
+
+def test_ids_from_other_conversations_do_not_move_the_watermark():
+    messages = RecordingMessages([_msg(1), _msg(9, conv='elsewhere')])
+    state, emit = RecordingState(messages), RecordingEmit()
+
+    async def scenario():
+        pipeline = ReadReceiptPipeline(messages, state, emit, flush_ms=5)
+        pipeline.add('u1', 'conv', ['msg_0001', 'msg_0009', 'zzzz'])
+        await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    assert state.writes[0][0]._doc['$max']['last_read_id'] == 'msg_0001'
+    assert emit.calls[0][1]['message_ids'] == ['msg_0001']
+
+
+def test_vanish_timers_start_once_and_are_broadcast():
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    messages = RecordingMessages([
+        _msg(1, expires_in=10), _msg(2, expires_in=10), _msg(3, expires_in=60),
+        _msg(4, expires_in=10, expires_at=started), _msg(5), _msg(6, conv='other'),
+    ])
+    state, emit = RecordingState(messages), RecordingEmit()
+
+    async def scenario():
+        pipeline = ReadReceiptPipeline(messages, state, emit, flush_ms=10)
+        pipeline.add('u2', 'conv', [f'msg_{i:04d}' for i in range(1, 6)])
+        pipeline.add('u3', 'other', ['msg_0006'])
+        await asyncio.sleep(0.03)
+
+    asyncio.run(scenario())
+    (ops,) = messages.writes
+    timers = {tuple(op._filter['message_id']['$in']): op._doc['$set']['expires_at'] for op in ops}
+    assert set(timers) == {('msg_0001', 'msg_0002'), ('msg_0003',)}
+    assert all(op._filter['expires_at'] is None for op in ops)
+    assert len(state.writes[0]) == 2
+    by_room = {room: data for event, data, room in emit.calls if event == 'messages_read_batch'}
+    assert set(by_room['conv']['expires_at_map']) == {'msg_0001', 'msg_0002', 'msg_0003', 'msg_0004'}
+    assert by_room['conv']['expires_at_map']['msg_0004'] == started.isoformat()
+    assert by_room['other']['message_ids'] == ['msg_0006']
+
+
+def test_close_flushes_pending_reads():
+    messages = RecordingMessages([_msg(1)])
+    state, emit = RecordingState(messages), RecordingEmit()
+
+    async def scenario():
+        pipeline = ReadReceiptPipeline(messages, state, emit, flush_ms=10_000)
+        pipeline.add('u1', 'conv', ['msg_0001'])
+        await pipeline.close()
+
+    asyncio.run(scenario())
+    assert len(state.writes) == 1 and [c[0] for c in emit.calls] == ['messages_read_batch', 'unread_count']
+
+
+def test_counter_is_reset_to_what_is_left_above_the_watermark():
+    messages = RecordingMessages([_msg(i, sender_id='me' if i == 7 else 'them') for i in range(1, 10)])
+    # An older read already got the user to msg_0005; a stale read must not raise the count
+    state = RecordingState(messages, {('me', 'conv'): {'last_read_id': 'msg_0005'}})
+    emit = RecordingEmit()
+
+    async def scenario():
+        pipeline = ReadReceiptPipeline(messages, state, emit, flush_ms=5)
+        pipeline.add('me', 'conv', ['msg_0002'])
+        await asyncio.sleep(0.02)
+        pipeline.add('me', 'conv', ['msg_0006'])
+        await asyncio.sleep(0.02)
+
+    asyncio.run(scenario())
+    # msg_0006..0009 remain after the first read, minus the user's own msg_0007
+    assert [ops[0]._doc['$set']['unread'] for ops in state.writes] == [3, 2]
+    counters = [data['unread_count'] for event, data, _ in emit.calls if event == 'unread_count']
+    assert counters == [3, 2]
+
+
+def test_read_by_shim_derives_receipts_from_watermarks():
+    page = [
+        {'message_id': 'msg_0001', 'sender_id': 'a', 'read_by': ['a', 'legacy']},
+        {'message_id': 'msg_0002', 'sender_id': 'b', 'read_by': ['b']},
+        {'message_id': 'msg_0003', 'sender_id': 'a'},
+    ]
+    apply_read_by(page, {'a': 'msg_0003', 'b': 'msg_0002'})
+    assert [m['read_by'] for m in page] == [['a', 'legacy', 'b'], ['b', 'a'], ['a']]
+
+
+class FakeAggregate:
+    def __init__(self, messages):
+        self.messages = messages
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        match = pipeline[0]['$match']
+        counts = {}
+        for m in self.messages:
+            if m['sender_id'] == match['sender_id']['$ne']:
+                continue
+            for branch in match['$or']:
+                if m['conversation_id'] == branch['conversation_id'] and m['message_id'] > branch['message_id']['$gt']:
+                    counts[m['conversation_id']] = counts.get(m['conversation_id'], 0) + 1
+        return FakeCursor([{'_id': c, 'count': n} for c, n in counts.items()])
+
+
+def test_unread_counts_skip_fully_read_conversations():
+    messages = FakeAggregate([
+        {'conversation_id': 'c1', 'message_id': f'msg_{i:04d}', 'sender_id': 'them' if i % 2 else 'me'}
+        for i in range(10)
+    ])
+    state = ReadState(None, messages)
+    convs = [
+        {'conversation_id': 'c1', 'last_message': {'message_id': 'msg_0009'}},
+        {'conversation_id': 'c2', 'last_message': {'message_id': 'msg_0100'}},
+    ]
+    counts = asyncio.run(state.unread_counts('me', convs, {'c1': 'msg_0004', 'c2': 'msg_0100'}))
+    assert counts == {'c1': 3}
+    (pipeline,) = messages.pipelines
+    assert [b['conversation_id'] for b in pipeline[0]['$match']['$or']] == ['c1']
+
+
+class FakeStateCollection:
+    def __init__(self, docs):
+        self.docs = {(d['user_id'], d['conversation_id']): dict(d) for d in docs}
+
+    def find(self, criteria, projection=None):
+        if '$in' in criteria.get('conversation_id', {}):
+            keys = [(criteria['user_id'], c) for c in criteria['conversation_id']['$in']]
+        else:
+            keys = [k for k in self.docs if k[1] == criteria['conversation_id']]
+        return FakeCursor([dict(self.docs[k]) for k in keys if k in self.docs])
+
+    async def bulk_write(self, ops, ordered=True):
+        for op in ops:
+            key = (op._filter['user_id'], op._filter['conversation_id'])
+            if key not in self.docs and not op._upsert:
+                continue
+            doc = self.docs.setdefault(key, {'user_id': key[0], 'conversation_id': key[1]})
+            if 'unread' in op._filter and 'unread' not in doc:
+                continue
+            doc.update(op._doc.get('$set', {}))
+            for field, n in op._doc.get('$inc', {}).items():
+                doc[field] = doc.get(field, 0) + n
+
+
+def test_missing_counters_are_counted_once_and_stored():
+    messages = FakeAggregate([
+        {'conversation_id': 'c2', 'message_id': f'msg_{i:04d}', 'sender_id': 'them'} for i in range(4)
+    ])
+    collection = FakeStateCollection([
+        {'user_id': 'me', 'conversation_id': 'c1', 'last_read_id': 'msg_0001', 'unread': 5},
+        # A watermark from the backfill: no counter yet
+        {'user_id': 'me', 'conversation_id': 'c2', 'last_read_id': ''},
+    ])
+    # Sends before the first listing must not start the counter at 1
+    asyncio.run(ReadState(collection, messages).increment({('me', 'c2'): 1, ('me', 'c3'): 1}))
+    assert 'unread' not in collection.docs[('me', 'c2')] and ('me', 'c3') not in collection.docs
+    state = ReadState(collection, messages)
+    convs = [
+        {'conversation_id': 'c1', 'last_message': {'message_id': 'msg_0009'}},
+        {'conversation_id': 'c2', 'last_message': {'message_id': 'msg_0003'}},
+    ]
+    states = asyncio.run(state.counters('me', convs))
+    assert states['c1']['unread'] == 5  # stored counter, not recounted
+    assert states['c2']['unread'] == 4
+    assert collection.docs[('me', 'c2')]['unread'] == 4
+    asyncio.run(state.increment({('me', 'c2'): 2}))
+    assert asyncio.run(state.counters('me', convs))['c2']['unread'] == 6
+    assert len(messages.pipelines) == 1
+
+
+def test_reconcile_overwrites_drifted_counters():
+    messages = RecordingMessages([_msg(i, sender_id='a' if i < 3 else 'b') for i in range(1, 6)])
+    collection = FakeStateCollection([
+        {'user_id': 'a', 'conversation_id': 'conv', 'last_read_id': 'msg_0003', 'unread': 40},
+        {'user_id': 'b', 'conversation_id': 'conv', 'unread': -1},
+    ])
+    counts = asyncio.run(ReadState(collection, messages).reconcile('conv', ['a', 'b']))
+    assert counts == {'a': 2, 'b': 2}
+    assert collection.docs[('a', 'conv')]['unread'] == 2 and collection.docs[('b', 'conv')]['unread'] == 2
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from redis_pool import RedisPool
+from routers import auth
+from socket_instance import _redis_reachable
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+requires_redis = pytest.mark.skipif(not _redis_reachable(REDIS_URL), reason='Redis is not reachable')
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeOtps:
+    def __init__(self):
+        self.docs = {}
+
+    async def delete_many(self, query):
+        self.docs.pop(query['email'], None)
+
+    async def insert_one(self, doc):
+        self.docs[doc['email']] = dict(doc)
+
+    async def find_one(self, query):
+        return self.docs.get(query['email'])
+
+
+def test_unreachable_redis_returns_default_and_backs_off():
+    clock = FakeClock()
+    pool = RedisPool('redis://127.0.0.1:1/0', socket_timeout=0.2, retry_seconds=5, clock=clock)
+
+    async def scenario():
+        assert await pool.call('get', 'k', default='fallback') == 'fallback'
+        assert not pool.available()
+        # Within the back-off window Redis is not contacted at all
+        assert await pool.call('get', 'k') is None
+        assert pool.counters == {'calls': 1, 'failures': 1, 'skipped': 1}
+        clock.now += 5
+        assert pool.available()
+        await pool.close()
+
+    asyncio.run(scenario())
+
+
+def test_unconfigured_pool_is_never_available():
+    pool = RedisPool('')
+    assert pool.client is None
+    assert pool.sync_pool() is None
+    assert asyncio.run(pool.call('ping', default=False)) is False
+
+
+def test_otp_falls_back_to_mongo_when_redis_is_down(monkeypatch):
+    otps = FakeOtps()
+    pool = RedisPool('')
+    monkeypatch.setattr(auth.db, 'otps', otps, raising=False)
+    monkeypatch.setattr(auth, 'redis_pool', pool)
+
+    async def scenario():
+        await auth._store_otp('a@example.com', '123456')
+        assert otps.docs['a@example.com']['otp'] == '123456'
+        assert not await auth._consume_otp('a@example.com', '000000')
+        assert await auth._consume_otp('a@example.com', '123456')
+        assert 'a@example.com' not in otps.docs
+
+    asyncio.run(scenario())
+
+
+@requires_redis
+def test_otp_round_trip_through_redis(monkeypatch):
+    otps = FakeOtps()
+    pool = RedisPool(REDIS_URL)
+    monkeypatch.setattr(auth.db, 'otps', otps, raising=False)
+    monkeypatch.setattr(auth, 'redis_pool', pool)
+    email = f"{uuid.uuid4().hex}@example.com"
+
+    async def scenario():
+        await auth._store_otp(email, '654321')
+        assert otps.docs == {}
+        assert await auth._consume_otp(email, '654321')
+        # Single use
+        assert not await auth._consume_otp(email, '654321')
+        await pool.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+import socketio
+
+from socket_instance import create_client_manager, _redis_reachable
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_socket_worker.py')
+
+requires_redis = pytest.mark.skipif(not _redis_reachable(REDIS_URL), reason='Redis is not reachable')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'worker on port {port} did not start')
+
+
+@pytest.fixture
+def workers():
+    env = {**os.environ, 'REDIS_URL': REDIS_URL, 'SOCKETIO_CHANNEL': f'quickchat-test-{uuid.uuid4().hex}'}
+    ports = [_free_port(), _free_port()]
+    procs = [subprocess.Popen([sys.executable, WORKER, str(p)], env=env) for p in ports]
+    try:
+        for p in ports:
+            _wait_for_port(p)
+        yield ports
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+
+def test_memory_mode_uses_in_process_manager():
+    assert create_client_manager(REDIS_URL, mode='memory') is None
+
+
+def test_auto_mode_falls_back_when_redis_is_down():
+    assert create_client_manager('redis://127.0.0.1:1/0', mode='auto') is None
+
+
+@requires_redis
+def test_message_crosses_workers(workers):
+    port_a, port_b = workers
+
+    async def scenario():
+        received = asyncio.get_running_loop().create_future()
+        sender, receiver = socketio.AsyncClient(), socketio.AsyncClient()
+
+        @receiver.on('new_message')
+        async def on_message(data):
+            if not received.done():
+                received.set_result(data)
+
+        await receiver.connect(f'http://127.0.0.1:{port_b}', transports=['websocket'])
+        await sender.connect(f'http://127.0.0.1:{port_a}', transports=['websocket'])
+        try:
+            await receiver.call('join_conversation', {'conversation_id': 'conv_multi'})
+            await sender.call('send_message', {'conversation_id': 'conv_multi', 'content': 'hello from A'})
+            return await asyncio.wait_for(received, timeout=5)
+        finally:
+            await sender.disconnect()
+            await receiver.disconnect()
+
+    data = asyncio.run(scenario())
+    assert data['content'] == 'hello from A'
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from spam_protection import SpamProtection, ContentScanner
+from socket_instance import _redis_reachable
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+requires_redis = pytest.mark.skipif(not _redis_reachable(REDIS_URL), reason='Redis is not reachable')
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _send(limiter, user_id, n):
+    return [asyncio.run(limiter.check_spam(user_id)) for _ in range(n)]
+
+
+def test_per_minute_limit_then_recovers():
+    clock = FakeClock(1_000_020.0)
+    limiter = SpamProtection(max_messages_per_minute=3, max_messages_per_hour=100, clock=clock)
+    results = _send(limiter, 'u1', 4)
+    assert [r[0] for r in results] == [False, False, False, True]
+    clock.now += 120
+    assert asyncio.run(limiter.check_spam('u1')) == (False, "OK")
+
+
+def test_hourly_limit_blocks_user():
+    clock = FakeClock(1_000_000.0)
+    limiter = SpamProtection(max_messages_per_minute=1000, max_messages_per_hour=5, clock=clock)
+    _send(limiter, 'u1', 5)
+    is_spam, reason = asyncio.run(limiter.check_spam('u1'))
+    assert is_spam and 'hourly' in reason
+    assert asyncio.run(limiter.get_user_block_status('u1'))
+    clock.now += 3601
+    assert not asyncio.run(limiter.get_user_block_status('u1'))
+
+
+def test_idle_users_are_evicted():
+    clock = FakeClock()
+    limiter = SpamProtection(clock=clock)
+    for i in range(100):
+        asyncio.run(limiter.check_spam(f'user_{i}'))
+    assert limiter.tracked_users() == 100
+    clock.now += 3601
+    asyncio.run(limiter.check_spam('fresh'))
+    assert limiter.tracked_users() == 1
+
+
+@requires_redis
+def test_redis_backend_shares_limits_between_instances():
+    import redis.asyncio as aioredis
+
+    async def scenario():
+        user_id = f"user_{uuid.uuid4().hex}"
+        worker_a = SpamProtection(max_messages_per_minute=2, redis=aioredis.from_url(REDIS_URL))
+        worker_b = SpamProtection(max_messages_per_minute=2, redis=aioredis.from_url(REDIS_URL))
+        try:
+            assert (await worker_a.check_spam(user_id))[0] is False
+            assert (await worker_b.check_spam(user_id))[0] is False
+            assert (await worker_a.check_spam(user_id))[0] is True
+        finally:
+            await worker_a.reset_user(user_id)
+
+    asyncio.run(scenario())
+
+
+def test_content_scanner_matches_keywords_case_insensitively_and_reloads():
+    scanner = ContentScanner(keywords=['click here', 'click link', 'act'], keywords_file='')
+    assert scanner.scan('Please CLICK LINK below') == (True, "Message contains spam keywords")
+    assert scanner.contains_keywords('react fast')
+    scanner.reload(['lottery'])
+    assert not scanner.contains_keywords('click here')
+    assert scanner.contains_keywords('You won the Lottery')
+
+
+def test_content_scanner_picks_up_keyword_file_changes(tmp_path):
+    path = tmp_path / 'keywords.txt'
+    path.write_text('crypto giveaway\n')
+    scanner = ContentScanner(keywords_file=str(path))
+    assert scanner.contains_keywords('huge CRYPTO GIVEAWAY today')
+    assert not scanner.contains_keywords('buy now')
+
+
+def test_content_scanner_detects_repeats_in_long_pastes():
+    scanner = ContentScanner(keywords_file='')
+    flood = ('a' * 75 + 'bcdefghijklmnopqrstuvwxyz') * 700
+    assert scanner.scan(flood) == (True, "Message contains excessive repeated characters")
+    varied = 'the quick brown fox jumps over the lazy dog ' * 1500
+    assert scanner.scan(varied) == (False, "OK")
+    assert scanner.scan('see http://a.example http://b.example https://c.example') == (True, "Message contains too many URLs")
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from typing_indicators import TypingTracker, socketio_backlog
+
+
+class RecordingEmit:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, event, data, room=None, skip_sid=None):
+        self.calls.append((event, data['user_id'], room, skip_sid))
+
+
+def test_keystroke_burst_is_throttled_then_stops_after_idle():
+    emit = RecordingEmit()
+
+    async def scenario():
+        tracker = TypingTracker(emit, interval_ms=50, idle_ms=30)
+        started = time.monotonic()
+        for _ in range(20):
+            await tracker.typing('sid1', 'u1', 'conv')
+            await asyncio.sleep(0.005)
+        elapsed = time.monotonic() - started
+        await asyncio.sleep(0.06)
+        return tracker, elapsed
+
+    tracker, elapsed = asyncio.run(scenario())
+    events = [c[0] for c in emit.calls]
+    assert 2 <= events.count('user_typing') <= elapsed / 0.05 + 1
+    assert events[-1] == 'user_stopped_typing' and events.count('user_stopped_typing') == 1
+    assert all(c[3] == ['sid1'] for c in emit.calls)
+    stats = tracker.stats()
+    assert stats['received'] == 20 and stats['emitted'] + stats['throttled'] == 20
+    assert stats['stopped'] == 1 and stats['active'] == 0
+
+
+def test_sending_a_message_stops_typing_at_once():
+    emit = RecordingEmit()
+
+    async def scenario():
+        tracker = TypingTracker(emit, interval_ms=1000, idle_ms=1000)
+        await tracker.typing('sid1', 'u1', 'conv')
+        await tracker.stop('u1', 'conv')
+        await tracker.stop('u1', 'conv')  # nothing typing any more: no event
+        await tracker.typing('sid1', 'u1', 'conv')
+        await tracker.disconnect('sid1')
+
+    asyncio.run(scenario())
+    assert [c[0] for c in emit.calls] == ['user_typing', 'user_stopped_typing', 'user_typing', 'user_stopped_typing']
+
+
+def test_backlogged_sockets_are_skipped():
+    emit = RecordingEmit()
+    queues = {'e1': 0, 'e2': 500, 'e3': 3}
+    server = SimpleNamespace(
+        manager=SimpleNamespace(get_participants=lambda ns, room: iter([('s1', 'e1'), ('s2', 'e2'), ('s3', 'e3')])),
+        eio=SimpleNamespace(sockets={e: SimpleNamespace(queue=SimpleNamespace(qsize=lambda n=n: n)) for e, n in queues.items()}),
+    )
+
+    async def scenario():
+        tracker = TypingTracker(emit, socketio_backlog(server, max_queue=64), interval_ms=0, idle_ms=1000)
+        await tracker.typing('s1', 'u1', 'conv')
+        await tracker.disconnect('s1')
+        return tracker
+
+    tracker = asyncio.run(scenario())
+    assert emit.calls[0][3] == ['s1', 's2']
+    assert tracker.stats()['skipped_backlogged'] == 2
@@ -0,0 +1,130 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI
+
+import media_storage
+from dependencies import get_current_user
+from rate_limiter import limiter
+from routers import media
+
+CHUNK = 64 * 1024
+
+
+class FakeUploads:
+    """The slice of a Motor collection the upload router uses."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def insert_one(self, doc):
+        self.docs[doc['upload_id']] = dict(doc)
+
+    async def find_one(self, query, projection=None):
+        for doc in self.docs.values():
+            if all(doc.get(k) == v for k, v in query.items()):
+                return dict(doc)
+        return None
+
+    async def update_one(self, query, update):
+        doc = self.docs.get(query['upload_id'])
+        if not doc or any(doc.get(k) != v for k, v in query.items()):
+            return SimpleNamespace(modified_count=0)
+        doc.update(update['$set'])
+        return SimpleNamespace(modified_count=1)
+
+
+class NoMessages:
+    async def distinct(self, key, query):
+        return []
+
+
+def _app(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_storage, 'MEDIA_DIR', tmp_path)
+    monkeypatch.setattr(media_storage, 'SPOOL_DIR', tmp_path / 'incoming')
+    monkeypatch.setattr(media, 'UPLOAD_CHUNK_MAX_BYTES', CHUNK)
+    fake_db = SimpleNamespace(uploads=FakeUploads(), messages=NoMessages())
+    monkeypatch.setattr(media, 'db', fake_db)
+    monkeypatch.setattr(media_storage, 'db', fake_db)
+    app = FastAPI()
+    app.state.limiter = limiter
+    app.include_router(media.router)
+    app.dependency_overrides[get_current_user] = lambda: {'user_id': 'u1'}
+    return app
+
+
+def _client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test')
+
+
+def test_chunked_upload_is_stored_and_served(monkeypatch, tmp_path, local_blobs):
+    data = os.urandom(CHUNK * 2 + 1000)
+    app = _app(monkeypatch, tmp_path)
+
+    async def scenario():
+        async with _client(app) as http:
+            res = await http.post('/api/uploads', json={'file_name': 'clip.mp4', 'mime_type': 'video/mp4',
+                                                        'size': len(data)})
+            upload_id = res.json()['upload_id']
+            offset = 0
+            while offset < len(data):
+                res = await http.put(f'/api/uploads/{upload_id}', headers={'Upload-Offset': str(offset)},
+                                     content=data[offset:offset + CHUNK])
+                assert res.status_code == 200
+                offset = res.json()['offset']
+            url = res.json()['url']
+            served = await http.get(url)
+            app.dependency_overrides[get_current_user] = lambda: {'user_id': 'u2'}
+            stranger = await http.get(url)
+            return res.json(), served, stranger
+
+    status, served, stranger = asyncio.run(scenario())
+    assert status['complete'] and status['url'].startswith('/api/blobs/')
+    assert served.content == data
+    assert served.headers['content-type'] == 'video/mp4'
+    assert served.headers['cache-control'].startswith('private') and 'immutable' in served.headers['cache-control']
+    assert stranger.status_code == 404
+    assert not list((tmp_path / 'incoming').glob('*.part'))
+
+
+def test_wrong_offset_reports_where_to_resume(monkeypatch, tmp_path):
+    app = _app(monkeypatch, tmp_path)
+
+    async def scenario():
+        async with _client(app) as http:
+            res = await http.post('/api/uploads', json={'size': 100})
+            upload_id = res.json()['upload_id']
+            await http.put(f'/api/uploads/{upload_id}', headers={'Upload-Offset': '0'}, content=b'a' * 40)
+            stale = await http.put(f'/api/uploads/{upload_id}', headers={'Upload-Offset': '0'}, content=b'b' * 40)
+            resume = await http.get(f'/api/uploads/{upload_id}')
+            return stale, resume
+
+    stale, resume = asyncio.run(scenario())
+    assert stale.status_code == 409
+    assert stale.json()['detail']['offset'] == 40
+    assert resume.json()['offset'] == 40 and not resume.json()['complete']
+
+
+def test_oversized_chunk_and_file_are_rejected(monkeypatch, tmp_path):
+    app = _app(monkeypatch, tmp_path)
+
+    async def scenario():
+        async with _client(app) as http:
+            too_big = await http.post('/api/uploads', json={'size': media.UPLOAD_MAX_BYTES + 1})
+            res = await http.post('/api/uploads', json={'size': CHUNK * 4})
+            upload_id = res.json()['upload_id']
+            chunk = await http.put(f'/api/uploads/{upload_id}', headers={'Upload-Offset': '0'},
+                                   content=b'x' * (CHUNK + 1))
+            return too_big, chunk
+
+    too_big, chunk = asyncio.run(scenario())
+    assert too_big.status_code == 413
+    assert chunk.status_code == 413
+
+
+def test_media_names_cannot_escape_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(media_storage, 'MEDIA_DIR', tmp_path)
+    assert media_storage.local_media_path('..%2F..%2Fetc%2Fpasswd') is None
+    assert media_storage.local_media_path('../server.py') is None
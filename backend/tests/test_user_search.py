@@ -0,0 +1,102 @@
+import asyncio
+import re
+
+from user_search import UserSearchIndex, normalize_term, search_terms
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return self.docs[:n]
+
+
+def _matches(doc, criteria):
+    for field, cond in criteria.items():
+        if field == '$or':
+            if not any(_matches(doc, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = doc[field]
+            if '$regex' in cond and not re.match(cond['$regex'], value):
+                return False
+            if '$gt' in cond and not value > cond['$gt']:
+                return False
+            if '$in' in cond and value not in cond['$in']:
+                return False
+        elif doc[field] != cond:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, criteria, projection=None):
+        return FakeCursor([dict(d) for d in self.docs if _matches(d, criteria)])
+
+
+def _index(users):
+    entries = []
+    for user in users:
+        terms = search_terms(user)
+        entries += [{'term': t, 'user_id': user['user_id'], 'terms': terms} for t in terms]
+    return UserSearchIndex(FakeCollection(entries), FakeCollection(users))
+
+
+USERS = [
+    {'user_id': 'u1', 'username': 'alice', 'unique_id': 'alice01', 'real_name': 'Alice Smith'},
+    {'user_id': 'u2', 'username': 'alfred', 'unique_id': 'alf', 'real_name': 'Alfred Ål'},
+    {'user_id': 'u3', 'username': 'bob', 'unique_id': 'bobby', 'real_name': 'Bob Al'},
+    {'user_id': 'u4', 'username': 'malice', 'unique_id': 'm4', 'real_name': 'Mal Ice'},
+]
+
+
+def test_terms_are_normalized():
+    assert normalize_term('  Ålice   SMITH ') == 'alice smith'
+    assert search_terms(USERS[0]) == ['alice', 'alice smith', 'alice01', 'smith']
+
+
+def test_exact_match_ranks_first_and_users_are_unique():
+    index = _index(USERS)
+    ids, position = asyncio.run(index.search_ids('AL', 10))
+    # 'al' is an exact term for Bob Al and (accent-folded) Alfred Ål
+    assert ids[:2] == ['u2', 'u3']
+    assert sorted(ids) == ['u1', 'u2', 'u3']
+    assert position is None
+
+
+def test_prefix_only_no_infix_match():
+    ids, _ = asyncio.run(_index(USERS).search_ids('lice', 10))
+    assert ids == []
+
+
+def test_pages_continue_from_cursor_without_repeats():
+    index = _index(USERS)
+
+    async def scenario():
+        seen = []
+        ids, position = await index.search_ids('al', 1)
+        seen += ids
+        while position is not None:
+            ids, position = await index.search_ids('al', 1, position)
+            seen += ids
+        return seen
+
+    assert asyncio.run(scenario()) == asyncio.run(index.search_ids('al', 10))[0]
+
+
+def test_search_returns_slim_docs_in_rank_order_excluding_self():
+    docs, _ = asyncio.run(_index(USERS).search('al', 10, exclude=['u2']))
+    assert [d['user_id'] for d in docs] == ['u3', 'u1']
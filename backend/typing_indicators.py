@@ -0,0 +1,131 @@
+"""
+Typing indicators
+-------------------
+Clients send `typing` while the user types (up to once a second per
+keystroke burst). Instead of broadcasting every one, typing state is kept per
+(user, conversation):
+- at most one `user_typing` is forwarded per TYPING_INTERVAL_MS; events in
+  between only refresh the state
+- once nothing has arrived for TYPING_IDLE_MS, `user_stopped_typing` is sent
+  (also straight away when the user sends a message or disconnects)
+- sockets on this node whose outbound queue already holds more than
+  TYPING_MAX_QUEUE packets are skipped; typing is the first thing to go when
+  a client cannot keep up, messages and receipts are not
+
+`stats()` reports events received against events emitted.
+
+Tuning (backend/.env):
+  TYPING_INTERVAL_MS=2000    # clients hide the indicator 3s after the last user_typing
+  TYPING_IDLE_MS=3000
+  TYPING_MAX_QUEUE=64
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from socket_instance import sio
+
+logger = logging.getLogger(__name__)
+
+TYPING_INTERVAL_MS = float(os.getenv('TYPING_INTERVAL_MS', '2000'))
+TYPING_IDLE_MS = float(os.getenv('TYPING_IDLE_MS', '3000'))
+TYPING_MAX_QUEUE = int(os.getenv('TYPING_MAX_QUEUE', '64'))
+
+
+class _Typing:
+    __slots__ = ('sid', 'last_emit', 'idle')
+
+    def __init__(self, sid: str):
+        self.sid = sid
+        self.last_emit = 0.0
+        self.idle: Optional[asyncio.TimerHandle] = None
+
+
+class TypingTracker:
+    def __init__(self, emit: Callable[..., Awaitable], backlogged: Callable[[str], Iterable[str]] = lambda room: (),
+                 interval_ms: float = TYPING_INTERVAL_MS, idle_ms: float = TYPING_IDLE_MS):
+        self.emit = emit
+        self.backlogged = backlogged
+        self.interval = interval_ms / 1000
+        self.idle = idle_ms / 1000
+        # (user_id, conversation_id) -> state of someone currently typing
+        self._active: Dict[Tuple[str, str], _Typing] = {}
+        self._inflight: set = set()
+        self._stats = {'received': 0, 'emitted': 0, 'throttled': 0, 'stopped': 0, 'skipped_backlogged': 0}
+
+    async def typing(self, sid: str, user_id: str, conversation_id: str):
+        """A `typing` event from a client; forwarded only if the interval has passed."""
+        self._stats['received'] += 1
+        key = (user_id, conversation_id)
+        state = self._active.get(key)
+        if state is None:
+            state = self._active[key] = _Typing(sid)
+        state.sid = sid
+        if state.idle is not None:
+            state.idle.cancel()
+        state.idle = asyncio.get_running_loop().call_later(self.idle, self._on_idle, key)
+
+        now = time.monotonic()
+        if now - state.last_emit < self.interval:
+            self._stats['throttled'] += 1
+            return
+        state.last_emit = now
+        await self._send('user_typing', user_id, conversation_id, sid)
+
+    async def stop(self, user_id: str, conversation_id: str):
+        """The user stopped typing (sent the message): tell the room now, not after the idle timeout."""
+        state = self._active.pop((user_id, conversation_id), None)
+        if state is None:
+            return
+        if state.idle is not None:
+            state.idle.cancel()
+        await self._send('user_stopped_typing', user_id, conversation_id, state.sid)
+
+    async def disconnect(self, sid: str):
+        for user_id, conversation_id in [key for key, state in self._active.items() if state.sid == sid]:
+            await self.stop(user_id, conversation_id)
+
+    def _on_idle(self, key: Tuple[str, str]):
+        task = asyncio.create_task(self.stop(*key))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, event: str, user_id: str, conversation_id: str, sid: str):
+        skip: List[str] = [sid]
+        for backed_up in self.backlogged(conversation_id):
+            if backed_up != sid:
+                skip.append(backed_up)
+                self._stats['skipped_backlogged'] += 1
+        try:
+            await self.emit(event, {'user_id': user_id, 'conversation_id': conversation_id},
+                            room=conversation_id, skip_sid=skip)
+        except Exception as e:
+            logger.warning(f"Typing broadcast failed: {e}")
+            return
+        self._stats['emitted' if event == 'user_typing' else 'stopped'] += 1
+
+    def stats(self) -> dict:
+        return {**self._stats, 'active': len(self._active)}
+
+
+def socketio_backlog(server, max_queue: int = TYPING_MAX_QUEUE) -> Callable[[str], List[str]]:
+    """
+    Sockets in a room on this node whose Engine.IO send queue is longer than
+    `max_queue` packets. Other nodes' sockets are not visible here and always
+    receive the event.
+    """
+    def backlogged(room: str) -> List[str]:
+        sids = []
+        for sid, eio_sid in server.manager.get_participants('/', room):
+            socket = server.eio.sockets.get(eio_sid)
+            if socket is not None and socket.queue.qsize() > max_queue:
+                sids.append(sid)
+        return sids
+    return backlogged
+
+
+# Global tracker used by the typing, send_message and disconnect handlers
+typing_tracker = TypingTracker(sio.emit, socketio_backlog(sio))
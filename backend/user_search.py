@@ -0,0 +1,131 @@
+"""
+Prefix search over users
+--------------------------
+`user_search` holds one small document per (search term, user): the
+lower-cased username, unique_id, full real name and each word of the real
+name. With an index on (term, user_id) a query is an anchored range scan, so
+the cost follows the page size instead of the size of the users collection.
+
+Walking the index in (term, user_id) order ranks an exact match first (it is
+the smallest term with the prefix), then the other completions. A user
+matching through several terms is returned once, at its best term, which also
+keeps results stable across pages. Pages continue from an opaque
+(term, user_id) cursor.
+
+The index is maintained by registration, profile updates and account
+deletion; `scripts/build_user_search.py` rebuilds it for existing users.
+"""
+
+import re
+import logging
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+from pymongo import DeleteMany, UpdateOne
+
+from database import db
+from avatars import list_avatar
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SCAN_BATCH = 200
+
+# Only what the search dropdown renders; the photo comes from the avatar endpoint
+SEARCH_PROJECTION = {
+    '_id': 0,
+    'user_id': 1,
+    'username': 1,
+    'real_name': 1,
+    'unique_id': 1,
+    'avatar': 1,
+}
+
+
+def normalize_term(text: str) -> str:
+    """Case- and accent-insensitive form used for both indexing and queries."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def search_terms(user: dict) -> List[str]:
+    terms = set()
+    for field in ('username', 'unique_id', 'real_name'):
+        value = normalize_term(user.get(field) or '')
+        if value:
+            terms.add(value)
+    real_name = normalize_term(user.get('real_name') or '')
+    terms.update(w for w in real_name.split(' ') if w)
+    return sorted(terms)
+
+
+class UserSearchIndex:
+    def __init__(self, collection, users):
+        self.collection = collection
+        self.users = users
+
+    async def index_user(self, user: dict):
+        """(Re)index one user document; terms that no longer apply are removed."""
+        terms = search_terms(user)
+        ops = [DeleteMany({'user_id': user['user_id'], 'term': {'$nin': terms}})]
+        ops += [
+            UpdateOne({'term': term, 'user_id': user['user_id']}, {'$set': {'terms': terms}}, upsert=True)
+            for term in terms
+        ]
+        await self.collection.bulk_write(ops, ordered=True)
+
+    async def remove_user(self, user_id: str):
+        await self.collection.delete_many({'user_id': user_id})
+
+    async def search_ids(self, query: str, limit: int, after: Optional[Tuple[str, str]] = None,
+                         exclude: Iterable[str] = ()) -> Tuple[List[str], Optional[Tuple[str, str]]]:
+        """
+        Return up to `limit` user ids matching `query` by prefix, best match first,
+        and the (term, user_id) position to continue from (None when exhausted).
+        """
+        prefix = normalize_term(query)
+        if not prefix:
+            return [], None
+        exclude = set(exclude)
+        term_filter = {'$regex': '^' + re.escape(prefix)}
+        found: List[str] = []
+        position = after
+        while True:
+            criteria = {'term': term_filter}
+            if position is not None:
+                criteria['$or'] = [
+                    {'term': {'$gt': position[0]}},
+                    {'term': position[0], 'user_id': {'$gt': position[1]}},
+                ]
+            entries = await self.collection.find(
+                criteria, {'_id': 0, 'term': 1, 'user_id': 1, 'terms': 1}
+            ).sort([('term', 1), ('user_id', 1)]).limit(SEARCH_SCAN_BATCH).to_list(SEARCH_SCAN_BATCH)
+
+            for entry in entries:
+                position = (entry['term'], entry['user_id'])
+                if entry['user_id'] in exclude:
+                    continue
+                # Emit each user only at its best (smallest) matching term
+                best = min((t for t in entry['terms'] if t.startswith(prefix)), default=entry['term'])
+                if entry['term'] != best:
+                    continue
+                found.append(entry['user_id'])
+                if len(found) >= limit:
+                    return found, position
+            if len(entries) < SEARCH_SCAN_BATCH:
+                return found, None
+
+    async def search(self, query: str, limit: int, after: Optional[Tuple[str, str]] = None,
+                     exclude: Iterable[str] = (),
+                     base_url: str = '') -> Tuple[List[dict], Optional[Tuple[str, str]]]:
+        """Like search_ids, but returns slim user documents in rank order (avatar URLs under base_url)."""
+        user_ids, position = await self.search_ids(query, limit, after, exclude)
+        if not user_ids:
+            return [], position
+        docs = await self.users.find({'user_id': {'$in': user_ids}}, SEARCH_PROJECTION).to_list(len(user_ids))
+        by_id = {d['user_id']: list_avatar(d, base_url) for d in docs}
+        return [by_id[u] for u in user_ids if u in by_id], position
+
+
+# Global index used by the users and auth routers
+user_search = UserSearchIndex(db.user_search, db.users)
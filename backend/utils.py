@@ -1,10 +1,9 @@
 import os
 import random
 import string
+import base64
+import json
 import logging
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import jwt
 import bcrypt
 import asyncio
@@ -28,18 +27,45 @@ VAPID_PUBLIC_KEY = os.getenv('VAPID_PUBLIC_KEY', '')
 VAPID_PRIVATE_KEY = os.getenv('VAPID_PRIVATE_KEY', '')
 VAPID_CLAIMS_EMAIL = os.getenv('VAPID_CLAIMS_EMAIL', 'mailto:' + SENDER_EMAIL).strip('"').strip("'")
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID', '').strip('"').strip("'")
+# bcrypt work factor for new hashes; existing hashes are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
 
 logger = logging.getLogger(__name__)
 
 def generate_otp():
     return ''.join(random.choices(string.digits, k=6))
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def normalize_email(email: str) -> str:
+    """Lookup key for emails: stored as `email_normalized` so login can use an exact index match."""
+    return email.strip().lower()
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def password_rounds(hashed: str) -> int:
+    """Work factor recorded in a bcrypt hash (`$2b$12$...` -> 12); 0 if unparseable."""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
+def encode_cursor(*parts) -> str:
+    """Opaque pagination cursor: clients pass it back verbatim, never parse it."""
+    return base64.urlsafe_b64encode(json.dumps(parts, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> list:
+    """Inverse of encode_cursor; raises ValueError on anything it did not produce."""
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(parts, list):
+        raise ValueError('Invalid cursor')
+    return parts
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -51,21 +77,3 @@ def create_refresh_token(data: dict):
     expire = datetime.now(timezone.utc) + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({'exp': expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-def send_email_func(to_email: str, subject: str, html_content: str):
-    try:
-        message = MIMEMultipart('alternative')
-        message['Subject'] = subject
-        message['From'] = SENDER_EMAIL
-        message['To'] = to_email
-        part = MIMEText(html_content, 'html')
-        message.attach(part)
-        
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(GMAIL_EMAIL, GMAIL_PASSWORD)
-            server.sendmail(SENDER_EMAIL, [to_email], message.as_string())
-        
-        return True
-    except Exception as e:
-        logger.error(f"Email failed: {e}")
-        return False
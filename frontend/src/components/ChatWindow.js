@@ -10,6 +10,7 @@ import { useAuth } from "@/contexts/AuthContext";
 import { useChatStore } from "@/hooks/useChatStore";
 import { useDialog } from "@/contexts/DialogContext";
 import { decryptMessage } from "@/utils/encryption";
+import { loadAttachment } from "@/utils/attachments";
 import {
   Popover,
   PopoverContent,
@@ -56,6 +57,17 @@ const MemoizedMessageRow = React.memo(({
   const theirPublicKey = selectedConversation?.other_user?.public_key;
 
   const decryptedContent = useMemo(() => decryptMessage(m.content, myPrivateKey, theirPublicKey), [m.content, myPrivateKey, theirPublicKey]);
+  // Attachments in the blob store carry only a hash; fetch (and open) them on display
+  const [blobSrc, setBlobSrc] = useState(null);
+  useEffect(() => {
+    if (!m.blob) return;
+    let cancelled = false;
+    loadAttachment(m.blob, m.blob_e2ee, myPrivateKey, theirPublicKey)
+      .then((src) => { if (!cancelled) setBlobSrc(src); })
+      .catch((err) => console.error("Attachment failed to load:", err));
+    return () => { cancelled = true; };
+  }, [m.blob, m.blob_e2ee, myPrivateKey, theirPublicKey]);
+  const mediaSrc = m.blob ? blobSrc : decryptedContent;
 
   const repliedMessage = useMemo(() => m.reply_to ? messages.find(msg => msg.message_id === m.reply_to) : null, [m.reply_to, messages]);
   const decryptedRepliedContent = useMemo(() => repliedMessage ? decryptMessage(repliedMessage.content, myPrivateKey, theirPublicKey) : null, [repliedMessage, myPrivateKey, theirPublicKey]);
@@ -149,9 +161,9 @@ const MemoizedMessageRow = React.memo(({
           )}
           {m.message_type?.startsWith("image") && (
             <div className={`relative group overflow-hidden rounded-xl min-h-[60px] min-w-[100px] bg-black/10 ${isVanishing && !isOwn ? 'blur-md hover:blur-none transition-all duration-300' : ''}`}>
-              <img src={decryptedContent} alt="attachment" className="w-full max-h-60 object-cover" loading="lazy" />
+              <img src={mediaSrc} alt="attachment" className="w-full max-h-60 object-cover" loading="lazy" />
               <button
-                onClick={() => downloadFile(decryptedContent, m.file_name || "image", m.message_id)}
+                onClick={() => downloadFile(mediaSrc, m.file_name || "image", m.message_id)}
                 className="absolute bottom-2 right-2 bg-black/50 hover:bg-black/70 p-1.5 rounded-full text-white opacity-0 group-hover:opacity-100 transition-all z-10"
                 title="Download Image"
               >
@@ -175,7 +187,7 @@ const MemoizedMessageRow = React.memo(({
           )}
           {m.message_type && m.message_type.startsWith("video/") && (
             <div className="relative group overflow-hidden rounded-xl min-h-[60px] min-w-[200px] bg-black/10">
-              <video controls src={decryptedContent} className="max-w-full rounded-xl relative z-10" />
+              <video controls src={mediaSrc} className="max-w-full rounded-xl relative z-10" />
               {(uploadProgress[m.message_id] !== undefined || downloadProgress[m.message_id] !== undefined) && (
                 <div className="absolute inset-0 bg-black/50 flex flex-col items-center justify-center backdrop-blur-sm z-20 transition-all duration-300 rounded-xl">
                   <div className="w-12 h-12 relative flex items-center justify-center">
@@ -194,7 +206,7 @@ const MemoizedMessageRow = React.memo(({
           )}
           {m.message_type && m.message_type.startsWith("audio/") && (
             <div className="relative group overflow-hidden rounded-full min-w-[240px] max-w-[300px] bg-white/10 dark:bg-black/20 p-1 flex items-center backdrop-blur-md shadow-sm border border-white/10">
-              <audio controls src={decryptedContent} className="w-full h-10 outline-none opacity-90 hover:opacity-100 transition-opacity custom-audio-player" />
+              <audio controls src={mediaSrc} className="w-full h-10 outline-none opacity-90 hover:opacity-100 transition-opacity custom-audio-player" />
               {(uploadProgress[m.message_id] !== undefined || downloadProgress[m.message_id] !== undefined) && (
                 <div className="absolute inset-0 bg-black/50 flex flex-col items-center justify-center backdrop-blur-sm z-20 transition-all duration-300 rounded-full">
                   <div className="w-8 h-8 relative flex items-center justify-center">
@@ -215,7 +227,7 @@ const MemoizedMessageRow = React.memo(({
             !["text", "location", "poll"].includes(m.message_type) &&
             !["image", "audio", "video"].includes(m.message_type.split("/")[0]) && (
             <button
-              onClick={() => downloadFile(decryptedContent, m.file_name, m.message_id)}
+              onClick={() => downloadFile(mediaSrc, m.file_name, m.message_id)}
               className="group relative flex items-center gap-3 p-3 rounded-xl transition-all text-left max-w-[260px] md:max-w-sm overflow-hidden"
               style={{
                 background: isOwn ? 'rgba(0,0,0,0.15)' : 'rgba(255,255,255,0.05)',
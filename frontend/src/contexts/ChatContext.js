@@ -48,13 +48,20 @@ export const ChatProvider = ({ children }) => {
       const res = await api.get('/conversations');
       if (res.status === 200) {
         setConversations(res.data);
-        const onlineSet = new Set();
-        res.data.forEach(conv => {
-            if (conv.other_user?.online_status === 'online') {
-                onlineSet.add(conv.other_user.user_id);
-            }
+        // online_status is live presence, so it also clears contacts who went offline
+        // while this client was disconnected and missed the presence_diff
+        setOnlineUsers(prev => {
+            const onlineSet = new Set(prev);
+            res.data.forEach(conv => {
+                if (!conv.other_user) return;
+                if (conv.other_user.online_status === 'online') {
+                    onlineSet.add(conv.other_user.user_id);
+                } else {
+                    onlineSet.delete(conv.other_user.user_id);
+                }
+            });
+            return onlineSet;
         });
-        setOnlineUsers(prev => new Set([...prev, ...onlineSet]));
       }
     } catch (e) {
       console.error("Failed to fetch conversations");
@@ -86,16 +86,23 @@ export const useChatSocket = ({
         typingTimeoutRef.current = setTimeout(() => setTyping(null), 3000);
       }
     };
+    const handleUserStoppedTyping = (data) => {
+      const currentConv = selectedConversationRef.current;
+      if (currentConv && data.conversation_id === currentConv.conversation_id) {
+        clearTimeout(typingTimeoutRef.current);
+        setTyping((current) => (current === data.user_id ? null : current));
+      }
+    };
     const handleIncomingCall = (data) => {
       setCallData({ ...data, incoming: true });
       setShowCall(true);
     };
-    const handleOnline = (data) =>
-      setOnlineUsers((p) => new Set([...p, data.user_id]));
-    const handleOffline = (data) =>
+    // Batched presence changes of the user's contacts: { online: [...], offline: [...] }
+    const handlePresenceDiff = (data) =>
       setOnlineUsers((p) => {
         const newSet = new Set(p);
-        newSet.delete(data.user_id);
+        (data.online || []).forEach((id) => newSet.add(id));
+        (data.offline || []).forEach((id) => newSet.delete(id));
         return newSet;
       });
     const handleError = (data) => toast.error(data.message);
@@ -198,8 +205,8 @@ export const useChatSocket = ({
 
     socket.on("new_message", handleNewMessage);
     socket.on("user_typing", handleUserTyping);
-    socket.on("user_online", handleOnline);
-    socket.on("user_offline", handleOffline);
+    socket.on("user_stopped_typing", handleUserStoppedTyping);
+    socket.on("presence_diff", handlePresenceDiff);
     socket.on("incoming_call", handleIncomingCall);
     socket.on("error", handleError);
     socket.on("message_read", handleMessageRead);
@@ -213,8 +220,8 @@ export const useChatSocket = ({
     return () => {
       socket.off("new_message", handleNewMessage);
       socket.off("user_typing", handleUserTyping);
-      socket.off("user_online", handleOnline);
-      socket.off("user_offline", handleOffline);
+      socket.off("user_stopped_typing", handleUserStoppedTyping);
+      socket.off("presence_diff", handlePresenceDiff);
       socket.off("incoming_call", handleIncomingCall);
       socket.off("error", handleError);
       socket.off("message_read", handleMessageRead);
@@ -249,6 +249,8 @@ export default function Chat() {
 
 
   const downloadFile = async (dataUrl, fileName, messageId) => {
+    // Blob-store attachments have no source until they finish loading
+    if (!dataUrl) return;
     // If it's a blob/data URI we can just download it directly
     if (dataUrl.startsWith("data:") || dataUrl.startsWith("blob:")) {
       const link = document.createElement("a");
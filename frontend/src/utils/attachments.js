@@ -0,0 +1,42 @@
+import api from '@/utils/api';
+import { decryptBytes } from '@/utils/encryption';
+
+// Attachments in the server's blob store arrive as a `blob` hash instead of content.
+// The bytes are fetched with the session token (the server only serves them to
+// participants of a conversation that has the attachment), opened when they are an
+// E2EE box, and kept per hash so scrolling back through a chat does not refetch them.
+const MAX_CACHED = 100;
+const cache = new Map(); // hash -> Promise<src usable in <img>/<video>/<audio>>
+
+const evictOldest = () => {
+  while (cache.size > MAX_CACHED) {
+    const [hash, pending] = cache.entries().next().value;
+    cache.delete(hash);
+    pending.then((src) => src.startsWith('blob:') && URL.revokeObjectURL(src)).catch(() => {});
+  }
+};
+
+export const loadAttachment = (hash, isE2ee, myPrivateKey, theirPublicKey) => {
+  const cached = cache.get(hash);
+  if (cached) {
+    // Most recently used goes to the back of the eviction order
+    cache.delete(hash);
+    cache.set(hash, cached);
+    return cached;
+  }
+
+  const pending = api.get(`/blobs/${hash}`, { responseType: 'arraybuffer' }).then((res) => {
+    if (isE2ee) {
+      // The box holds the same data URI string the client would otherwise have sent inline
+      const src = decryptBytes(new Uint8Array(res.data), myPrivateKey, theirPublicKey);
+      if (src === null) throw new Error('Could not decrypt attachment');
+      return src;
+    }
+    const type = res.headers['content-type'] || 'application/octet-stream';
+    return URL.createObjectURL(new Blob([res.data], { type }));
+  });
+  pending.catch(() => cache.delete(hash));
+  cache.set(hash, pending);
+  evictOldest();
+  return pending;
+};
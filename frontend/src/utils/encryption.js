@@ -62,3 +62,22 @@ export const decryptMessage = (messageWithNonceBase64, myPrivateKeyBase64, their
     return messageWithNonceBase64;
   }
 };
+
+// Decrypt a NaCl box held as raw bytes (nonce + ciphertext), e.g. a downloaded attachment blob.
+// Returns null when the bytes do not open with these keys.
+export const decryptBytes = (messageWithNonce, myPrivateKeyBase64, theirPublicKeyBase64) => {
+  if (!myPrivateKeyBase64 || !theirPublicKeyBase64) return null;
+
+  try {
+    const nonce = messageWithNonce.slice(0, nacl.box.nonceLength);
+    const message = messageWithNonce.slice(nacl.box.nonceLength);
+
+    const mySecretKey = util.decodeBase64(myPrivateKeyBase64);
+    const theirPublicKey = util.decodeBase64(theirPublicKeyBase64);
+
+    const decrypted = nacl.box.open(message, nonce, theirPublicKey, mySecretKey);
+    return decrypted ? util.encodeUTF8(decrypted) : null;
+  } catch (e) {
+    return null;
+  }
+};